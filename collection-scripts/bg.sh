@@ -1,6 +1,17 @@
 #!/bin/bash
 
 CONCURRENCY=${CONCURRENCY:-5}
+# With the scheduler each class of tasks has its own concurrency (see the
+# --class option of run_bg), the one of the api tasks is tuned between 1 and
+# CONCURRENCY_API_MAX depending on the load of the API server
+CONCURRENCY_API=${CONCURRENCY_API:-$CONCURRENCY}
+CONCURRENCY_API_MAX=${CONCURRENCY_API_MAX:-$((CONCURRENCY_API * 4))}
+CONCURRENCY_LOGS=${CONCURRENCY_LOGS:-$CONCURRENCY}
+CONCURRENCY_EXEC=${CONCURRENCY_EXEC:-$CONCURRENCY}
+CONCURRENCY_NODE=${CONCURRENCY_NODE:-$CONCURRENCY}
+# Default timeout (in seconds, 0 for none) and retries of the background tasks
+BG_TIMEOUT=${BG_TIMEOUT:-0}
+BG_RETRIES=${BG_RETRIES:-0}
 
 # Function to run commands in background without exceeding $CONCURRENCY
 # processes in parallel.
@@ -14,31 +25,414 @@ CONCURRENCY=${CONCURRENCY:-5}
 #    run_bg sleep 10 '&&' echo hola
 #    run_bg echo hola '>' myfile.txt
 #
-# For now these methods ignore errors on the calls that are made in the
-# background.
+# When the scheduler is running (see sched_start) the tasks are queued and
+# run_bg returns immediately, and these options can be passed before the
+# command:
+#    --priority N   tasks with a higher priority are started first (default 0)
+#    --timeout S    kill the task after S seconds (default $BG_TIMEOUT)
+#    --retries N    run the task again up to N times if it fails
+#                   (default $BG_RETRIES)
+#    --after IDS    start the task when the tasks with these ids are done
+#    --class CLASS  pool of the task: api (oc calls to the API server), logs
+#                   (oc logs), exec (commands run in the pods) or node (SOS
+#                   reports, ssh); guessed from the command by default
+#    --slots N      slots of the pool the task holds, for commands running N
+#                   processes in parallel (default 1)
+# The id of the new task is stored in BG_TASK_ID, and can be passed to
+# wait_bg and --after:
+#    run_bg oc get pods '>' pods.log
+#    ids="$BG_TASK_ID"
+#    run_bg --after "$ids" grep Error pods.log '>' errors.log
+#
+# Between the calls to run_bg and wait_bg, the queued tasks are started by a
+# launcher process (see sched_release), so the slots that free up while the
+# shell runs foreground commands don't stay idle.
+#
+# Without the scheduler (e.g. when called from a subshell) the options are
+# ignored, except --after, and BG_TASK_ID is the PID of the new process.
+# When TRACE_FILE is set the start and end times, exit status and output size
+# of the tasks are recorded there (see trace_task).
 
 function run_bg {
+    local priority=0 timeout="${BG_TIMEOUT}" retries="${BG_RETRIES}" after=""
+    local class="-" slots=1
+    while [[ "$1" == --* ]]; do
+        case "$1" in
+            --priority) priority="$2" ;;
+            --class) class="$2" ;;
+            --slots) slots="$2" ;;
+            --timeout) timeout="$2" ;;
+            --retries) retries="$2" ;;
+            --after) after="$2" ;;
+            *) break ;;
+        esac
+        shift 2
+    done
+
+    BG_OUTPUT=""
+    if [[ -n "${TRACE_FILE}" ]]; then
+        bg_output "$@"
+    fi
+
+    if sched_active && sched_reclaim; then
+        SCHED_SEQ=$((SCHED_SEQ + 1))
+        BG_TASK_ID=${SCHED_SEQ}
+        SCHED_TASKS[${BG_TASK_ID}]="$*"
+        SCHED_OUTPUTS[${BG_TASK_ID}]="${BG_OUTPUT}"
+        SCHED_PHASES[${BG_TASK_ID}]="${TRACE_PHASE}"
+        local name="$*"
+        name=${name//$'\n'/ }
+        after="${after// /,}"
+        printf 'task %s %s %s %s %s %s %s %s\n' "${BG_TASK_ID}" "${priority}" \
+            "${timeout}" "${retries}" "${after:--}" "${class}" "${slots}" \
+            "${name:0:512}" >&"${SCHED_REQ_FD}"
+        # if the scheduler is gone the task is started right away below
+        if sched_sync "${BG_TASK_ID}"; then
+            sched_release "${SCHED_VALUE}"
+            return 0
+        fi
+    fi
+
+    if [[ -n "$after" ]]; then
+        # shellcheck disable=SC2086
+        wait_bg $after
+    fi
     while [[ $(jobs -r | wc -l) -ge $CONCURRENCY ]]; do
         wait -n
     done
 
-    # Cannot use the alternative suggested by SC2294 which is just "$@"&
-    # because that doesn't accomplish what we want, as it executes the first
-    # element as the command and the rest as its parameters, so it cannot run
-    # multiple commands, use pipes, redirect...
+    if [[ -n "${TRACE_FILE}" ]]; then
+        trace_task "${BG_OUTPUT}" "$@"&
+    else
+        # Cannot use the alternative suggested by SC2294 which is just "$@"&
+        # because that doesn't accomplish what we want, as it executes the
+        # first element as the command and the rest as its parameters, so it
+        # cannot run multiple commands, use pipes, redirect...
+        # shellcheck disable=SC2294
+        eval "$@"&
+    fi
+    BG_TASK_ID=$!
+    return 0
+}
+
+
+# Set BG_OUTPUT to the file the stdout of a run_bg command is redirected to,
+# or piped to GZWRITE_BIN (see OUTPUT_TO in common.sh)
+function bg_output {
+    local prev=""
+    for arg in "$@"; do
+        if [[ "$prev" == ">" ]] || [[ "$prev" == ">>" ]] || \
+           [[ -n "${GZWRITE_BIN}" && "$prev" == "${GZWRITE_BIN}" ]]; then
+            BG_OUTPUT="$arg"
+        fi
+        prev="$arg"
+    done
+}
+
+
+# Start the scheduler of the background tasks (pyscripts/bgsched.py): from
+# now on run_bg queues the tasks, and the scheduler tells when to start them.
+# The tasks exchange messages with the scheduler through two FIFOs, kept open
+# in SCHED_REQ_FD and SCHED_GRANT_FD, in the SCHED_DIR directory, which is
+# removed by the scheduler when it ends. The PIDs of the started tasks are
+# listed in SCHED_PIDS, to wait for them if the scheduler dies.
+# Set BG_SCHEDULER=0 to keep using the bash only implementation.
+function sched_start {
+    local status="$1" owner="${BASHPID}" dir reply
+    # SCHED_BIN is set in common.sh
+    # shellcheck disable=SC2153
+    if [[ "${BG_SCHEDULER:-1}" != 1 ]] || [[ ! -x "${SCHED_BIN}" ]] || sched_active; then
+        return 1
+    fi
+    dir=$(mktemp -d) || return 1
+    if ! mkfifo "${dir}/req" "${dir}/grant"; then
+        rm -rf "${dir}"
+        return 1
+    fi
+    "${SCHED_BIN}" --concurrency "${CONCURRENCY}" --owner "${owner}" \
+        --pool "api=${CONCURRENCY_API}:${CONCURRENCY_API_MAX}" \
+        --pool "logs=${CONCURRENCY_LOGS}" --pool "exec=${CONCURRENCY_EXEC}" \
+        --pool "node=${CONCURRENCY_NODE}" --errors "${dir}" \
+        ${status:+--status "${status}"} "${dir}/req" "${dir}/grant" &
+    SCHED_PID=$!
+    # Opening the FIFOs in read-write mode doesn't block if the scheduler
+    # fails to start
+    exec {SCHED_REQ_FD}<>"${dir}/req" {SCHED_GRANT_FD}<>"${dir}/grant"
+    if ! read -r -t 30 -u "${SCHED_GRANT_FD}" reply || [[ "$reply" != ready ]]; then
+        echo "Cannot start the scheduler, running the tasks without it"
+        sched_close
+        kill "${SCHED_PID}" 2>/dev/null
+        rm -rf "${dir}"
+        return 1
+    fi
+    SCHED_DIR="${dir}"
+    SCHED_PIDS=$(mktemp)
+    SCHED_OWNER=${BASHPID}
+    SCHED_SEQ=0
+    SCHED_WAITS=0
+    SCHED_LAUNCHER=""
+    declare -gA SCHED_TASKS=() SCHED_OUTPUTS=() SCHED_PHASES=()
+}
+
+
+# Stop the scheduler once the queued tasks are done, it prints a summary of
+# the tasks that failed
+function sched_stop {
+    sched_active || return 0
+    wait_bg
+    if sched_active; then
+        printf 'quit\n' >&"${SCHED_REQ_FD}"
+        sched_close
+        rm -f "${SCHED_PIDS}"
+        SCHED_PIDS=""
+    fi
+    wait "${SCHED_PID}" 2>/dev/null
+}
+
+
+function sched_close {
+    exec {SCHED_REQ_FD}>&- {SCHED_GRANT_FD}<&-
+    SCHED_REQ_FD=""
+    SCHED_GRANT_FD=""
+}
+
+
+# Whether run_bg and wait_bg go through the scheduler: only the shell that
+# started it can, as it's the one keeping the queued commands
+function sched_active {
+    [[ -n "${SCHED_REQ_FD}" ]] && [[ "${BASHPID}" == "${SCHED_OWNER}" ]]
+}
+
+
+# Wait for the scheduler to queue a task, starting the tasks it asks for in
+# the meantime (including the new one, if there's a free slot)
+function sched_sync {
+    while sched_read; do
+        if [[ "${SCHED_OP}" == run ]]; then
+            sched_launch "${SCHED_ARG}" "${SCHED_VALUE}"
+        elif [[ "${SCHED_OP}" == queued ]] && [[ "${SCHED_ARG}" == "$1" ]]; then
+            return 0
+        fi
+    done
+    return 1
+}
+
+
+# Read a message from the scheduler in SCHED_OP, SCHED_ARG, SCHED_VALUE and
+# SCHED_WAITING. If the scheduler is gone it's not used anymore, and 1 is
+# returned.
+function sched_read {
+    while ! read -r -t 60 -u "${SCHED_GRANT_FD}" SCHED_OP SCHED_ARG SCHED_VALUE SCHED_WAITING; do
+        # the read timed out, check the scheduler is still there
+        kill -0 "${SCHED_PID}" 2>/dev/null && continue
+        echo "The scheduler is gone, running the tasks without it"
+        sched_close
+        return 1
+    done
+    return 0
+}
+
+
+# Hand the reading of the run messages over to a launcher process while the
+# shell does something else, if some of the tasks are not started yet. The
+# launcher is forked now, so it knows the commands of all the queued tasks,
+# and it ends when the shell takes the FIFO back with sched_reclaim, which
+# run_bg and wait_bg do first. The tasks it started are not children of the
+# shell: if the scheduler dies, wait_bg waits for them with
+# sched_wait_launched.
+#    sched_release <waiting tasks>
+function sched_release {
+    [[ "$1" -gt 0 ]] || return 0
+    (
+        while sched_read; do
+            if [[ "${SCHED_OP}" == run ]]; then
+                sched_launch "${SCHED_ARG}" "${SCHED_VALUE}"
+            elif [[ "${SCHED_OP}" == pause ]]; then
+                exit 0
+            fi
+        done
+        # the scheduler is gone
+        wait
+        exit 1
+    )&
+    SCHED_LAUNCHER=$!
+}
+
+
+# Stop the launcher, once it has started the tasks granted until now. If the
+# scheduler is gone it's not used anymore, and 1 is returned.
+function sched_reclaim {
+    local pid="${SCHED_LAUNCHER}"
+    [[ -n "${pid}" ]] || return 0
+    SCHED_LAUNCHER=""
+    printf 'pause\n' >&"${SCHED_REQ_FD}"
+    if ! kill -0 "${SCHED_PID}" 2>/dev/null; then
+        # the launcher would only notice it when its read times out
+        echo "The scheduler is gone, running the tasks without it"
+        kill "${pid}" 2>/dev/null
+    fi
+    wait "${pid}" && return 0
+    sched_close
+    return 1
+}
+
+
+# Wait for the tasks started through the scheduler once it's gone, those
+# started by the launchers included: they are not children of the shell,
+# so their PIDs are polled.
+function sched_wait_launched {
+    local pid
+    [[ -n "${SCHED_PIDS}" ]] && [[ "${BASHPID}" == "${SCHED_OWNER}" ]] || return 0
+    # reap the children of the shell first, their PIDs could be reused
+    wait
+    while read -r pid; do
+        while kill -0 "${pid}" 2>/dev/null; do
+            sleep 0.2
+        done
+    done < "${SCHED_PIDS}"
+    rm -f "${SCHED_PIDS}"
+    SCHED_PIDS=""
+}
+
+
+# Start a task of the given class, reporting its PID and exit status to the
+# scheduler. The FIFOs are closed for the command, so the processes it leaves
+# behind don't keep them open. The stderr of the api tasks goes to the
+# scheduler, which looks for the errors of an overloaded API server.
+#    sched_launch <id> <class>
+function sched_launch {
+    local id="$1"
+    (
+        printf 'start %s %s\n' "${id}" "${BASHPID}" >&"${SCHED_REQ_FD}"
+        if [[ "$2" == api ]]; then
+            exec 2>"${SCHED_DIR}/${id}.err"
+        fi
+        # report the failure of any command of a pipeline, so that e.g. an
+        # oc call piped to cmaps.py can be retried
+        set -o pipefail
+        if [[ -n "${TRACE_FILE}" ]]; then
+            # the task is recorded in the phase it was queued in
+            TRACE_PHASE="${SCHED_PHASES[${id}]}" \
+                trace_task "${SCHED_OUTPUTS[${id}]}" "${SCHED_TASKS[${id}]}"
+        else
+            # shellcheck disable=SC2294
+            eval "${SCHED_TASKS[${id}]}"
+        fi {SCHED_REQ_FD}>&- {SCHED_GRANT_FD}<&-
+        printf 'exit %s %s\n' "${id}" "$?" >&"${SCHED_REQ_FD}"
+    )&
+    printf '%s\n' "$!" >>"${SCHED_PIDS}"
+    # Let bash forget about the finished tasks, its job table would
+    # otherwise grow with every task and slow down each new one
+    jobs -n >/dev/null
+}
+
+
+# Current time in seconds since the epoch, with microseconds
+function trace_now {
+    local now="${EPOCHREALTIME:-$(date +%s.%N)}"
+    echo "${now/,/.}"
+}
+
+
+# Escape a string to be used as a JSON string value
+function trace_escape {
+    local s="$1"
+    s=${s//\\/\\\\}
+    s=${s//\"/\\\"}
+    s=${s//$'\n'/\\n}
+    s=${s//$'\t'/\\t}
+    s=${s//$'\r'/\\r}
+    echo "$s"
+}
+
+
+# Append a record to TRACE_FILE as a JSON line:
+#    trace_record <type> <name> <start> <end> <status> [<output>]
+# A single write is used for each line, so concurrent tasks can append to
+# the same file.
+function trace_record {
+    local type="$1" name="$2" start="$3" end="$4" status="$5" output="$6"
+    local size=null
+    if [[ -n "$output" ]] && [[ ! -f "$output" ]] && [[ -f "${output}.gz" ]]; then
+        output="${output}.gz"
+    fi
+    if [[ -n "$output" ]] && [[ -f "$output" ]]; then
+        size=$(stat -c %s "$output" 2>/dev/null || echo null)
+    fi
+    printf '{"type":"%s","name":"%s","phase":"%s","start":%s,"end":%s,"status":%s,"output":"%s","bytes":%s,"pid":%s}\n' \
+        "$type" "$(trace_escape "$name")" "$(trace_escape "${TRACE_PHASE}")" \
+        "$start" "$end" "$status" "$(trace_escape "$output")" "$size" \
+        "${BASHPID}" >> "${TRACE_FILE}"
+}
+
+
+# Run a run_bg command recording it in TRACE_FILE, output being the file
+# its stdout is redirected to, if any.
+#    trace_task <output> <command>...
+function trace_task {
+    local start rc output="$1"
+    shift
+    start=$(trace_now)
     # shellcheck disable=SC2294
-    eval "$@"&
-    # Return the new process' PID
-    return $!
+    eval "$@"
+    rc=$?
+    trace_record task "$*" "$start" "$(trace_now)" "$rc" "$output"
+    return $rc
+}
+
+
+# Run a gathering phase (usually the sourcing of a gather_* script, or a
+# function) recording its duration in TRACE_FILE. The run_bg tasks started
+# during the phase are associated with it.
+#    trace_phase gather_sos source "${DIR_NAME}/gather_sos"
+function trace_phase {
+    local name="$1"
+    shift
+    if [[ -z "${TRACE_FILE}" ]]; then
+        "$@"
+        return $?
+    fi
+    local start rc prev_phase="${TRACE_PHASE}"
+    start=$(trace_now)
+    TRACE_PHASE="$name"
+    "$@"
+    rc=$?
+    TRACE_PHASE="${prev_phase}"
+    trace_record phase "$name" "$start" "$(trace_now)" "$rc"
+    return $rc
 }
 
 
-# Waits for all background tasks to complete or just for a list of PIDs
-# Disable SC2120 in this to prevent SC2119 when called without the optional PIDs
+# Waits for all background tasks to complete or just for a list of task ids
+# (BG_TASK_ID). With the scheduler it starts the queued tasks while waiting,
+# and returns 1 if any of the tasks failed.
+# Disable SC2120 in this to prevent SC2119 when called without the optional IDs
 # shellcheck disable=SC2120
 function wait_bg {
+    if sched_active; then
+        local token ids="$*" failed
+        SCHED_WAITS=$((SCHED_WAITS + 1))
+        token="w${SCHED_WAITS}"
+        sched_reclaim && printf 'wait %s %s\n' "${token}" "${ids// /,}" >&"${SCHED_REQ_FD}"
+        while sched_active && sched_read; do
+            if [[ "${SCHED_OP}" == run ]]; then
+                sched_launch "${SCHED_ARG}" "${SCHED_VALUE}"
+            elif [[ "${SCHED_OP}" == "done" ]] && [[ "${SCHED_ARG}" == "${token}" ]]; then
+                failed="${SCHED_VALUE}"
+                sched_release "${SCHED_WAITING}"
+                [[ "${failed}" -eq 0 ]]
+                return $?
+            fi
+        done
+        # the scheduler is gone, wait for the running tasks
+        sched_wait_launched
+        wait
+        return 1
+    fi
     # When we receive a list of PIDs those may be already finished, and we'll
     # get an error complaining those are not children
     wait -f "$@" 2>/dev/null
+    # the tasks started before the scheduler died
+    [[ $# -eq 0 ]] && sched_wait_launched
     return 0
 }
@@ -34,6 +34,187 @@ export DEFAULT_NAMESPACES
 NAMESPACE_PATH=${BASE_COLLECTION_PATH}/namespaces
 export NAMESPACE_PATH
 
+# Files already masked by a mask.py pass are recorded in this manifest, so
+# later passes over the same tree can skip them. It's excluded from the
+# final archive.
+MASK_MANIFEST=${BASE_COLLECTION_PATH}/.mask_manifest.jsonl
+export MASK_MANIFEST
+
+# The cluster facts looked up by several scripts (CRDs, namespaces, pods,
+# OpenStack services) are stored in this directory by the cached function,
+# and reused until they are older than DISCOVERY_CACHE_TTL seconds. An empty
+# value disables the cache. It's excluded from the final archive.
+DISCOVERY_CACHE=${DISCOVERY_CACHE-${BASE_COLLECTION_PATH}/.discovery_cache}
+DISCOVERY_CACHE_TTL=${DISCOVERY_CACHE_TTL:-600}
+export DISCOVERY_CACHE DISCOVERY_CACHE_TTL
+[[ -n "${DISCOVERY_CACHE}" ]] && mkdir -p "${DISCOVERY_CACHE}"
+
+# The phases of the gathering and the tasks run in background (run_bg) are
+# recorded in this trace, one JSON record per line, to be analyzed with
+# pyscripts/trace_report.py. An empty value disables the tracing.
+TRACE_FILE=${TRACE_FILE-${BASE_COLLECTION_PATH}/trace.jsonl}
+export TRACE_FILE
+[[ -n "${TRACE_FILE}" ]] && mkdir -p "$(dirname "${TRACE_FILE}")"
+
+# The background tasks are queued to the scheduler (see run_bg in bg.sh),
+# which records their exit status in BG_STATUS_FILE
+SCHED_BIN=${SCHED_BIN:-/usr/bin/bgsched.py}
+BG_STATUS_FILE=${BG_STATUS_FILE-${BASE_COLLECTION_PATH}/bg-tasks.jsonl}
+[[ -n "${BG_STATUS_FILE}" ]] && mkdir -p "$(dirname "${BG_STATUS_FILE}")"
+sched_start "${BG_STATUS_FILE}"
+
+# The resources are read with the API client (pyscripts/kubeapi.py), which
+# keeps its connections to the API server open, instead of an oc process per
+# request, when the API server can be reached with the service account of the
+# pod. Set KUBEAPI=0 to always use oc.
+KUBEAPI_BIN=${KUBEAPI_BIN:-/usr/bin/kubeapi.py}
+if [[ -z "${KUBEAPI}" ]]; then
+    KUBEAPI=0
+    "${KUBEAPI_BIN}" --request-timeout 10 version &>/dev/null && KUBEAPI=1
+    export KUBEAPI
+fi
+
+# The logs of the pods are planned by pyscripts/logplan.py. Each log can be
+# capped in size (LOG_LIMIT_BYTES) and the current ones restricted to a time
+# window (LOG_SINCE), the total size of the logs of a namespace shared among
+# its containers (LOG_BUDGET), favouring the crashing ones. Empty values
+# gather whole logs.
+LOGPLAN_BIN=${LOGPLAN_BIN:-/usr/bin/logplan.py}
+export LOG_LIMIT_BYTES="${LOG_LIMIT_BYTES-}"
+export LOG_SINCE="${LOG_SINCE-}"
+export LOG_BUDGET="${LOG_BUDGET-}"
+
+# The large text artifacts (pod logs, events) are compressed with gzip
+# while they are written when COMPRESS_ARTIFACTS=1, by piping them
+# to pyscripts/gzwrite.py, which saves them as <file>.gz unless they are
+# small. compress then bundles them as they are. The commands writing them
+# end with "${OUTPUT_TO[@]}" <file> instead of '>' <file>.
+GZWRITE_BIN=${GZWRITE_BIN:-/usr/bin/gzwrite.py}
+export COMPRESS_ARTIFACTS=${COMPRESS_ARTIFACTS:-0}
+# OUTPUT_TO is used by the gather scripts sourcing this file
+# shellcheck disable=SC2034
+if [[ "${COMPRESS_ARTIFACTS}" -eq 1 ]]; then
+    OUTPUT_TO=('|' "${GZWRITE_BIN}")
+else
+    OUTPUT_TO=('>')
+fi
+
+# The archive made by compress is a single XZ stream (tar, the default), or
+# independent XZ blocks compressed on ARCHIVE_JOBS cores (0 for all of them)
+# with a catalog of the members (indexed), read with pyscripts/mgarchive.py.
+MGARCHIVE_BIN=${MGARCHIVE_BIN:-/usr/bin/mgarchive.py}
+export ARCHIVE_FORMAT=${ARCHIVE_FORMAT:-tar}
+export ARCHIVE_JOBS=${ARCHIVE_JOBS:-0}
+
+# The duplicated files of the collection (e.g. the secrets matching several
+# services, the CRs captured twice) are replaced with hardlinks before the
+# archive is made, by pyscripts/dedup.py. Set DEDUP=0 to keep them.
+DEDUP_BIN=${DEDUP_BIN:-/usr/bin/dedup.py}
+export DEDUP=${DEDUP:-1}
+
+# The openstack commands of gather_services_status are run in a single
+# openstackclient session by pyscripts/osbatch.py, each of them stopped
+# after OSC_TIMEOUT seconds. Set OSC_BATCH=0 to run them one by one with
+# oc rsh.
+OSBATCH_BIN=${OSBATCH_BIN:-/usr/bin/osbatch.py}
+export OSC_BATCH=${OSC_BATCH:-1}
+export OSC_TIMEOUT=${OSC_TIMEOUT:-120}
+
+# The openstack outputs are gathered as tables (table, the default), as JSON
+# in <file>.json (json) or both. pyscripts/ctlsummary.py indexes them, from
+# the JSON when there is some, in ctlplane/summary.json.
+CTLSUMMARY_BIN=${CTLSUMMARY_BIN:-/usr/bin/ctlsummary.py}
+export OSC_FORMAT=${OSC_FORMAT:-table}
+
+# The databases are dumped by pyscripts/dbdump.py, DB_JOBS at a time, and
+# always compressed while they are written, as they are the largest
+# artifacts, at DB_COMPRESS_LEVEL (gzip level, 1 by default so that the
+# compression of the largest dumps keeps up with mysqldump).
+DBDUMP_BIN=${DBDUMP_BIN:-/usr/bin/dbdump.py}
+export DB_JOBS=${DB_JOBS:-4}
+export DB_COMPRESS_LEVEL=${DB_COMPRESS_LEVEL:-1}
+
+# Run the API client, sharing the discovery of the resource types through
+# the discovery cache
+function kubeapi {
+    "${KUBEAPI_BIN}" ${DISCOVERY_CACHE:+--cache-dir "${DISCOVERY_CACHE}"} \
+        --cache-ttl "${DISCOVERY_CACHE_TTL}" "$@"
+}
+
+# Run a command, or print the output it had when it was run with the same
+# key and return its status, if it's in the discovery cache and has not
+# expired. Failures are only cached with --failures (e.g. for a namespace
+# that doesn't exist).
+#    cached [--failures] <key> <command...>
+function cached {
+    local failures=0 key file now status stamp tmp
+    if [[ "$1" == --failures ]]; then
+        failures=1
+        shift
+    fi
+    key="${1//[^[:alnum:]._=,-]/_}"
+    shift
+    if [[ -z "${DISCOVERY_CACHE}" ]]; then
+        "$@"
+        return
+    fi
+    file="${DISCOVERY_CACHE}/${key}"
+    printf -v now '%(%s)T' -1
+    if [[ -r "${file}" ]]; then
+        {
+            read -r status stamp
+            if (( now - stamp < DISCOVERY_CACHE_TTL )); then
+                cat
+                return "${status}"
+            fi
+        } < "${file}"
+    fi
+    tmp="${file}.${BASHPID}"
+    "$@" > "${tmp}"
+    status=$?
+    cat "${tmp}"
+    if [[ ${status} -eq 0 ]] || [[ ${failures} -eq 1 ]]; then
+        { printf '%s %s\n' "${status}" "${now}"; cat "${tmp}"; } > "${tmp}.new"
+        mv -f "${tmp}.new" "${file}"
+    fi
+    rm -f "${tmp}"
+    return "${status}"
+}
+
+# Drop the entries of the discovery cache, all of them or the ones whose key
+# starts with one of the given prefixes, so that they are looked up again,
+# e.g. after a phase changing the cluster during a long run:
+#    discovery_invalidate pods_openstack
+function discovery_invalidate {
+    [[ -z "${DISCOVERY_CACHE}" ]] && return
+    if [[ $# -eq 0 ]]; then
+        rm -f "${DISCOVERY_CACHE}"/*
+        return
+    fi
+    local prefix
+    for prefix in "$@"; do
+        rm -f "${DISCOVERY_CACHE}/${prefix//[^[:alnum:]._=,-]/_}"*
+    done
+}
+
+# Names of the CRDs of the cluster
+function get_crds {
+    cached crds /usr/bin/oc get crd -o custom-columns=NAME:.metadata.name --no-headers
+}
+
+# Pods of a namespace matching a label selector, one per line, with the
+# given custom columns (default: the name of the pod)
+#    get_pods <namespace> <selector> [columns]
+function get_pods {
+    local columns="${3:-NAME:.metadata.name}"
+    cached "pods_$1_$2_${columns}" /usr/bin/oc -n "$1" get pods -l "$2" -o custom-columns="${columns}" --no-headers
+}
+
+# Names of the services in the OpenStack catalog, one per line
+function get_osp_services {
+    cached osp_services /usr/bin/oc -n "${OSP_NS}" exec openstackclient -- openstack service list -c Name -f value
+}
+
 # k8s services that must be gather from the openstack
 # ctlplane namespace
 declare resources=(
@@ -61,7 +242,7 @@ export resources
 # Adding grafana.com, observability.openshift.io and logging.openshift.io
 # because of resources used by telemetry logging.
 get_matching_crds() {
-    /usr/bin/oc get crd | awk '/(openstack|rabbitmq|monitoring|grafana|observability\.openshift|logging\.openshift|nmstate|metallb|k8s\.cni\.cncf)\.(org|com|rhobs|io)/ {print $1}'
+    get_crds | awk '/(openstack|rabbitmq|monitoring|grafana|observability\.openshift|logging\.openshift|nmstate|metallb|k8s\.cni\.cncf)\.(org|com|rhobs|io)/ {print $1}'
 }
 
 # list of osp services that might be present in the ctlplane
@@ -97,14 +278,30 @@ declare -a OSP_SERVICES=(
 export OSP_SERVICES
 
 
+# Replace the duplicated files of the collection with hardlinks, so they are
+# archived once, and report the space saved.
+function dedup_files {
+    [[ "${DEDUP}" -eq 1 ]] || return 0
+    "${DEDUP_BIN}" \
+        --exclude='must-gather.tar*' \
+        --exclude='must-gather.catalog.jsonl' \
+        --exclude='.mask_manifest.jsonl' \
+        --exclude='.discovery_cache' \
+        "${BASE_COLLECTION_PATH}" || true
+}
+
 # Archive the collected data into a single downloadable file.
 # When SOS_DECOMPRESS=0, SOS reports are kept as .tar.xz archives and
 # recompressing them with XZ produces no size reduction while adding
 # significant time. In that case, non-SOS data is compressed separately
 # into an intermediate XZ archive, then bundled with the already-compressed
-# SOS files into a plain tar.
-# Otherwise (SOS_DECOMPRESS=1 or no SOS reports), a single XZ pass over
-# everything is used.
+# SOS files into a plain tar. The same is done for the artifacts compressed
+# while they were written (the database dumps, and the logs and events with
+# COMPRESS_ARTIFACTS=1).
+# Otherwise (SOS_DECOMPRESS=1 or no SOS reports, and no compressed
+# artifacts), a single XZ pass over everything is used.
+# With ARCHIVE_FORMAT=indexed, everything goes in a tar.xz archive made of
+# independent blocks, with a catalog of its members (see mgarchive.py).
 function compress {
     # The path to store the compressed result
     local compressed_path=${COMPRESSED_PATH:-"${BASE_COLLECTION_PATH}"}
@@ -113,28 +310,61 @@ function compress {
     local delete_after=${DELETE_AFTER_COMPRESSION:-0}
     local archive
 
+    # Already compressed data is bundled as it is: the SOS reports when
+    # they are not decompressed, and the artifacts compressed while they
+    # were written
+    local -a bundled=()
+    local compressed_list=""
     if [[ ${SOS_DECOMPRESS} -eq 0 ]] && \
        [[ -n "$(find "${SOS_PATH}" -type f 2>/dev/null | head -1)" ]]; then
+        bundled+=("${SOS_PATH}")
+    fi
+    compressed_list=$(mktemp)
+    find "${BASE_COLLECTION_PATH}" -path "${SOS_PATH}" -prune -o \
+        -type f -name '*.gz' -print > "${compressed_list}"
+    if [[ -s "${compressed_list}" ]]; then
+        bundled+=(-T "${compressed_list}")
+    fi
+
+    if [[ "${ARCHIVE_FORMAT}" == indexed ]]; then
+        archive="${compressed_path}/must-gather.tar.xz"
+
+        # Compress the tar stream in independent blocks on several cores,
+        # listing the members in must-gather.catalog.jsonl, so that single
+        # members can be read with mgarchive.py without decompressing the
+        # whole archive.
+        "${MGARCHIVE_BIN}" create \
+            --jobs "${ARCHIVE_JOBS}" \
+            --exclude='must-gather.tar*' \
+            --exclude='must-gather.catalog.jsonl' \
+            --exclude='.mask_manifest.jsonl' \
+            --exclude='.discovery_cache' \
+            "${archive}" "${BASE_COLLECTION_PATH}" || true
+    elif [[ ${#bundled[@]} -gt 0 ]]; then
         archive="${compressed_path}/must-gather.tar"
         local rhoso_archive="${compressed_path}/rhoso-data.tar.xz"
 
-        # Compress only non-SOS data (CRDs, CMs, logs, DB dumps) into an
-        # intermediate XZ archive, excluding the SOS directory entirely.
+        # Compress only the rest of the data (CRDs, CMs, logs, DB dumps) into
+        # an intermediate XZ archive, excluding the SOS directory entirely
+        # and the compressed artifacts, listed by their full path.
         tar \
             --exclude='must-gather.tar' \
             --exclude='rhoso-data.tar.xz' \
             --exclude='sos-reports' \
+            --exclude='.mask_manifest.jsonl' \
+            --exclude='.discovery_cache' \
+            ${compressed_list:+--no-wildcards --anchored -X "${compressed_list}"} \
             --warning=no-file-changed --ignore-failed \
             -cJf \
             "${rhoso_archive}" "${BASE_COLLECTION_PATH}" || true
 
-        # Bundle the intermediate archive with the SOS reports into a plain
-        # tar (no compression) so already-compressed SOS data is not re-processed.
+        # Bundle the intermediate archive with the compressed data into a
+        # plain tar (no compression) so it's not re-processed.
         tar \
             --exclude='must-gather.tar' \
             --warning=no-file-changed --ignore-failed \
             -cf \
-            "${archive}" "${rhoso_archive}" "${SOS_PATH}" || true
+            "${archive}" "${rhoso_archive}" "${bundled[@]}" || true
 
         rm -f "${rhoso_archive}"
     else
@@ -142,10 +372,13 @@ function compress {
 
         tar \
             --exclude='must-gather.tar.xz' \
+            --exclude='.mask_manifest.jsonl' \
+            --exclude='.discovery_cache' \
             --warning=no-file-changed --ignore-failed \
             -cJf \
             "${archive}" "${BASE_COLLECTION_PATH}" || true
     fi
+    [[ -n "${compressed_list}" ]] && rm -f "${compressed_list}"
 
     echo "The ${archive} now can be attached to the support case."
 
@@ -153,6 +386,7 @@ function compress {
         find "${BASE_COLLECTION_PATH}" \
             -mindepth 1 \
             -not -path "*must-gather.tar*" \
+            -not -path "*must-gather.catalog.jsonl" \
             -delete
     fi
 }
@@ -163,25 +397,51 @@ export WEBHOOKS_COLLECTION_PATH
 NODES_COLLECTION_PATH=${BASE_COLLECTION_PATH}/nodes
 export NODES_COLLECTION_PATH
 
-# if a namespace doesn't exist, we don't gather resources
+# if a namespace doesn't exist, we don't gather resources. The namespaces
+# are checked by several scripts, the result is cached.
 function check_namespace {
+    cached --failures "namespace_$1" lookup_namespace "$1"
+}
+
+function lookup_namespace {
     local namespace="$1"
+    if [[ "${KUBEAPI}" -eq 1 ]]; then
+        kubeapi get namespaces "$namespace" -o /dev/null 2>/dev/null
+        return
+    fi
     if /usr/bin/oc get project "$namespace" > /dev/null 2>&1; then
         return 0
     fi
     return 1
 }
 
+# Get all the objects of a kind, in a namespace or in all of them (-A), and
+# save them in one file per object in output_dir, passing the other options
+# to cmaps.py. The objects are read by the API client when available, and
+# by oc otherwise.
+#    get_split <namespace|-A> <resource> <output_dir> [cmaps.py options]
+function get_split {
+    local ns="$1" resource="$2" output_dir="$3"
+    local scope=(-n "$ns")
+    shift 3
+    [[ "$ns" == -A ]] && scope=(--all-namespaces)
+    if [[ "${KUBEAPI}" -eq 1 ]]; then
+        kubeapi split "${scope[@]}" "$resource" "$output_dir" "$@"
+    else
+        /usr/bin/oc "${scope[@]}" get "$resource" -o yaml | /usr/bin/cmaps.py - "$output_dir" "$@"
+    fi
+}
+
 # for each resource passed as input, we gather the related
 # info in a dedicated directory within the namespace tree
 function get_resources {
     local resource="$1"
     local NS="$2"
     mkdir -p "${NAMESPACE_PATH}"/"$NS"/"$resource"
-    for res in $(oc -n "$NS" get "$resource" -o custom-columns=":metadata.name"); do
-        echo "Dump $resource: $res";
-        run_bg /usr/bin/oc -n "$NS" get "$resource" "$res" -o yaml '>' "${NAMESPACE_PATH}/${NS}/${resource}/${res}.yaml"
-    done
+    echo "Dump $resource in namespace $NS"
+    # Retrieve all the resources with a single call and split the
+    # resulting List in one file per resource
+    run_bg --retries 2 get_split "$NS" "$resource" "${NAMESPACE_PATH}/${NS}/${resource}"
 }
 
 function expand_ns {
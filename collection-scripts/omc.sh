@@ -131,17 +131,22 @@ function collect_backup_restore_omc {
 # Post processing actions on gathered files
 function collect_omc_post {
     local CMS="core/configmaps.yaml"
-    local MASK_OPT=""
-    [[ "${DO_NOT_MASK}" -eq 0 ]] && MASK_OPT="--mask"
+    local split_opts=()
+    local pairs=()
+    [[ "${DO_NOT_MASK}" -eq 0 ]] && split_opts=(--mask)
     for ns in "${DEFAULT_NAMESPACES[@]}"; do
         if check_namespace "$ns"; then
             mkdir -p "$NAMESPACE_PATH/${ns}/configmaps"
-            # Split ConfigMapList and apply masking if required
-            /usr/bin/cmaps.py "${NAMESPACE_PATH}/${ns}/$CMS" "${NAMESPACE_PATH}/${ns}/configmaps" "$MASK_OPT"
+            pairs+=("${NAMESPACE_PATH}/${ns}/$CMS" "${NAMESPACE_PATH}/${ns}/configmaps")
             # Provide a better view of the namespace resources
             run_bg /usr/bin/oc -n "${ns}" get all '>' "${NAMESPACE_PATH}/${ns}/all_resources.log"
         fi
     done
+    # Split the ConfigMapLists of all the namespaces with a single process
+    # pool, and apply masking if required
+    if [[ ${#pairs[@]} -gt 0 ]]; then
+        /usr/bin/cmaps.py --kind ConfigMapList "${split_opts[@]}" "${pairs[@]}"
+    fi
 }
 
 # Main OMC resource gathering
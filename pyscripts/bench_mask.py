@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark suite for mask.py, cmaps.py and sqlmask.py: measure files/sec,
+MB/sec and peak RSS of SecretMask, PlaintextMask, mask_resource,
+split_configmaps and of the masking of a database dump on a synthetic
+corpus (see gen_corpus.py), and store the results as JSON so that runs can
+be compared over time. The dump is only generated with --dump-size.
+Each benchmark runs in a fresh interpreter, so that the peak RSS is not
+affected by the other benchmarks.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+from cmaps import ListReader, split_configmaps
+from gen_corpus import gen_corpus
+from mask import MASK_VERSION, PlaintextMask, SecretMask, mask_resource
+from sqlmask import SqlMask
+
+
+def run_secret_mask(paths):
+    for path in paths:
+        SecretMask(path, True).mask()
+
+
+def run_plaintext_mask(paths):
+    for path in paths:
+        PlaintextMask(path).mask()
+
+
+def run_mask_resource(paths):
+    for path in paths:
+        mask_resource(path, True)
+
+
+def run_split_configmaps(paths):
+    for path in paths:
+        split_configmaps(path, path + ".d", apply_mask=True)
+
+
+def run_sqlmask(paths):
+    for path in paths:
+        with open(path, 'rb') as src, open(path + ".masked", 'wb') as dest:
+            dest.writelines(SqlMask().stream(src))
+
+
+def input_stats(corpus, entries, items):
+    """
+    Return the number of files (or List items) and bytes processed by a
+    benchmark.
+    """
+    files = size = 0
+    for entry in entries:
+        path = os.path.join(corpus, entry)
+        paths = [path]
+        if os.path.isdir(path):
+            paths = [os.path.join(path, f) for f in os.listdir(path)]
+        for p in paths:
+            size += os.path.getsize(p)
+            if items:
+                with open(p, 'r') as f:
+                    files += sum(1 for _ in ListReader(f).items())
+            else:
+                files += 1
+    return files, size
+
+
+# benchmark name -> (corpus entries, function, files counted as List items)
+BENCHMARKS = {
+    "SecretMask": (["secrets"], run_secret_mask, False),
+    "PlaintextMask": (["configmaps", "crs"], run_plaintext_mask, False),
+    "mask_resource": (["secrets", "configmaps", "crs"], run_mask_resource,
+                      False),
+    "split_configmaps": (["configmaps.yaml"], run_split_configmaps, True),
+    "sqlmask": (["dump.sql"], run_sqlmask, False),
+}
+
+
+def available(corpus):
+    """
+    Return the benchmarks whose inputs are in the corpus.
+    """
+    return [name for name, (entries, _, _) in BENCHMARKS.items()
+            if all(os.path.exists(os.path.join(corpus, e)) for e in entries)]
+
+
+def copy_inputs(corpus, entries, dest):
+    """
+    Copy the corpus entries used by a benchmark in dest, and return the
+    list of input files.
+    """
+    paths = []
+    for entry in entries:
+        src = os.path.join(corpus, entry)
+        if os.path.isdir(src):
+            shutil.copytree(src, os.path.join(dest, entry))
+            paths += sorted(os.path.join(dest, entry, f)
+                            for f in os.listdir(src))
+        else:
+            shutil.copy(src, dest)
+            paths.append(os.path.join(dest, entry))
+    return paths
+
+
+def run_single(name, corpus, repeat):
+    """
+    Run a benchmark on a fresh copy of the corpus repeat times and return
+    its results, the best run being reported.
+    """
+    entries, fn, items = BENCHMARKS[name]
+    best = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as work:
+            paths = copy_inputs(corpus, entries, work)
+            start = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, \
+                    contextlib.redirect_stdout(devnull):
+                fn(paths)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    files, size = input_stats(corpus, entries, items)
+    # ru_maxrss is in KB on Linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        "files": files,
+        "bytes": size,
+        "seconds": round(best, 4),
+        "files_per_sec": round(files / best, 2),
+        "mb_per_sec": round(size / best / 2 ** 20, 3),
+        "peak_rss_mb": round(rss, 1),
+    }
+
+
+def run_benchmarks(names, corpus, repeat):
+    """
+    Run each benchmark in a separate interpreter and return the results.
+    """
+    results = {}
+    for name in names:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--single', name,
+             '--corpus', os.path.abspath(corpus), '--repeat', str(repeat)],
+            stdout=subprocess.PIPE, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        results[name] = json.loads(out.stdout)
+    return results
+
+
+def compare(results, baseline):
+    """
+    Print the ratio between the current results and a baseline run.
+    """
+    for name, res in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        speedup = base["seconds"] / res["seconds"]
+        rss = res["peak_rss_mb"] / base["peak_rss_mb"]
+        print(f"{name:>18}: {speedup:6.2f}x speed, {rss:6.2f}x peak RSS")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--corpus',
+                        help='Corpus directory (default: generate one)')
+    parser.add_argument('-b', '--benchmark', action='append',
+                        choices=list(BENCHMARKS),
+                        help='Benchmark to run (default: all)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Runs, the best one is reported (default: 3)')
+    parser.add_argument('-n', '--count', type=int, default=100,
+                        help='Secrets, ConfigMaps and CRs of the generated '
+                        'corpus (default: 100)')
+    parser.add_argument('-s', '--size', type=int, default=4096,
+                        help='Size of the generated config files '
+                        '(default: 4096)')
+    parser.add_argument('-i', '--items', type=int, default=1000,
+                        help='Items of the generated ConfigMapList '
+                        '(default: 1000)')
+    parser.add_argument('-d', '--dump-size', type=int, default=0,
+                        help='Size of the generated database dump, none if 0 '
+                        '(default: 0)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed of the generated corpus')
+    parser.add_argument('-o', '--output',
+                        help='Write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='Compare the results with a previous run')
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.single, args.corpus, args.repeat)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = args.corpus
+        params = {"corpus": corpus}
+        if corpus is None:
+            corpus = os.path.join(tmp, "corpus")
+            params = {"count": args.count, "size": args.size,
+                      "items": args.items, "dump_size": args.dump_size,
+                      "seed": args.seed}
+            gen_corpus(corpus, args.count, args.size, items=args.items,
+                       seed=args.seed, dump_size=args.dump_size)
+        results = run_benchmarks(args.benchmark or available(corpus),
+                                 corpus, args.repeat)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "libyaml": yaml.__with_libyaml__,
+        "mask_version": MASK_VERSION,
+        "corpus": params,
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
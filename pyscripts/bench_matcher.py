@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmark for the masking regexes: compare the plain re.sub based
+masking with the precompiled KeywordMatcher objects on the text found in
+the tests/samples* data (resource values and decoded secret entries).
+"""
+
+import argparse
+import base64
+import os
+import re
+import sys
+import timeit
+from binascii import Error as binascii_error
+
+import yaml
+
+from mask import MASK_STR, matchers, regexes
+
+SAMPLE_DIRS = ["tests/samples", "tests/samples_plaintext"]
+
+
+def collect_texts(obj, texts):
+    """
+    Recursively collect all the strings found in a loaded resource.
+    """
+    if isinstance(obj, dict):
+        for v in obj.values():
+            collect_texts(v, texts)
+    elif isinstance(obj, list):
+        for v in obj:
+            collect_texts(v, texts)
+    elif isinstance(obj, str):
+        texts.append(obj)
+
+
+def load_texts(dirs):
+    """
+    Return the strings masked by mask.py for the yaml files found in dirs,
+    including the base64 decoded content of the secrets.
+    """
+    texts = []
+    for d in dirs:
+        for root, subdirs, files in os.walk(d):
+            for f in sorted(files):
+                if not f.endswith('.yaml'):
+                    continue
+                with open(os.path.join(root, f), 'r') as fh:
+                    resource = yaml.safe_load(fh)
+                collect_texts(resource, texts)
+                if not isinstance(resource, dict) or \
+                        resource.get('kind') != 'Secret' or \
+                        not isinstance(resource.get('data'), dict):
+                    continue
+                for v in resource['data'].values():
+                    try:
+                        texts.append(base64.b64decode(v).decode())
+                    except (binascii_error, UnicodeDecodeError, TypeError):
+                        continue
+    return texts
+
+
+def mask_re(texts):
+    """
+    Masking as done before the precompiled matchers.
+    """
+    out = []
+    for t in texts:
+        for pattern in regexes:
+            t = re.sub(pattern, r"\1{}".format(MASK_STR), t, flags=re.I)
+        out.append(t)
+    return out
+
+
+def mask_matchers(texts):
+    """
+    Masking through the precompiled matchers.
+    """
+    out = []
+    for t in texts:
+        for matcher in matchers:
+            t = matcher.sub(t)
+        out.append(t)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--number', type=int, default=3,
+                        help='Runs per measure (default: 3)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Measures, the best one is reported (default: 3)')
+    args = parser.parse_args()
+
+    texts = load_texts(SAMPLE_DIRS)
+    if mask_re(texts) != mask_matchers(texts):
+        print("Error: the matchers and re.sub results differ")
+        sys.exit(1)
+
+    size = sum(len(t) for t in texts)
+    print(f"{len(texts)} strings, {size} chars")
+    results = {}
+    for fn in (mask_re, mask_matchers):
+        best = min(timeit.repeat(lambda: fn(texts), number=args.number,
+                                 repeat=args.repeat)) / args.number
+        results[fn.__name__] = best
+        print(f"{fn.__name__:>14}: {best * 1000:10.3f} ms/run")
+    print(f"speedup: {results['mask_re'] / results['mask_matchers']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,713 @@
+#!/usr/bin/env python3
+
+"""
+Scheduler of the background tasks of the collection scripts (see run_bg in
+bg.sh).
+
+The shell submits its tasks through a FIFO, and the scheduler replies on a
+second FIFO with the tasks the shell has to start: the highest priority
+ones first, only after the tasks they depend on are finished, and without
+exceeding the concurrency of the pool of their class:
+    api     oc calls to the API server (the default)
+    logs    oc logs streams
+    exec    commands run in the pods (oc rsh/exec, mysqldump, openstack)
+    node    SOS reports and other commands run on the nodes (oc debug, ssh)
+The concurrency of a pool with a maximum (e.g. --pool api=5:20) is tuned
+while the tasks run: it's halved when the API server answers with 429 or
+5xx errors (which are retried, unless the task appends to its output), and it's increased by one when the tasks
+complete as fast as the fastest ones seen so far, decreased by one when
+they become much slower.
+The started tasks report their PID and exit status back, so the scheduler
+can enforce timeouts, retry the failed tasks and tell the shell when the
+tasks it's waiting for are done, with no polling involved.
+
+Messages sent by the shell, one per line:
+    task <id> <priority> <timeout> <retries> <after> <class> <slots> <name>
+    start <id> <pid>
+    exit <id> <status>
+    wait <token> [<ids>]
+    pause
+    quit
+where <after> and <ids> are comma separated lists of task ids, <after>
+being '-' when empty, and all the submitted tasks are waited without <ids>.
+The class is guessed from the command when it's '-'. A task holds <slots>
+slots of its pool, e.g. for a command running several processes, all the
+slots of the pool when it has fewer.
+The stderr of the api tasks is written to <errors>/<id>.err, so the
+scheduler can find the API server errors: it's printed once they end.
+Messages sent by the scheduler:
+    ready
+    queued <id> <waiting>
+    run <id> <class>
+    done <token> <failed> <waiting>
+    pause
+Each task message is acknowledged with queued, after the run messages it
+triggered, so the shell starts the task right away when a slot is free.
+<waiting> is the number of tasks not started yet: while there are some,
+the shell hands the reading of the run messages over to a launcher process
+until it needs the FIFO back, which it asks for with pause, echoed once
+the run messages sent before are.
+"""
+
+import argparse
+import errno
+import heapq
+import json
+import os
+import re
+import selectors
+import shutil
+import signal
+import sys
+import time
+
+# exit status of the tasks killed when their timeout expires, as timeout(1)
+TIMEOUT_STATUS = 124
+# exit status of the tasks that disappeared without reporting their status
+LOST_STATUS = 255
+# seconds between SIGTERM and SIGKILL when a task times out
+KILL_GRACE = 10
+# seconds to wait before retrying a failed task, multiplied by the attempt
+RETRY_DELAY = 2
+# failed tasks listed in the final summary
+MAX_FAILED_REPORTED = 20
+
+# class of the tasks, guessed from the commands and the oc subcommands
+# they run, in order of precedence
+DEFAULT_POOL = "api"
+POOL_COMMANDS = [
+    ("node", {"ssh", "scp", "gather_node_sos", "gather_edpm_sos"}, {"debug"}),
+    ("logs", set(), {"logs"}),
+    ("exec", {"mysqldump"}, {"rsh", "exec", "cp"}),
+]
+# errors of the API server that mean it's overloaded, the HTTP status codes
+# only where they are reported as such, not in e.g. the name of a resource
+THROTTLE_RE = re.compile(
+    r'\(TooManyRequests\)|(?i:too many requests)|\(InternalError\)|'
+    r'\(ServiceUnavailable\)|\(Timeout\)|server is currently unable|'
+    r'status code:? (429|5\d\d)\b')
+# messages of the api tasks that are not errors, not printed
+QUIET_RE = re.compile(r'^No resources found')
+# smoothing of the average duration of the tasks of an adaptive pool
+LATENCY_ALPHA = 0.2
+# the concurrency is increased when the average duration is within FAST
+# times the fastest seen, and decreased when it's over SLOW times
+LATENCY_FAST = 1.5
+LATENCY_SLOW = 4
+
+
+def classify(name):
+    """
+    Return the pool of a task from its command.
+    """
+    words = name.split()
+    commands = {os.path.basename(w) for w in words}
+    oc = "oc" in commands
+    for pool, cmds, subcmds in POOL_COMMANDS:
+        if commands & cmds or (oc and subcmds.intersection(words)):
+            return pool
+    return DEFAULT_POOL
+
+
+class Pool():
+    """
+    A class of tasks with its own concurrency. With a max_limit, the
+    concurrency is adjusted by observe, between 1 and max_limit.
+    """
+
+    def __init__(self, name, limit, max_limit=None):
+        self.name = name
+        self.limit = max(limit, 1)
+        self.max_limit = max_limit
+        # (-priority, seq, id) of the tasks that can be started
+        self.ready = []
+        self.active = 0
+        self.latency = None
+        self.fastest = None
+        # tasks completed since the last change of the concurrency
+        self.completed = 0
+
+    def observe(self, seconds, throttled):
+        """
+        Adjust the concurrency of an adaptive pool after a task completed
+        in the given time, throttled being True if the API server reported
+        it's overloaded. Return a description of the change, if any.
+        """
+        if self.max_limit is None:
+            return None
+        self.completed += 1
+        if throttled:
+            # back off right away, but only once for the tasks that were
+            # already running when the concurrency was lowered
+            if self.completed < self.limit // 2 or self.limit == 1:
+                return None
+            return self._set(self.limit // 2, "API server overloaded")
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += LATENCY_ALPHA * (seconds - self.latency)
+        if self.fastest is None or self.latency < self.fastest:
+            self.fastest = self.latency
+        # wait for a full round of tasks at the current concurrency
+        if self.completed < self.limit:
+            return None
+        if self.latency > self.fastest * LATENCY_SLOW:
+            return self._set(self.limit - 1,
+                             f"tasks slowed down to {self.latency:.2f}s")
+        if self.latency <= self.fastest * LATENCY_FAST:
+            return self._set(self.limit + 1,
+                             f"tasks take {self.latency:.2f}s")
+        return None
+
+    def _set(self, limit, reason):
+        limit = min(max(limit, 1), self.max_limit)
+        if limit == self.limit:
+            return None
+        change = (f"Concurrency of the {self.name} tasks: {self.limit} -> "
+                  f"{limit} ({reason})")
+        self.limit = limit
+        self.completed = 0
+        return change
+
+
+class Task():
+    """
+    A task submitted by the shell.
+    """
+    __slots__ = ("id", "name", "pool", "priority", "timeout", "retries",
+                 "after", "slots", "held", "pending", "dependents",
+                 "waiters", "state",
+                 "attempts", "pid", "queued", "start", "began", "deadline",
+                 "kill_at", "timed_out", "throttled", "status")
+
+    def __init__(self, task_id, name="", priority=0, timeout=0, retries=0,
+                 after=(), pool=None, slots=1):
+        self.id = task_id
+        self.name = name
+        self.pool = pool or classify(name)
+        self.priority = priority
+        self.timeout = timeout
+        self.retries = retries
+        self.after = list(after)
+        self.slots = max(slots, 1)
+        # slots of the pool taken while the task runs
+        self.held = 0
+        # unfinished tasks this one depends on
+        self.pending = set()
+        self.dependents = []
+        self.waiters = []
+        # queued -> blocked|ready -> granted -> running -> done
+        self.state = "queued"
+        self.attempts = 0
+        self.pid = None
+        self.queued = time.time()
+        self.start = None
+        # start of the current attempt
+        self.began = None
+        self.deadline = None
+        self.kill_at = None
+        self.timed_out = False
+        self.throttled = 0
+        self.status = None
+
+    def repeatable(self):
+        """
+        Whether the task can be run again without being asked to: not if
+        it appends to a file, which would get the output twice.
+        """
+        return ">>" not in self.name
+
+    def record(self):
+        """
+        Return the status record of a finished task.
+        """
+        return {"id": self.id, "name": self.name, "pool": self.pool,
+                "priority": self.priority, "status": self.status,
+                "attempts": self.attempts, "timed_out": self.timed_out,
+                "throttled": self.throttled,
+                "queued": round(self.queued, 6),
+                "start": self.start and round(self.start, 6),
+                "end": round(time.time(), 6)}
+
+
+class Scheduler():
+    """
+    Keep track of the submitted tasks, and decide which ones are started.
+    The messages for the shell are passed to the send callable and the
+    timed out tasks to the kill one, so this class doesn't do any I/O
+    besides writing the status records and reading the stderr of the api
+    tasks from the errors directory.
+    pools maps the class of the tasks to their Pool, the missing ones get
+    the default concurrency.
+    """
+
+    def __init__(self, concurrency, send, status=None,
+                 retry_delay=RETRY_DELAY, kill_grace=KILL_GRACE, kill=None,
+                 pools=None, errors=None):
+        self.concurrency = max(concurrency, 1)
+        self.pools = dict(pools or {})
+        self.errors = errors
+        self.send = send
+        self.kill = kill or kill_tree
+        self.status = status
+        self.retry_delay = retry_delay
+        self.kill_grace = kill_grace
+        self.tasks = {}
+        # (time, seq, id) of the failed tasks waiting to be retried
+        self.delayed = []
+        # id -> task, of the tasks started and not finished yet
+        self.active = {}
+        self.seq = 0
+        self.finished = 0
+        self.failed = []
+        # token -> number of unfinished tasks, failed tasks
+        self.waits = {}
+        self.quit = False
+
+    def handle(self, line):
+        """
+        Process a message from the shell.
+        """
+        fields = line.split(' ', 8)
+        op = fields[0]
+        try:
+            if op == "task":
+                self.submit(Task(fields[1],
+                                 fields[8] if len(fields) > 8 else "",
+                                 int(fields[2]), float(fields[3]),
+                                 int(fields[4]), self._ids(fields[5]),
+                                 None if fields[6] == '-' else fields[6],
+                                 int(fields[7])))
+                self.send(f"queued {fields[1]} {self.waiting()}")
+            elif op == "start":
+                self.started(fields[1], int(fields[2]))
+            elif op == "exit":
+                self.exited(fields[1], int(fields[2]))
+            elif op == "wait":
+                # without a list of ids, all the submitted tasks
+                ids = ' '.join(fields[2:]).strip()
+                self.wait(fields[1], self._ids(ids) if ids else None)
+            elif op == "pause":
+                self.send("pause")
+            elif op == "quit":
+                self.quit = True
+            elif op:
+                raise ValueError(op)
+        except (IndexError, ValueError):
+            print(f"Error parsing scheduler message: {line}", file=sys.stderr)
+
+    @staticmethod
+    def _ids(field):
+        """
+        Parse a comma separated list of ids, '-' being the empty list.
+        """
+        return [i for i in field.split(',') if i and i != '-']
+
+    def submit(self, task):
+        """
+        Queue a task, it's ready to start when its dependencies are done.
+        """
+        self.tasks[task.id] = task
+        for dep_id in task.after:
+            dep = self.tasks.get(dep_id)
+            if dep is not None and dep.state != "done":
+                task.pending.add(dep_id)
+                dep.dependents.append(task)
+        if task.pending:
+            task.state = "blocked"
+        else:
+            self._make_ready(task)
+        self.dispatch()
+
+    def pool(self, name):
+        """
+        Return the pool of a class of tasks.
+        """
+        if name not in self.pools:
+            self.pools[name] = Pool(name, self.concurrency)
+        return self.pools[name]
+
+    def _make_ready(self, task):
+        task.state = "ready"
+        self.seq += 1
+        heapq.heappush(self.pool(task.pool).ready,
+                       (-task.priority, self.seq, task.id))
+
+    def dispatch(self):
+        """
+        Ask the shell to start the ready tasks, up to the concurrency of
+        their pools.
+        """
+        now = time.time()
+        while self.delayed and self.delayed[0][0] <= now:
+            self._make_ready(self.tasks[heapq.heappop(self.delayed)[2]])
+        for pool in self.pools.values():
+            while pool.ready:
+                task = self.tasks[pool.ready[0][2]]
+                # the next task waits for enough free slots, so that the
+                # tasks holding several of them are not starved
+                slots = min(task.slots, pool.limit)
+                if pool.active + slots > pool.limit:
+                    break
+                heapq.heappop(pool.ready)
+                task.state = "granted"
+                task.attempts += 1
+                task.timed_out = False
+                task.held = slots
+                pool.active += slots
+                self.active[task.id] = task
+                self.send(f"run {task.id} {task.pool}")
+
+    def started(self, task_id, pid):
+        """
+        A task has been started by the shell in the process pid.
+        """
+        task = self.tasks.get(task_id)
+        if task is None or task.state != "granted":
+            return
+        task.state = "running"
+        task.pid = pid
+        task.began = time.time()
+        task.start = task.start or task.began
+        if task.timeout > 0:
+            task.deadline = time.time() + task.timeout
+
+    def exited(self, task_id, status):
+        """
+        A task has finished with the given exit status: retry it if it
+        failed and it has attempts left, or if the API server was
+        overloaded and the task can be run again, otherwise mark it as
+        done.
+        """
+        task = self.tasks.get(task_id)
+        if task is None or task.state not in ("granted", "running"):
+            return
+        del self.active[task.id]
+        pool = self.pool(task.pool)
+        pool.active -= task.held
+        task.held = 0
+        errors = self._errors(task)
+        throttled = status != 0 and bool(THROTTLE_RE.search(errors))
+        task.throttled += throttled
+        if task.began is not None:
+            change = pool.observe(time.time() - task.began, throttled)
+            if change:
+                print(change, file=sys.stderr)
+        task.pid = task.deadline = task.kill_at = task.began = None
+        if task.timed_out:
+            status = TIMEOUT_STATUS
+        retries = task.retries
+        if throttled and task.repeatable():
+            retries = max(retries, 1)
+        if status != 0 and task.attempts <= retries:
+            task.state = "delayed"
+            self.seq += 1
+            heapq.heappush(self.delayed, (
+                time.time() + self.retry_delay * task.attempts, self.seq,
+                task.id))
+        else:
+            self._done(task, status)
+        self.dispatch()
+
+    def _errors(self, task):
+        """
+        Return the stderr of an api task, printing it as it was captured
+        but for the messages that are not errors.
+        """
+        if self.errors is None or task.pool != DEFAULT_POOL:
+            return ""
+        path = os.path.join(self.errors, f"{task.id}.err")
+        try:
+            with open(path, 'r', errors='replace') as f:
+                errors = f.read()
+            os.unlink(path)
+        except OSError:
+            return ""
+        sys.stderr.write("".join(line for line in errors.splitlines(True)
+                                 if not QUIET_RE.match(line)))
+        return errors
+
+    def _done(self, task, status):
+        task.state = "done"
+        task.status = status
+        self.finished += 1
+        if status != 0:
+            self.failed.append(task)
+        if self.status is not None:
+            self.status.write(json.dumps(task.record()) + "\n")
+            self.status.flush()
+        for dep in task.dependents:
+            dep.pending.discard(task.id)
+            if not dep.pending and dep.state == "blocked":
+                self._make_ready(dep)
+        task.dependents = []
+        for token in task.waiters:
+            self._wait_update(token, status)
+        task.waiters = []
+
+    def wait(self, token, ids=None):
+        """
+        Reply to token when the given tasks (all the submitted ones by
+        default) are done, with the number of them that failed.
+        """
+        if ids is None:
+            tasks = list(self.tasks.values())
+        else:
+            tasks = [self.tasks[i] for i in ids if i in self.tasks]
+        pending = [t for t in tasks if t.state != "done"]
+        failed = sum(1 for t in tasks if t.state == "done" and t.status)
+        self.waits[token] = [len(pending), failed]
+        for task in pending:
+            task.waiters.append(token)
+        self._wait_update(token, None)
+
+    def _wait_update(self, token, status):
+        wait = self.waits[token]
+        if status is not None:
+            wait[0] -= 1
+            wait[1] += 1 if status else 0
+        if wait[0] == 0:
+            del self.waits[token]
+            self.send(f"done {token} {wait[1]} {self.waiting()}")
+
+    def waiting(self):
+        """
+        Return the number of tasks not started yet, blocked, ready or
+        waiting to be retried.
+        """
+        return len(self.tasks) - self.finished - len(self.active)
+
+    def running_tasks(self):
+        return [t for t in self.active.values() if t.state == "running"]
+
+    def next_timer(self):
+        """
+        Return the time of the next timeout or retry, if any.
+        """
+        times = [t.kill_at or t.deadline for t in self.running_tasks()
+                 if t.kill_at or t.deadline]
+        if self.delayed:
+            times.append(self.delayed[0][0])
+        return min(times, default=None)
+
+    def check_timers(self):
+        """
+        Kill the tasks whose timeout expired and start the delayed retries.
+        """
+        now = time.time()
+        for task in self.running_tasks():
+            if task.kill_at and task.kill_at <= now:
+                # the task didn't stop on SIGTERM
+                self.kill(task.pid, signal.SIGKILL, True)
+                task.kill_at = None
+                self.exited(task.id, TIMEOUT_STATUS)
+            elif task.deadline and task.deadline <= now:
+                print(f"Task timed out after {task.timeout}s: {task.name}",
+                      file=sys.stderr)
+                task.timed_out = True
+                task.deadline = None
+                task.kill_at = now + self.kill_grace
+                # the shell running the task reports its exit status
+                self.kill(task.pid, signal.SIGTERM, False)
+        self.dispatch()
+
+    def lost(self, task_id, pid):
+        """
+        The process running a task is gone without reporting its status.
+        """
+        task = self.tasks.get(task_id)
+        if task is not None and task.state == "running" and task.pid == pid:
+            self.exited(task_id, LOST_STATUS)
+
+    def summary(self):
+        """
+        Return a summary of the tasks, listing the failed ones.
+        """
+        lines = [f"Background tasks: {len(self.tasks)} submitted, "
+                 f"{self.finished} finished, {len(self.failed)} failed"]
+        for task in self.failed[:MAX_FAILED_REPORTED]:
+            reason = "timed out" if task.timed_out else f"exit {task.status}"
+            lines.append(f"  {reason}: {task.name}")
+        if len(self.failed) > MAX_FAILED_REPORTED:
+            lines.append(f"  ... and {len(self.failed) - MAX_FAILED_REPORTED}"
+                         " more")
+        return "\n".join(lines)
+
+
+def children(pid):
+    """
+    Return the PIDs of the descendants of a process.
+    """
+    pids = []
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", 'r') as f:
+            direct = [int(p) for p in f.read().split()]
+    except OSError:
+        return pids
+    for child in direct:
+        pids.append(child)
+        pids += children(child)
+    return pids
+
+
+def kill_tree(pid, sig, include_self):
+    """
+    Send a signal to the descendants of a process, and optionally to the
+    process itself.
+    """
+    if pid is None:
+        return
+    pids = children(pid) + ([pid] if include_self else [])
+    for p in pids:
+        try:
+            os.kill(p, sig)
+        except OSError:
+            pass
+
+
+class FifoServer():
+    """
+    Exchange the scheduler messages with the shell through the FIFOs.
+    """
+
+    def __init__(self, requests, replies, owner=None):
+        self.req = os.open(requests, os.O_RDONLY | os.O_NONBLOCK)
+        # the shell opens the FIFO in read-write mode, so this doesn't block
+        self.rep = open(replies, 'w', buffering=1)
+        self.buffer = b""
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(self.req, selectors.EVENT_READ, "req")
+        self.pidfds = {}
+        if owner:
+            self.watch(owner, None)
+
+    def send(self, message):
+        self.rep.write(message + "\n")
+
+    def watch(self, pid, task_id):
+        """
+        Get notified when a process ends, if supported by the system.
+        """
+        if not hasattr(os, "pidfd_open"):
+            return
+        try:
+            fd = os.pidfd_open(pid)
+        except OSError:
+            return
+        self.pidfds[fd] = (pid, task_id)
+        self.sel.register(fd, selectors.EVENT_READ, "pid")
+
+    def _unwatch(self, fd):
+        self.sel.unregister(fd)
+        os.close(fd)
+        return self.pidfds.pop(fd)
+
+    def read_lines(self):
+        """
+        Return the complete lines available, or None at EOF.
+        """
+        while True:
+            try:
+                data = os.read(self.req, 65536)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+                break
+            if not data:
+                return None
+            self.buffer += data
+        *lines, self.buffer = self.buffer.split(b"\n")
+        return [line.decode(errors="replace") for line in lines]
+
+    def serve(self, sched):
+        """
+        Process the messages until the shell quits or goes away.
+        """
+        self.send("ready")
+        while not sched.quit:
+            timer = sched.next_timer()
+            timeout = None if timer is None else max(timer - time.time(), 0)
+            events = self.sel.select(timeout)
+            # the messages are processed first, an exit status is always
+            # received before the end of the process that sent it
+            ended = []
+            for key, _ in events:
+                if key.data == "pid":
+                    ended.append(self._unwatch(key.fd))
+            lines = self.read_lines() if (events or ended) else []
+            if lines is None:
+                break
+            for line in lines:
+                sched.handle(line)
+                if line.startswith("start "):
+                    task = sched.tasks.get(line.split()[1])
+                    if task is not None and task.pid:
+                        self.watch(task.pid, task.id)
+            for pid, task_id in ended:
+                if task_id is None:
+                    # the shell is gone, nobody can start the queued tasks
+                    sched.quit = True
+                else:
+                    sched.lost(task_id, pid)
+            sched.check_timers()
+
+
+def parse_pool(value):
+    """
+    Parse a pool definition: <class>=<concurrency>[:<max concurrency>]
+    """
+    try:
+        name, limits = value.split('=', 1)
+        limit, _, max_limit = limits.partition(':')
+        pool = Pool(name, int(limit), int(max_limit) if max_limit else None)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid pool: {value}")
+    if pool.max_limit is not None:
+        pool.max_limit = max(pool.max_limit, pool.limit)
+    return pool
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('requests', help='FIFO the shell writes to')
+    parser.add_argument('replies', help='FIFO the shell reads from')
+    parser.add_argument('-c', '--concurrency', type=int, default=5,
+                        help='Tasks of each class running at the same time '
+                        '(default: 5)')
+    parser.add_argument('-p', '--pool', type=parse_pool, action='append',
+                        default=[], metavar='CLASS=N[:MAX]',
+                        help='Concurrency of a class of tasks, tuned up to '
+                        'MAX when given')
+    parser.add_argument('-e', '--errors',
+                        help='Directory where the stderr of the api tasks '
+                        'is written, removed at exit')
+    parser.add_argument('-s', '--status',
+                        help='Append the status of the finished tasks to '
+                        'this file, as JSON lines')
+    parser.add_argument('--owner', type=int,
+                        help='PID of the shell, exit when it ends')
+    parser.add_argument('--retry-delay', type=float, default=RETRY_DELAY,
+                        help='Seconds before retrying a failed task, '
+                        f'multiplied by the attempt (default: {RETRY_DELAY})')
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+    server = FifoServer(args.requests, args.replies, args.owner)
+    status = open(args.status, 'a') if args.status else None
+    sched = Scheduler(args.concurrency, server.send, status,
+                      retry_delay=args.retry_delay,
+                      pools={p.name: p for p in args.pool},
+                      errors=args.errors)
+    try:
+        server.serve(sched)
+    finally:
+        print(sched.summary(), file=sys.stderr)
+        if status is not None:
+            status.close()
+        if args.errors:
+            shutil.rmtree(args.errors, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,110 +1,561 @@
 #!/usr/bin/env python3
 
 """
-Split a Kubernetes ConfigMapList YAML file into individual ConfigMap files.
+Split a Kubernetes List YAML file (ConfigMapList, SecretList, or the List
+returned by 'oc get <kind> -o yaml') into individual resource files.
 Uses only Python standard library (no external dependencies).
 Optionally applies masking to the split files.
 """
 
 import yaml
 import os
+import re
+import shutil
 import sys
+import time
 import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from yaml.composer import Composer
+from yaml.constructor import SafeConstructor
+from yaml.resolver import Resolver
 
 # Import mask module for applying masking
 try:
-    from mask import mask_data
+    from mask import mask_data, MaskManifest, file_entry, default_jobs
+    from mask import STATS_SLOWEST, enable_stats, get_stats, timed
+    from mask import write_text, YAML_WIDTH
 except ImportError:
+    # the dumps are not folded, as in mask.py
+    YAML_WIDTH = 2 ** 31 - 1
     mask_data = None
+    MaskManifest = None
+    default_jobs = None
+    STATS_SLOWEST = 10
+    enable_stats = get_stats = timed = None
 
+# Path of the file created for each item, relative to the output directory
+DEFAULT_LAYOUT = "{name}.yaml"
 
-def split_configmaps(input_file, output_dir='configmaps', apply_mask=False):
+# Minimum interval in seconds between two progress messages
+PROGRESS_INTERVAL = 2
+
+# Maximum number of items submitted to the worker processes and not yet
+# written, so that memory stays proportional to the size of the items
+MAX_PENDING_ITEMS = 64
+
+# Use the libyaml parser when available, the nodes are still composed in
+# Python so that the items of a List can be loaded one at a time
+try:
+    from yaml.cyaml import CParser
+
+    class ListLoader(CParser, Composer, SafeConstructor, Resolver):
+        """
+        SafeLoader based on the libyaml parser.
+        """
+
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            Composer.__init__(self)
+            SafeConstructor.__init__(self)
+            Resolver.__init__(self)
+except ImportError:
+    ListLoader = yaml.SafeLoader
+
+
+class Progress():
     """
-    Split a ConfigMapList YAML file into individual ConfigMap files.
+    Rate-limited progress output: the processed items are reported at
+    most once every PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, source, interval=PROGRESS_INTERVAL):
+        self.source = source
+        self.interval = interval
+        self.count = 0
+        self.last = time.monotonic()
+
+    def update(self, name):
+        self.count += 1
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            print(f"  [{self.count}] {name} ({self.source})", flush=True)
+
+
+class ListReader():
+    """
+    Stream the items of a List YAML document, loading one item at a time:
+    memory is proportional to the largest item, not to the whole List.
+    The other top-level keys (kind, apiVersion, metadata) are stored in
+    header as they are read; as the keys are sorted in the oc output,
+    kind is only known once the items have been read.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.header = {}
+        # set when the document is not a mapping
+        self.document = None
+
+    def _load_node(self, loader):
+        """
+        Load the next node of the document.
+        """
+        return loader.construct_document(loader.compose_node(None, None))
+
+    def items(self):
+        """
+        Generator returning the items of the List.
+        """
+        loader = ListLoader(self.stream)
+        try:
+            # StreamStartEvent
+            loader.get_event()
+            if loader.check_event(yaml.StreamEndEvent):
+                return
+            # DocumentStartEvent
+            loader.get_event()
+            if not loader.check_event(yaml.MappingStartEvent):
+                self.document = self._load_node(loader)
+                return
+            loader.get_event()
+            while not loader.check_event(yaml.MappingEndEvent):
+                key = self._load_node(loader)
+                if key == 'items' and \
+                        loader.check_event(yaml.SequenceStartEvent):
+                    loader.get_event()
+                    while not loader.check_event(yaml.SequenceEndEvent):
+                        yield self._load_node(loader)
+                    loader.get_event()
+                else:
+                    self.header[key] = self._load_node(loader)
+        finally:
+            loader.dispose()
+
+
+def describe_item(item):
+    """
+    Text the match and exclude patterns are searched in: the item name
+    and, for secrets, the secret type (as in the 'oc get' output).
+    """
+    name = (item.get('metadata') or {}).get('name', '')
+    return f"{name} {item.get('type', '')}"
+
+
+def item_paths(item, output_path, layout, match):
+    """
+    Return the paths where an item is saved: one per matching pattern, or
+    a single one when no pattern is given. Items that don't match, or
+    that don't have the namespace required by the layout, are skipped.
+    """
+    metadata = item.get('metadata') or {}
+    namespace = metadata.get('namespace')
+    if '{namespace}' in layout and not namespace:
+        return []
+
+    if match:
+        desc = describe_item(item)
+        patterns = [p.pattern for p in match if p.search(desc)]
+    else:
+        patterns = [None]
+
+    paths = []
+    for pattern in patterns:
+        path = output_path / layout.format(name=metadata.get('name'),
+                                           namespace=namespace,
+                                           kind=item.get('kind'),
+                                           match=pattern)
+        if path not in paths:
+            paths.append(path)
+    return paths
+
+
+def write_item(item, filepath, apply_mask=False, dump_conf=False,
+               written=None):
+    """
+    Write a single item of the List, masked if requested.
+    Returns True when the file has been masked. The files written, the
+    item and the config files dumped from a masked secret, are appended
+    to written when given.
+    """
+    if written is None:
+        written = []
+    if apply_mask and mask_data:
+        try:
+            mask_data(item, str(filepath), dump_conf, written)
+            return True
+        except Exception as e:
+            print(f"Warning: Could not mask {filepath}: {e}")
+    elif apply_mask and not mask_data:
+        print("Warning: Masking requested but mask module not available")
+    elif timed is None:
+        with open(filepath, 'w') as f:
+            yaml.dump(item, f, default_flow_style=False, sort_keys=False,
+                      width=YAML_WIDTH)
+        written.append(str(filepath))
+    else:
+        with timed("dump"):
+            content = yaml.dump(item, default_flow_style=False,
+                                sort_keys=False, width=YAML_WIDTH)
+        write_text(str(filepath), content)
+        written.append(str(filepath))
+    return False
+
+
+def link_file(source, dest):
+    """
+    Hardlink dest to source, replacing it, or copy source when it can't
+    be linked (e.g. on another filesystem).
+    """
+    try:
+        os.unlink(dest)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
+
+
+def current_stats():
+    """
+    Return the masking statistics being collected, if any.
+    """
+    return get_stats() if get_stats else None
+
+
+def timed_items(items, record):
+    """
+    Generator returning the items, accounting the time spent to read and
+    parse them to the statistics record of the List.
+    """
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+        finally:
+            elapsed = time.perf_counter() - start
+            record["phases"]["parse"] = \
+                record["phases"].get("parse", 0) + elapsed
+            record["seconds"] += elapsed
+        yield item
+
+
+def save_item(item, output_path, opts):
+    """
+    Save an item of the List in the paths selected by the split options,
+    and return the list of (path, manifest entry) tuples for the created
+    files, where the entry is None when the file is not masked or not
+    recorded in a manifest; and the statistics records of the files.
+    An item saved in several paths (e.g. a secret matching several
+    services) is masked and written once, the other paths and the config
+    files dumped next to them are hardlinks to the first ones.
+    """
+    if opts['exclude'] and opts['exclude'].search(describe_item(item)):
+        return [], []
+    paths = item_paths(item, output_path, opts['layout'], opts['match'])
+    stats = current_stats()
+
+    saved = []
+    written = []
+    entry = None
+    for filepath in paths:
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        if saved:
+            first = saved[0][0]
+            for source in written:
+                link_file(source, str(filepath) + source[len(first):])
+            saved.append((str(filepath), entry))
+            continue
+        if stats:
+            stats.start_file(str(filepath))
+        try:
+            masked = write_item(item, filepath, opts['apply_mask'],
+                                opts['dump_conf'], written)
+        finally:
+            if stats:
+                stats.end_file()
+        if masked and opts['record']:
+            entry = file_entry(str(filepath), opts['dump_conf'])
+        saved.append((str(filepath), entry))
+    return saved, stats.take() if stats else []
+
+
+def split_list(input_file, output_dir, apply_mask=False,
+               layout=DEFAULT_LAYOUT, match=None, exclude=None,
+               dump_conf=False, manifest=None, kinds=None, executor=None,
+               ignore_case=False):
+    """
+    Split a Kubernetes List YAML file into individual resource files, so
+    that a kind can be collected with a single API call. The List is
+    streamed, and each item is written before the next one is loaded.
 
     Args:
-        input_file: Path to the input YAML file
+        input_file: Path to the input YAML file ('-' reads stdin), or an
+                    object reading the List like ListReader, with a name
+                    (e.g. kubeapi.ListStream)
         output_dir: Directory where individual files will be saved
         apply_mask: Whether to apply masking to the split files
+        layout: Path of each file relative to output_dir, formatted with
+                the item name, namespace and kind, and the matching pattern
+        match: Patterns selecting the items to save,
+               each item is saved once per matching pattern
+        exclude: Pattern of the items to skip
+        dump_conf: Whether to dump the config files of masked secrets
+        manifest: MaskManifest where the masked files are recorded
+        kinds: Accepted List kinds (default: any kind ending with List)
+        executor: Process pool where the items are masked and written,
+                  they are processed in the current process when None
+        ignore_case: Whether match and exclude ignore the case
 
     Returns:
         List of created file paths
     """
 
-    # Create output directory
     output_path = Path(output_dir)
-    output_path.mkdir(parents=True, exist_ok=True)
+    flags = re.I if ignore_case else 0
+    opts = {
+        'layout': layout,
+        'match': [re.compile(p, flags) for p in match or []],
+        'exclude': re.compile(exclude, flags) if exclude else None,
+        'apply_mask': apply_mask,
+        'dump_conf': dump_conf,
+        'record': manifest is not None,
+    }
+    # Kinds of the accepted items
+    item_kinds = [k[:-len('List')] for k in kinds] if kinds else None
+
+    created_files = []
+    # Items without kind (e.g. in a SecretList) are kept until the kind of
+    # the List is known
+    pending = []
+    total = 0
+    source = input_file if isinstance(input_file, str) else input_file.name
+    progress = Progress(source)
+    # Items submitted to the executor
+    running = deque()
 
-    # Read and parse the YAML file
-    with open(input_file, 'r') as f:
-        data = yaml.safe_load(f)
+    def collect(result):
+        saved, records = result
+        if stats:
+            stats.records.extend(records)
+        for filepath, entry in saved:
+            if entry and manifest:
+                manifest.record(filepath, entry)
+            created_files.append(filepath)
 
-    # Validate it's a ConfigMapList
-    if data.get('kind') != 'ConfigMapList':
-        print(f"Warn: Expected kind 'ConfigMapList', got '{data.get('kind')}'")
+    def process(i, item):
+        # Extract metadata
+        metadata = item.setdefault('metadata', {})
+        name = metadata.setdefault('name', f'unnamed-{i}')
+        if item_kinds and item.get('kind') not in item_kinds:
+            print(f"Warn: Skipping {name} of kind '{item.get('kind')}'")
+            return
+        progress.update(name)
+        if executor is None:
+            collect(save_item(item, output_path, opts))
+            return
+        running.append(executor.submit(save_item, item, output_path, opts))
+        while len(running) > MAX_PENDING_ITEMS:
+            collect(running.popleft().result())
+
+    stats = current_stats()
+    f = None
+    if source is not input_file:
+        reader = input_file
+    elif input_file == '-':
+        reader = ListReader(sys.stdin)
+    else:
+        f = open(input_file, 'r')
+        reader = ListReader(f)
+    try:
+        items = reader.items()
+        if stats:
+            # account the parsing of the List to its own record
+            list_record = stats.new_record(source)
+            if f is not None:
+                list_record["bytes"]["read"] = os.path.getsize(input_file)
+            items = timed_items(items, list_record)
+        print(f"Processing items from {source}", flush=True)
+        # Process each resource
+        for total, item in enumerate(items, 1):
+            if not isinstance(item, dict):
+                continue
+            if 'kind' not in item and 'kind' not in reader.header:
+                pending.append((total, item))
+                continue
+            if 'kind' not in item:
+                item['kind'] = reader.header['kind'][:-len('List')]
+            process(total, item)
+    finally:
+        if f is not None:
+            f.close()
+        while running:
+            collect(running.popleft().result())
+
+    # Validate it's a List (nothing has been retrieved when the input is
+    # empty, e.g. the kind doesn't exist)
+    kind = reader.header.get('kind') or ''
+    not_list = reader.header and not kind.endswith('List')
+    if reader.document is not None or not_list:
+        print(f"Warn: Expected a List kind, got '{kind or None}'")
         return
 
-    # Get the list of ConfigMaps
-    configmaps = data.get('items', [])
-    created_files = []
+    for i, item in pending:
+        if kind[:-len('List')]:
+            item['kind'] = kind[:-len('List')]
+        process(i, item)
+    while running:
+        collect(running.popleft().result())
 
-    total = len(configmaps)
-    print(f"Processing {total} ConfigMaps from {input_file}", flush=True)
+    if stats:
+        stats.records.append(list_record)
+    print(f"Processed {total} items from {source}", flush=True)
+    if manifest:
+        manifest.save()
+    return created_files
 
-    # Process each ConfigMap
-    for i, cm in enumerate(configmaps, 1):
-        # Extract metadata
-        metadata = cm.get('metadata', {})
-        name = metadata.get('name', f'unnamed-{i}')
 
-        # Create filename using configmap name
-        filename = f"{name}.yaml"
-        filepath = output_path / filename
+def split_lists(pairs, jobs=1, **kwargs):
+    """
+    Split several List files, given as (input_file, output_dir) pairs,
+    sharing the same pool of jobs worker processes. Other arguments are
+    passed to split_list.
 
-        print(f"  [{i}/{total}] {name}", flush=True)
+    Returns:
+        True if all the Lists have been split
+    """
+    executor = None
+    if jobs > 1:
+        # don't duplicate the buffered output in the workers
+        sys.stdout.flush()
+        executor = ProcessPoolExecutor(max_workers=jobs)
 
-        if apply_mask and mask_data:
-            try:
-                mask_data(cm, str(filepath))
-            except Exception as e:
-                print(f"Warning: Could not mask {filepath}: {e}")
-        elif apply_mask and not mask_data:
-            print(f"Warning: Masking requested but mask module not available")
-        else:
-            with open(filepath, 'w') as f:
-                yaml.dump(cm, f, default_flow_style=False, sort_keys=False)
+    ok = True
+    try:
+        for input_file, output_dir in pairs:
+            # Check input file
+            if isinstance(input_file, str) and input_file != '-' \
+                    and not os.path.exists(input_file):
+                print(f"Error: File '{input_file}' not found")
+                ok = False
+                continue
+            if split_list(input_file, output_dir, executor=executor,
+                          **kwargs) is None:
+                ok = False
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return ok
 
-        created_files.append(str(filepath))
 
-    return created_files
+def split_configmaps(input_file, output_dir='configmaps', apply_mask=False):
+    """
+    Split a ConfigMapList YAML file into individual ConfigMap files.
+
+    Args:
+        input_file: Path to the input YAML file
+        output_dir: Directory where individual files will be saved
+        apply_mask: Whether to apply masking to the split files
+
+    Returns:
+        List of created file paths
+    """
+
+    # Create output directory
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    return split_list(input_file, output_dir, apply_mask,
+                      kinds=('ConfigMapList',))
+
+
+def add_split_arguments(parser):
+    """
+    Add the options selecting how the Lists are split to an argparse
+    parser, they are used by run_split.
+    """
+    parser.add_argument('--mask', action='store_true',
+                        help='Apply masking to the split resource files')
+    parser.add_argument('--layout', default=DEFAULT_LAYOUT,
+                        help='Path of the resource files in output_dir, using the {name}, {namespace}, {kind} and {match} fields (default: %(default)s)')  # noqa E501
+    parser.add_argument('--match', action='append',
+                        help='Only save the resources whose name matches the pattern, can be repeated')  # noqa E501
+    parser.add_argument('-i', '--ignore-case', action='store_true',
+                        help='Ignore the case in the --match and --exclude patterns')  # noqa E501
+    parser.add_argument('--exclude',
+                        help='Skip the resources whose name or type matches the pattern')  # noqa E501
+    parser.add_argument('--kind', action='append',
+                        help='Only save the items of Lists of this kind (e.g. ConfigMapList), can be repeated')  # noqa E501
+    parser.add_argument('--dump-conf', action='store_true',
+                        help='Dump the config files of the masked secrets')
+    parser.add_argument('--manifest', metavar='MANIFEST_PATH',
+                        help='Record the masked files in the mask.py manifest')  # noqa E501
+    parser.add_argument('--stats', metavar='STATS_PATH',
+                        help='Write the masking statistics as JSON to STATS_PATH')  # noqa E501
+    parser.add_argument('--stats-slowest', metavar='N', type=int,
+                        default=STATS_SLOWEST,
+                        help='Number of slowest files reported in the statistics (default: %(default)s)')  # noqa E501
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=default_jobs() if default_jobs else 1,
+                        help='Number of worker processes used to mask and write the resources (default: %(default)s)')  # noqa E501
+
+
+def run_split(args, pairs):
+    """
+    Split the (input_file, output_dir) pairs (see split_lists) with the
+    options added by add_split_arguments, exiting on failure.
+    """
+    manifest = None
+    if args.manifest and MaskManifest:
+        manifest = MaskManifest(args.manifest)
+
+    stats = None
+    if args.stats and enable_stats:
+        stats = enable_stats(args.stats_slowest)
+    elif args.stats:
+        print("Warning: Statistics requested but mask module not available")
+
+    # Split the Lists into individual resources
+    try:
+        ok = split_lists(pairs, args.jobs, apply_mask=args.mask,
+                         layout=args.layout, match=args.match,
+                         exclude=args.exclude, dump_conf=args.dump_conf,
+                         manifest=manifest, kinds=args.kind,
+                         ignore_case=args.ignore_case)
+    except Exception as e:
+        # on stderr, where the errors of the API server are looked for
+        # (see bgsched.py)
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if stats:
+        stats.save(args.stats)
+    if not ok:
+        sys.exit(1)
 
 
 def main():
     """Main entry point."""
     # Parse command line arguments
     parser = argparse.ArgumentParser(
-        description='Split ConfigMapList YAML file into individual ConfigMaps'
+        description='Split List YAML files into individual resources'
     )
-    parser.add_argument('input_file', help='Path to the input ConfigMapList YAML file')  # noqa E501
-    parser.add_argument('output_dir', nargs='?', default='configmaps',
-                        help='Directory where individual files will be saved (default: configmaps)')  # noqa E501
-    parser.add_argument('--mask', action='store_true',
-                        help='Apply masking to the split ConfigMap files')
+    parser.add_argument('paths', nargs='+', metavar='input_file [output_dir]',
+                        help='Path to the input List YAML file (- to read stdin) and directory where individual files will be saved (default: configmaps). Several input_file output_dir pairs can be passed')  # noqa E501
+    add_split_arguments(parser)
 
     args = parser.parse_args()
 
-    # Check input file
-    if not os.path.exists(args.input_file):
-        print(f"Error: File '{args.input_file}' not found")
-        sys.exit(1)
+    if len(args.paths) == 1:
+        pairs = [(args.paths[0], 'configmaps')]
+    elif len(args.paths) % 2 == 0:
+        pairs = list(zip(args.paths[::2], args.paths[1::2]))
+    else:
+        parser.error("expected input_file output_dir pairs")
 
-    # Split the ConfigMapList into individual ConfigMaps
-    try:
-        split_configmaps(args.input_file, args.output_dir, args.mask)
-    except Exception as e:
-        print(f"Error: {e}")
-        sys.exit(1)
+    run_split(args, pairs)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+"""
+Build a summary index of the control plane status gathered by
+gather_services_status, to start the triage from a small file instead of
+the tables listing every port, node or service.
+
+The outputs are read from their JSON capture (<file>.json, see OSC_FORMAT)
+when there is one, and from their table otherwise. The index, written to
+summary.json in the ctlplane directory, has:
+
+    counts        the number of entries of each list, and per value of
+                  their status columns
+    down          the services and agents that are down
+    error_ports   the ports in ERROR state
+    cells         the hosts of each cell, the compute services not mapped
+                  to a cell, the mapped hosts without a compute service and
+                  the cells without any host
+
+    ctlsummary.py /must-gather/ctlplane
+"""
+
+import argparse
+import collections
+import json
+import os
+import sys
+
+SUMMARY = "summary.json"
+# columns whose values are counted
+STATUS_COLUMNS = ("status", "state", "alive", "provisioning state",
+                  "power state", "maintenance", "provisioning_status",
+                  "operating_status", "action")
+# lists of services and agents, by suffix of their file
+SERVICE_LISTS = ("service_list", "agent_list")
+DOWN_STATES = ("down", "failed")
+NOT_ALIVE = ("false", "xxx")
+# columns kept in the entries of the index
+KEEP_COLUMNS = ("ID", "Name", "Binary", "Agent Type", "Host", "Hostname",
+                "Zone", "Availability Zone", "State", "Status", "Alive",
+                "Updated At")
+CELL0 = "00000000-0000-0000-0000-000000000000"
+
+
+def parse_table(text):
+    """
+    Return the rows of a table printed by openstack or nova-manage as
+    dicts, the lines continuing the cells of a row being joined to them.
+    """
+    header = None
+    rows = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line.startswith('|'):
+            continue
+        cells = [c.strip() for c in line.strip('|').split('|')]
+        if header is None:
+            header = cells
+        elif rows and not cells[0] and len(cells) == len(header):
+            for column, cell in zip(header, cells):
+                if cell:
+                    rows[-1][column] += '\n' + cell
+        else:
+            rows.append(dict(zip(header, cells)))
+    return rows
+
+
+def parse_json(text):
+    """
+    Return the entries of the JSON lists of a file, several lists being
+    concatenated when the command was run for each zone, project... The
+    single objects shown by the show commands aren't entries.
+    """
+    decoder = json.JSONDecoder()
+    entries = []
+    pos = 0
+    while True:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        if pos == len(text):
+            return entries
+        value, pos = decoder.raw_decode(text, pos)
+        if isinstance(value, list):
+            entries.extend(value)
+
+
+def load(root, name):
+    """
+    Return the entries of an output, from its JSON capture or its table,
+    or None if it wasn't gathered or can't be read.
+    """
+    for path, parse in ((os.path.join(root, name + '.json'), parse_json),
+                        (os.path.join(root, name), parse_table)):
+        try:
+            with open(path, 'r') as f:
+                return parse(f.read())
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError) as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            return None
+    return None
+
+
+def outputs(root):
+    """
+    Return the names of the outputs of the ctlplane directory, relative
+    to it, without the .json suffix of their capture.
+    """
+    names = set()
+    for dirpath, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in files:
+            path = os.path.relpath(os.path.join(dirpath, name), root)
+            # the outputs have no extension, unlike the OVN databases,
+            # the cluster status files...
+            if path == SUMMARY or ('.' in name and not name.endswith('.json')):
+                continue
+            names.add(path[:-5] if name.endswith('.json') else path)
+    return sorted(names)
+
+
+def value(entry, column):
+    """
+    Return the value of a column as a string, as JSON and tables show
+    them differently (e.g. true and :-), null and empty).
+    """
+    v = entry.get(column)
+    if v is None:
+        return ""
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    return str(v)
+
+
+def compact(entry, source=None):
+    """
+    Return the identifying and status columns of an entry.
+    """
+    kept = {c: entry[c] for c in KEEP_COLUMNS if c in entry}
+    if source:
+        kept = dict(source=source, **kept)
+    return kept
+
+
+def count_states(entries):
+    """
+    Return the number of entries and their number per value of each
+    status column.
+    """
+    counts = {"total": len(entries)}
+    for column in sorted({c for e in entries for c in e}):
+        if column.lower() in STATUS_COLUMNS:
+            counts[column] = dict(collections.Counter(
+                value(e, column) for e in entries))
+    return counts
+
+
+def is_down(entry):
+    """
+    Whether a service or agent is down: nova, cinder and manila report
+    their State as down, heat and watcher their Status, neutron its agents
+    not Alive.
+    """
+    if value(entry, "Alive").lower() in NOT_ALIVE:
+        return True
+    return any(value(entry, c).lower() in DOWN_STATES
+               for c in ("State", "Status"))
+
+
+def cell_gaps(root):
+    """
+    Return the hosts of each cell, and the gaps between the host mappings
+    and the compute services, or None if they weren't gathered.
+    """
+    cells = load(root, os.path.join("nova", "cell_list"))
+    mappings = load(root, os.path.join("nova", "host_list"))
+    services = load(root, os.path.join("nova", "service_list"))
+    if cells is None or mappings is None:
+        return None
+    hosts = collections.defaultdict(list)
+    for mapping in mappings:
+        hosts[mapping.get("Cell Name", "")].append(mapping.get("Hostname"))
+    gaps = {
+        "hosts": {c.get("Name", ""): len(hosts.get(c.get("Name", ""), []))
+                  for c in cells},
+        "empty_cells": sorted(c.get("Name", "") for c in cells
+                              if c.get("UUID") != CELL0
+                              and not hosts.get(c.get("Name", ""))),
+    }
+    if services is not None:
+        mapped = {h for names in hosts.values() for h in names}
+        computes = {s.get("Host") for s in services
+                    if s.get("Binary") == "nova-compute"}
+        gaps["unmapped_hosts"] = sorted(computes - mapped)
+        gaps["unknown_hosts"] = sorted(mapped - computes)
+    return gaps
+
+
+def summarize(root):
+    """
+    Return the summary index of a ctlplane directory.
+    """
+    summary = {"counts": {}, "down": [], "error_ports": []}
+    for name in outputs(root):
+        entries = load(root, name)
+        if not entries or not all(isinstance(e, dict) for e in entries):
+            continue
+        summary["counts"][name] = count_states(entries)
+        if name.endswith(SERVICE_LISTS):
+            summary["down"].extend(compact(e, name) for e in entries
+                                   if is_down(e))
+        if name == os.path.join("neutron", "port_list"):
+            summary["error_ports"] = [compact(e) for e in entries
+                                      if value(e, "Status") == "ERROR"]
+    cells = cell_gaps(root)
+    if cells is not None:
+        summary["cells"] = cells
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('root', help='The ctlplane directory')
+    parser.add_argument('-o', '--output',
+                        help=f'File written (default: <root>/{SUMMARY})')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        print(f"{args.root}: not a directory", file=sys.stderr)
+        sys.exit(1)
+    summary = summarize(args.root)
+    output = args.output or os.path.join(args.root, SUMMARY)
+    with open(output, 'w') as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+        f.write('\n')
+    gaps = summary.get("cells", {})
+    print(f"Indexed {len(summary['counts'])} lists in {output}: "
+          f"{len(summary['down'])} down, {len(summary['error_ports'])} "
+          f"ports in error, "
+          f"{len(gaps.get('unmapped_hosts', []))} unmapped hosts")
+
+
+if __name__ == '__main__':
+    main()
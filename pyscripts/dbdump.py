@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+"""
+Dump the databases of the galera pods of a namespace in parallel,
+compressing each dump while it's streamed to the disk (with gzip level 1
+by default, see --level).
+
+The databases of each pod are listed once, those asked for that don't
+exist are skipped, and each database is dumped to
+<output-dir>/<pod>-<database>.sql, saved as .sql.gz unless it's small (see
+gzwrite.py). Up to --jobs dumps run at the same time. The duration, the
+size of the dump and of the file written, and the status of each dump are
+recorded in <output-dir>/dumps.json. With --mask, the dumps are masked
+while they are streamed (see sqlmask.py), and the number of values masked
+is recorded as well:
+
+    dbdump.py --namespace openstack --output-dir dbs/openstack --mask \\
+        --databases nova,neutron openstack-galera-0 openstack-cell1-galera-0
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gzwrite import MIN_SIZE, save
+from sqlmask import MaskedReader
+
+DUMP_OPTIONS = ["--single-transaction", "--complete-insert",
+                "--skip-lock-tables", "--lock-tables=0"]
+# not dumped by mysqldump --all-databases either
+SYSTEM_DATABASES = ("information_schema", "performance_schema", "sys")
+STATS = "dumps.json"
+JOBS = 4
+# the dumps are large: compress them cheaply, so that gzip keeps up with
+# mysqldump
+LEVEL = 1
+# lines of the errors kept for each dump
+ERROR_LINES = 5
+
+
+class Counter:
+    """
+    A stream counting the bytes read from another one.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self.source.read(size)
+        self.size += len(chunk)
+        return chunk
+
+    def readline(self):
+        line = self.source.readline()
+        self.size += len(line)
+        return line
+
+
+def galera(namespace, pod, args):
+    """
+    Return the oc command running args in the galera container of a pod.
+    """
+    return ["oc", "-n", namespace, "exec", "-c", "galera", pod, "--"] + args
+
+
+def list_databases(namespace, pod):
+    """
+    Return the databases of a pod, without the system ones, or None if
+    they can't be listed.
+    """
+    ret = subprocess.run(
+        galera(namespace, pod, ["mysql", "-uroot", "-N", "-B", "-e",
+                                "SHOW DATABASES"]),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if ret.returncode:
+        print(f"Can't list the databases of {pod}: {ret.stderr.strip()}",
+              file=sys.stderr)
+        return None
+    return [db for db in ret.stdout.split() if db not in SYSTEM_DATABASES]
+
+
+def select(existing, wanted, pod):
+    """
+    Return the databases to dump among the existing ones of a pod: all of
+    them if wanted is None, those of wanted that exist otherwise.
+    """
+    if wanted is None:
+        return existing
+    selected = []
+    for db in wanted:
+        if db in existing:
+            selected.append(db)
+        else:
+            print(f"Database {db} does not exist on {pod}, skipping")
+    return selected
+
+
+def dump(namespace, pod, db, output_dir, options, min_size, level,
+         mask=False):
+    """
+    Dump a database to <pod>-<db>.sql(.gz), masked if mask is set, and
+    return its record.
+    """
+    path = os.path.join(output_dir, f"{pod}-{db}.sql")
+    start = time.monotonic()
+    proc = subprocess.Popen(
+        galera(namespace, pod, ["mysqldump", "-uroot"] + options + [db]),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # the errors are read aside, the dump could block on a full pipe
+    errors = []
+    reader = threading.Thread(target=lambda: errors.append(proc.stderr.read()))
+    reader.start()
+    source = Counter(proc.stdout)
+    masked = MaskedReader(source) if mask else None
+    try:
+        written = save(masked or source, path, min_size, level)
+    except Exception as e:
+        # any failure of the masking or the write only fails this dump,
+        # its mysqldump is stopped and the other dumps go on
+        proc.kill()
+        written = None
+        errors.append(f"{e}\n".encode())
+    status = proc.wait()
+    reader.join()
+    record = {
+        "pod": pod,
+        "database": db,
+        "file": os.path.basename(written) if written else None,
+        "status": status if written else 1,
+        "seconds": round(time.monotonic() - start, 3),
+        "dump_size": source.size,
+        "size": os.path.getsize(written) if written else 0,
+    }
+    if masked:
+        record["masked"] = masked.mask.masked
+    error = b"".join(errors).decode(errors='replace').strip()
+    if record["status"]:
+        record["error"] = "\n".join(error.splitlines()[-ERROR_LINES:])
+    return record
+
+
+def dump_all(namespace, pods, output_dir, wanted=None, jobs=JOBS,
+             options=DUMP_OPTIONS, min_size=MIN_SIZE, level=LEVEL,
+             mask=False):
+    """
+    Dump the databases of the pods, jobs at a time, and return their
+    records, the largest dumps first.
+    """
+    tasks = []
+    for pod in pods:
+        existing = list_databases(namespace, pod)
+        if existing is not None:
+            tasks.extend((pod, db) for db in select(existing, wanted, pod))
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = [executor.submit(dump, namespace, pod, db, output_dir,
+                                   options, min_size, level, mask)
+                   for pod, db in tasks]
+        records = [f.result() for f in futures]
+    records.sort(key=lambda r: -r["dump_size"])
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('pods', nargs='+', help='The galera pods')
+    parser.add_argument('--namespace', required=True,
+                        help='Namespace of the pods')
+    parser.add_argument('--output-dir', required=True,
+                        help='Directory of the dumps')
+    parser.add_argument('--databases', default='all',
+                        help='Comma separated databases to dump, or all '
+                        '(default: %(default)s)')
+    parser.add_argument('--jobs', type=int, default=JOBS,
+                        help='Dumps run at the same time '
+                        '(default: %(default)s)')
+    parser.add_argument('--options', default=' '.join(DUMP_OPTIONS),
+                        help='Options of mysqldump (default: %(default)s)')
+    parser.add_argument('--min-size', type=int, default=MIN_SIZE,
+                        help='Dumps smaller than this number of bytes are '
+                        'not compressed (default: %(default)s)')
+    parser.add_argument('--level', type=int, default=LEVEL,
+                        choices=range(1, 10), metavar='1-9',
+                        help='Compression level (default: %(default)s)')
+    parser.add_argument('--mask', action='store_true',
+                        help='Mask the sensitive data of the dumps')
+    args = parser.parse_args()
+
+    wanted = None
+    if args.databases.lower() != 'all':
+        wanted = [db for db in args.databases.split(',') if db]
+    os.makedirs(args.output_dir, exist_ok=True)
+    records = dump_all(args.namespace, args.pods, args.output_dir, wanted,
+                       args.jobs, args.options.split(), args.min_size,
+                       args.level, args.mask)
+    with open(os.path.join(args.output_dir, STATS), 'w') as f:
+        json.dump(records, f, indent=2)
+        f.write('\n')
+
+    failed = [r for r in records if r["status"]]
+    for record in failed:
+        print(f"Dump of {record['database']} on {record['pod']} failed: "
+              f"{record.get('error', '')}", file=sys.stderr)
+    print(f"Dumped {len(records) - len(failed)} databases, "
+          f"{sum(r['dump_size'] for r in records)} bytes in "
+          f"{sum(r['size'] for r in records)} bytes, {len(failed)} failed")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
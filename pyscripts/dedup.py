@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""
+Replace the duplicated files of a directory with hardlinks, so that their
+content is stored, and archived, once.
+
+The same content is often collected several times: a secret matching
+several services is saved in each secrets/<service> directory with its
+config files, a CR can be captured by gather_crs and by oc adm inspect,
+rotated logs can be both in the SOS reports and in the pod directories.
+Files are compared by size first, then by the hash of their beginning
+and finally of their whole content, so most of them are never read.
+Only files with the same permissions and owner are linked, and the space
+saved is reported:
+
+    dedup.py /must-gather --exclude .mask_manifest.jsonl
+    dedup.py --dry-run /must-gather
+"""
+
+import argparse
+import collections
+import fnmatch
+import hashlib
+import os
+import stat
+import sys
+
+# files smaller than this are not worth a lookup
+MIN_SIZE = 1024
+HEAD_SIZE = 64 << 10
+READ_SIZE = 1 << 20
+
+
+def digest(path, limit=None):
+    """
+    Return the sha256 of a file, or of its first limit bytes.
+    """
+    h = hashlib.sha256()
+    left = limit
+    with open(path, 'rb') as f:
+        while left is None or left > 0:
+            chunk = f.read(READ_SIZE if left is None else min(READ_SIZE, left))
+            if not chunk:
+                break
+            h.update(chunk)
+            if left is not None:
+                left -= len(chunk)
+    return h.hexdigest()
+
+
+def scan(root, excludes=(), min_size=MIN_SIZE):
+    """
+    Return the regular files of root that may have duplicates: lists of
+    inodes, with the paths of their names in root, having the same size,
+    permissions and owner.
+    """
+    inodes = {}
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs
+                         if not any(fnmatch.fnmatch(d, p) for p in excludes))
+        for name in sorted(files):
+            if any(fnmatch.fnmatch(name, p) for p in excludes):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode) or st.st_size < min_size:
+                continue
+            key = (st.st_dev, st.st_ino)
+            if key not in inodes:
+                inodes[key] = (st, [])
+            inodes[key][1].append(path)
+
+    groups = collections.defaultdict(list)
+    for st, paths in inodes.values():
+        groups[(st.st_dev, st.st_size, st.st_mode, st.st_uid,
+                st.st_gid)].append((st, paths))
+    return [g for g in groups.values() if len(g) > 1]
+
+
+def split_by(group, key):
+    """
+    Split a group of inodes by the key of their first path, dropping the
+    inodes that can't be read and the ones left alone.
+    """
+    parts = collections.defaultdict(list)
+    for inode in group:
+        try:
+            parts[key(inode[1][0])].append(inode)
+        except OSError as e:
+            print(f"{inode[1][0]}: {e}", file=sys.stderr)
+    return [p for p in parts.values() if len(p) > 1]
+
+
+def link(source, path):
+    """
+    Replace path with a hardlink to source.
+    """
+    tmp = f"{path}.dedup{os.getpid()}"
+    os.link(source, tmp)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        os.unlink(tmp)
+        raise
+
+
+def dedup(root, excludes=(), min_size=MIN_SIZE, dry_run=False):
+    """
+    Replace the duplicated files of root with hardlinks to the first of
+    them, and return the number of files replaced and the bytes saved.
+    """
+    replaced = 0
+    saved = 0
+    for group in scan(root, excludes, min_size):
+        if group[0][0].st_size > HEAD_SIZE:
+            group_parts = split_by(group, lambda p: digest(p, HEAD_SIZE))
+        else:
+            group_parts = [group]
+        for part in group_parts:
+            for same in split_by(part, digest):
+                # keep the inode with most names, fewer paths are changed
+                same.sort(key=lambda inode: -len(inode[1]))
+                source = same[0][1][0]
+                for st, paths in same[1:]:
+                    try:
+                        for path in paths:
+                            if not dry_run:
+                                link(source, path)
+                            replaced += 1
+                    except OSError as e:
+                        print(f"{path}: {e}", file=sys.stderr)
+                        continue
+                    # the space is freed when no name is left outside root
+                    if st.st_nlink == len(paths):
+                        saved += st.st_size
+    return replaced, saved
+
+
+def human(size):
+    """
+    Return a size in bytes in a readable unit.
+    """
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            break
+        size /= 1024
+    return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('root', help='Directory to deduplicate')
+    parser.add_argument('--exclude', action='append', default=[],
+                        help='Skip the files and directories whose name '
+                        'matches this pattern, can be repeated')
+    parser.add_argument('--min-size', type=int, default=MIN_SIZE,
+                        help='Skip the files smaller than this number of '
+                        'bytes (default: %(default)s)')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="Only report the duplicates, don't link them")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        print(f"{args.root}: not a directory", file=sys.stderr)
+        sys.exit(1)
+    replaced, saved = dedup(args.root, args.exclude, args.min_size,
+                            args.dry_run)
+    action = "Would replace" if args.dry_run else "Replaced"
+    print(f"{action} {replaced} duplicated files with hardlinks, saving "
+          f"{human(saved)} in {args.root}")
+
+
+if __name__ == '__main__':
+    main()
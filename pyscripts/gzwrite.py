@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+"""
+Save the standard input to a file, compressed with gzip while it's read.
+
+The output is written to <path>.gz once it's larger than --min-size, and
+to <path> as it is otherwise, so that the small files remain readable
+without decompressing them. The file left by a previous attempt with the
+other name is removed.
+"""
+
+import argparse
+import gzip
+import os
+import signal
+import sys
+
+# bytes read at once
+CHUNK_SIZE = 1 << 20
+# files smaller than this are not compressed
+MIN_SIZE = 64 << 10
+# fast, and still close to the best ratio on logs
+LEVEL = 6
+
+
+def remove(path):
+    """
+    Remove a file, if it exists.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def save(source, path, min_size=MIN_SIZE, level=LEVEL):
+    """
+    Save the source stream to path, or path.gz if it's larger than
+    min_size, and return the path written.
+    """
+    head = []
+    size = 0
+    while size < min_size:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            remove(path + '.gz')
+            with open(path, 'wb') as f:
+                f.write(b''.join(head))
+            return path
+        head.append(chunk)
+        size += len(chunk)
+
+    remove(path)
+    with open(path + '.gz', 'wb') as raw:
+        # no name nor time in the header, the same content gives the
+        # same file
+        with gzip.GzipFile(filename='', mode='wb', compresslevel=level,
+                           fileobj=raw, mtime=0) as f:
+            for chunk in head:
+                f.write(chunk)
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                f.write(chunk)
+    return path + '.gz'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('path', help='File to write, without .gz')
+    parser.add_argument('--min-size', type=int, default=MIN_SIZE,
+                        help='Files smaller than this number of bytes are '
+                        f'not compressed (default: {MIN_SIZE})')
+    parser.add_argument('--level', type=int, default=LEVEL,
+                        choices=range(1, 10), metavar='1-9',
+                        help=f'Compression level (default: {LEVEL})')
+    args = parser.parse_args()
+
+    # a timed out task is terminated: end the gzip stream so that what
+    # has been read so far can be decompressed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(143))
+    try:
+        save(sys.stdin.buffer, args.path, args.min_size, args.level)
+    except OSError as e:
+        print(f"Error writing {args.path}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,636 @@
+#!/usr/bin/env python3
+
+"""
+Read resources from the Kubernetes API server without starting an oc process
+per request. Only the Python standard library is used.
+
+The client authenticates with the token of the service account of the pod
+(or the --token-file option), and keeps its HTTPS connections open between
+requests, so the TLS handshake and the discovery of the resource types are
+done once per process instead of once per oc call, or once per run when
+the discovery is stored in a cache directory (--cache-dir). Lists are read in pages
+(the limit and continue parameters, like oc --chunk-size), and each page is
+written out before the next one is requested:
+
+    kubeapi.py version
+    kubeapi.py get -n openstack pods -o pods.json
+    kubeapi.py get namespaces openstack -o /dev/null
+    kubeapi.py split -n openstack secrets secrets/ --mask --layout ...
+
+get writes the objects as JSON, like 'oc get -o json', split saves each
+object of the List in its own file, optionally masked, accepting the same
+options as cmaps.py. Errors are reported like oc does, e.g.
+'Error from server (NotFound): ...', and make the command exit with 1.
+"""
+
+import argparse
+import gzip
+import http.client
+import json
+import os
+import re
+import ssl
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+SERVICE_ACCOUNT_PATH = "/var/run/secrets/kubernetes.io/serviceaccount"
+# Number of objects per page of a List, as the default of oc --chunk-size
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_TIMEOUT = 60
+# Seconds the discovery stored in the cache directory is reused
+DEFAULT_CACHE_TTL = 600
+# Aggregated discovery returns all the API groups and their resources with a
+# single request, older API servers ignore it and return the APIGroupList
+AGGREGATED_DISCOVERY = ", ".join([
+    "application/json;g=apidiscovery.k8s.io;v=v2;as=APIGroupDiscoveryList",
+    "application/json;g=apidiscovery.k8s.io;v=v2beta1;as=APIGroupDiscoveryList",
+    "application/json",
+])
+# Errors of a reused connection closed by the server while it was idle, the
+# request is sent again on a new connection
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected,
+                           http.client.CannotSendRequest,
+                           ConnectionResetError, BrokenPipeError)
+
+
+class ApiError(Exception):
+    """
+    An error returned by the API server, or a failure to reach it. The
+    message is formatted as the oc one.
+    """
+
+    def __init__(self, message, status=None, reason=None, details=None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.details = details or {}
+
+    @classmethod
+    def from_response(cls, status, reason, body):
+        """
+        Build the error from a response, using the Status object returned
+        by the API server when there is one.
+        """
+        try:
+            obj = json.loads(body)
+        except ValueError:
+            obj = None
+        if isinstance(obj, dict) and obj.get("kind") == "Status":
+            reason = obj.get("reason") or reason
+            message = obj.get("message") or body
+            return cls(f"Error from server ({reason}): {message}", status,
+                       reason, obj)
+        message = body.decode(errors="replace").strip() or reason
+        return cls(f"Error from server ({reason}): the server responded "
+                   f"with the status code {status}: {message}", status,
+                   reason)
+
+
+def sorted_object(pairs):
+    """
+    object_pairs_hook sorting the keys of the JSON objects, as in the oc
+    output.
+    """
+    return dict(sorted(pairs))
+
+
+def oc_object(obj):
+    """
+    Remove what oc get leaves out of the objects by default (see its
+    --show-managed-fields option): the field managers of the metadata.
+    """
+    metadata = obj.get("metadata")
+    if isinstance(metadata, dict):
+        metadata.pop("managedFields", None)
+    return obj
+
+
+class ApiResource():
+    """
+    A resource type found by the discovery.
+    """
+
+    def __init__(self, name, group, version, kind, namespaced,
+                 singular="", short_names=()):
+        self.name = name
+        self.group = group
+        self.version = version
+        self.kind = kind
+        self.namespaced = namespaced
+        self.singular = singular or kind.lower()
+        self.short_names = tuple(short_names or ())
+
+    @property
+    def api_version(self):
+        return f"{self.group}/{self.version}" if self.group else self.version
+
+    def matches(self, name):
+        """
+        Whether name designates this resource type, as the plural, singular
+        or short name, or the kind.
+        """
+        return name in (self.name, self.singular, self.kind.lower()) \
+            or name in self.short_names
+
+    def path(self, namespace=None, name=None):
+        """
+        Return the API path of the resources, or of one of them.
+        """
+        if self.group:
+            path = f"/apis/{self.group}/{self.version}"
+        else:
+            path = f"/api/{self.version}"
+        if namespace and self.namespaced:
+            path += "/namespaces/" + urllib.parse.quote(namespace, safe="")
+        path += "/" + self.name
+        if name:
+            path += "/" + urllib.parse.quote(name, safe="")
+        return path
+
+
+class ApiClient():
+    """
+    Client of the API server. The connections are kept open and reused by
+    the following requests, it can be shared by several threads, each
+    request using its own connection.
+    """
+
+    def __init__(self, server, token=None, token_file=None, ca_file=None,
+                 verify=True, timeout=DEFAULT_TIMEOUT,
+                 chunk_size=DEFAULT_CHUNK_SIZE, cache_dir=None,
+                 cache_ttl=DEFAULT_CACHE_TTL):
+        url = urllib.parse.urlsplit(server)
+        if url.scheme not in ("http", "https") or not url.hostname:
+            raise ApiError(f"error: invalid server URL '{server}'")
+        self.https = url.scheme == "https"
+        self.host = url.hostname
+        self.port = url.port
+        self.prefix = url.path.rstrip("/")
+        self.token = token
+        self.token_file = token_file
+        if token is None and token_file:
+            self.token = self._read_token()
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+        self.context = None
+        if self.https:
+            self.context = ssl.create_default_context(cafile=ca_file)
+            if not verify:
+                self.context.check_hostname = False
+                self.context.verify_mode = ssl.CERT_NONE
+        self._idle = []
+        self._lock = threading.Lock()
+        # resource types of the API groups:
+        # (group, version) -> (version, [resources])
+        self._groups = {}
+        self._aggregated = None
+        self._group_list = []
+        # number of connections opened, to check they are reused
+        self.connections = 0
+
+    @classmethod
+    def in_cluster(cls, **kwargs):
+        """
+        Return a client using the service account of the pod.
+        """
+        host = os.environ.get("KUBERNETES_SERVICE_HOST")
+        port = os.environ.get("KUBERNETES_SERVICE_PORT", "443")
+        if not host:
+            raise ApiError("error: not running in a pod, "
+                           "KUBERNETES_SERVICE_HOST is not set")
+        if ":" in host:
+            host = f"[{host}]"
+        kwargs.setdefault("token_file",
+                          os.path.join(SERVICE_ACCOUNT_PATH, "token"))
+        kwargs.setdefault("ca_file",
+                          os.path.join(SERVICE_ACCOUNT_PATH, "ca.crt"))
+        return cls(f"https://{host}:{port}", **kwargs)
+
+    def _read_token(self):
+        try:
+            with open(self.token_file, 'r') as f:
+                return f.read().strip()
+        except OSError as e:
+            raise ApiError(f"error: can't read the token: {e}")
+
+    def _connect(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+            self.connections += 1
+        if self.https:
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout,
+                context=self.context), False
+        return http.client.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout), False
+
+    def _release(self, conn):
+        with self._lock:
+            self._idle.append(conn)
+
+    def close(self):
+        """
+        Close the idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def _send(self, path, headers):
+        """
+        Send a GET request and return the status, reason, headers and body
+        of the response. A connection closed by the server while idle is
+        replaced by a new one.
+        """
+        while True:
+            conn, reused = self._connect()
+            try:
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except STALE_CONNECTION_ERRORS as e:
+                conn.close()
+                if reused:
+                    continue
+                raise ApiError(f"Unable to connect to the server: {e}")
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise ApiError(f"Unable to connect to the server: {e}")
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            if resp.getheader("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            return resp.status, resp.reason, body
+
+    def request(self, path, query=None, accept="application/json"):
+        """
+        GET an API path and return the decoded JSON response, raising
+        ApiError if the request failed.
+        """
+        url = self.prefix + path
+        if query:
+            url += "?" + urllib.parse.urlencode(query)
+        headers = {"Accept": accept, "Accept-Encoding": "gzip",
+                   "User-Agent": "openstack-must-gather"}
+        for attempt in range(2):
+            if self.token:
+                headers["Authorization"] = f"Bearer {self.token}"
+            status, reason, body = self._send(url, headers)
+            # the token of the service account is rotated, read it again
+            if status == 401 and self.token_file and attempt == 0:
+                token = self._read_token()
+                if token != self.token:
+                    self.token = token
+                    continue
+            break
+        if status != 200:
+            raise ApiError.from_response(status, reason, body)
+        try:
+            return json.loads(body, object_pairs_hook=sorted_object)
+        except ValueError as e:
+            raise ApiError(f"error: invalid response for {path}: {e}")
+
+    def discovery(self, path, accept="application/json"):
+        """
+        GET a discovery API path, which is read from the cache directory,
+        if any, when it has been stored there less than cache_ttl seconds
+        ago.
+        """
+        if not self.cache_dir:
+            return self.request(path, accept=accept)
+        cache = os.path.join(self.cache_dir,
+                             "kubeapi" + re.sub(r"[^\w.,=-]", "_", path))
+        try:
+            if time.time() - os.path.getmtime(cache) < self.cache_ttl:
+                with open(cache, 'r') as f:
+                    return json.load(f, object_pairs_hook=sorted_object)
+        except (OSError, ValueError):
+            pass
+        obj = self.request(path, accept=accept)
+        # several processes can update the cache at the same time
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(obj, f)
+            os.replace(tmp, cache)
+        except OSError:
+            pass
+        return obj
+
+    def _group_resources(self, group, version=None):
+        """
+        Return the version and the resource types of an API group (the
+        preferred version unless given), or None if it doesn't exist.
+        """
+        key = (group, version)
+        if key in self._groups:
+            return self._groups[key]
+        try:
+            if not group:
+                version = version or "v1"
+                path = f"/api/{version}"
+            else:
+                if version is None:
+                    info = self.discovery(f"/apis/{group}")
+                    version = info["preferredVersion"]["version"]
+                path = f"/apis/{group}/{version}"
+            listing = self.discovery(path)
+        except ApiError as e:
+            if e.status != 404:
+                raise
+            self._groups[key] = None
+            return None
+        resources = [ApiResource(r["name"], group, version, r["kind"],
+                                 r.get("namespaced", False),
+                                 r.get("singularName"), r.get("shortNames"))
+                     for r in listing.get("resources", [])
+                     if "/" not in r["name"]]
+        self._groups[key] = (version, resources)
+        return self._groups[key]
+
+    def _all_resources(self):
+        """
+        Generator returning the resource types of all the API groups, in
+        the order of the discovery, the preferred version of each group.
+        """
+        if self._aggregated is None:
+            listing = self.discovery("/apis", accept=AGGREGATED_DISCOVERY)
+            if listing.get("kind") != "APIGroupDiscoveryList":
+                self._aggregated = False
+                self._group_list = [
+                    (g["name"], g["preferredVersion"]["version"])
+                    for g in listing.get("groups", [])]
+            else:
+                self._aggregated = []
+                for group in listing.get("items", []):
+                    name = group["metadata"]["name"]
+                    # the versions are sorted by preference
+                    version = (group.get("versions") or [None])[0]
+                    if version is None:
+                        continue
+                    for r in version.get("resources", []):
+                        kind = (r.get("responseKind") or {}).get("kind", "")
+                        self._aggregated.append(ApiResource(
+                            r["resource"], name, version["version"], kind,
+                            r.get("scope") == "Namespaced",
+                            r.get("singularResource"), r.get("shortNames")))
+        if self._aggregated is not False:
+            yield from self._aggregated
+            return
+        for group, version in self._group_list:
+            found = self._group_resources(group, version)
+            if found:
+                yield from found[1]
+
+    def resolve(self, name):
+        """
+        Return the resource type designated by name, as oc does: its plural,
+        singular or short name or its kind, optionally followed by the API
+        group (e.g. deployments.apps) or version and group.
+        """
+        name = name.lower()
+        resource, _, group = name.partition(".")
+        candidates = []
+        if group:
+            version, _, rest = group.partition(".")
+            candidates.append((group, None))
+            if rest:
+                candidates.append((rest, version))
+        else:
+            candidates.append(("", None))
+        for group, version in candidates:
+            found = self._group_resources(group, version)
+            for res in found[1] if found else []:
+                if res.matches(resource):
+                    return res
+        if not group:
+            for res in self._all_resources():
+                if res.matches(resource):
+                    return res
+        raise ApiError(f'error: the server doesn\'t have a resource type '
+                       f'"{name}"')
+
+    def get(self, resource, name, namespace=None):
+        """
+        Return an object, resource being the name of its type.
+        """
+        res = self.resolve(resource)
+        return oc_object(self.request(res.path(namespace, name)))
+
+    def list(self, resource, namespace=None, selector=None):
+        """
+        Return a ListStream reading the objects of a type, in a namespace
+        or in all of them when namespace is None.
+        """
+        return ListStream(self, resource, namespace, selector)
+
+
+class ListStream():
+    """
+    Read the objects of a List page by page, with the same interface as
+    cmaps.ListReader: items is a generator returning the objects, and the
+    kind and apiVersion of the List are stored in header. The objects get
+    their kind and apiVersion, and lose their managedFields, as in the oc
+    output.
+    """
+
+    def __init__(self, client, resource, namespace=None, selector=None):
+        self.client = client
+        self.resource = resource
+        self.namespace = namespace
+        self.selector = selector
+        self.name = f"{resource} in {namespace or 'all namespaces'}"
+        self.header = {}
+        self.document = None
+
+    def items(self):
+        """
+        Generator returning the objects of the List.
+        """
+        res = self.client.resolve(self.resource)
+        path = res.path(self.namespace)
+        query = {"limit": self.client.chunk_size}
+        if self.selector:
+            query["labelSelector"] = self.selector
+        while True:
+            try:
+                page = self.client.request(path, query)
+            except ApiError as e:
+                # the continue token expired, the server returns another
+                # one to read the rest of the List from its current state
+                token = (e.details.get("metadata") or {}).get("continue")
+                if e.status == 410 and token and "continue" in query:
+                    query["continue"] = token
+                    continue
+                raise
+            if not self.header:
+                self.header = {"apiVersion": page.get("apiVersion", "v1"),
+                               "kind": page.get("kind", res.kind + "List")}
+            for item in page.get("items") or []:
+                oc_object(item)
+                item["apiVersion"] = res.api_version
+                item["kind"] = res.kind
+                yield sorted_object(item.items())
+            token = (page.get("metadata") or {}).get("continue")
+            if not token:
+                return
+            query["continue"] = token
+
+
+def write_list(stream, out):
+    """
+    Write the objects of a ListStream to out as a JSON List, like
+    'oc get -o json', one page in memory at a time.
+    """
+    out.write('{"apiVersion": "v1", "items": [')
+    for i, item in enumerate(stream.items()):
+        out.write(",\n" if i else "\n")
+        json.dump(item, out)
+    out.write('], "kind": "List", "metadata": {"resourceVersion": ""}}\n')
+
+
+def do_version(client, args):
+    json.dump(client.request("/version"), sys.stdout, indent=4)
+    print()
+
+
+def do_get(client, args):
+    namespace = None if args.all_namespaces else args.namespace
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        if args.name:
+            json.dump(client.get(args.resource, args.name, namespace), out,
+                      indent=4)
+            out.write("\n")
+        else:
+            write_list(client.list(args.resource, namespace, args.selector),
+                       out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def do_split(client, args):
+    try:
+        import cmaps
+    except ImportError as e:
+        raise ApiError(f"error: can't split the Lists: {e}")
+    namespace = None if args.all_namespaces else args.namespace
+    if len(args.paths) % 2:
+        raise ApiError("error: expected resource output_dir pairs")
+    pairs = [(client.list(resource, namespace, args.selector), output_dir)
+             for resource, output_dir in zip(args.paths[::2],
+                                             args.paths[1::2])]
+    cmaps.run_split(args, pairs)
+
+
+def default_namespace():
+    """
+    Return the namespace of the pod, as oc does when running in a pod.
+    """
+    try:
+        with open(os.path.join(SERVICE_ACCOUNT_PATH, "namespace"), 'r') as f:
+            return f.read().strip() or "default"
+    except OSError:
+        return "default"
+
+
+def add_scope_arguments(parser):
+    parser.add_argument('-n', '--namespace', default=default_namespace(),
+                        help='Namespace of the resources (default: the one '
+                        'of the pod)')
+    parser.add_argument('-A', '--all-namespaces', action='store_true',
+                        help='Read the resources of all the namespaces')
+    parser.add_argument('-l', '--selector',
+                        help='Label selector of the resources')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--server',
+                        help='URL of the API server (default: the one of '
+                        'the cluster the pod runs in)')
+    parser.add_argument('--token-file',
+                        help='File with the bearer token (default: the one '
+                        'of the service account of the pod)')
+    parser.add_argument('--certificate-authority', metavar='CA_FILE',
+                        help='CA certificates of the API server')
+    parser.add_argument('--insecure-skip-tls-verify', action='store_true',
+                        help="Don't check the certificate of the API server")
+    parser.add_argument('--request-timeout', type=float,
+                        default=DEFAULT_TIMEOUT,
+                        help='Timeout in seconds of the requests '
+                        '(default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='Number of objects read per request '
+                        '(default: %(default)s)')
+    parser.add_argument('--cache-dir',
+                        help='Directory where the discovery of the resource '
+                        'types is stored, to be reused by the next runs')
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_CACHE_TTL,
+                        help='Seconds the discovery stored in the cache '
+                        'directory is reused (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    cmd = commands.add_parser('version', help='Print the server version')
+    cmd.set_defaults(func=do_version)
+
+    cmd = commands.add_parser('get', help='Write objects as JSON')
+    cmd.add_argument('resource', help='Type of the objects')
+    cmd.add_argument('name', nargs='?', help='Name of the object, all the '
+                     'objects are written as a List if not given')
+    cmd.add_argument('-o', '--output', default='-',
+                     help='Output file (default: stdout)')
+    add_scope_arguments(cmd)
+    cmd.set_defaults(func=do_get)
+
+    cmd = commands.add_parser('split', help='Save the objects of Lists in '
+                              'one file each (see cmaps.py)')
+    cmd.add_argument('paths', nargs='+', metavar='resource output_dir',
+                     help='Type of the objects and directory where they '
+                     'are saved, several pairs can be passed')
+    add_scope_arguments(cmd)
+    try:
+        import cmaps
+        cmaps.add_split_arguments(cmd)
+    except ImportError:
+        pass
+    cmd.set_defaults(func=do_split)
+
+    args = parser.parse_args()
+    options = {"timeout": args.request_timeout,
+               "chunk_size": args.chunk_size,
+               "cache_dir": args.cache_dir, "cache_ttl": args.cache_ttl,
+               "verify": not args.insecure_skip_tls_verify}
+    if args.token_file:
+        options["token_file"] = args.token_file
+    if args.certificate_authority:
+        options["ca_file"] = args.certificate_authority
+    try:
+        if args.server:
+            client = ApiClient(args.server, **options)
+        else:
+            client = ApiClient.in_cluster(**options)
+        args.func(client, args)
+    except ApiError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+"""
+Plan the collection of the logs of the pods of a namespace.
+
+Read the pods, as returned by 'oc get pods -o json', and print the tasks
+gathering their description and the logs of their containers, one per line:
+    describe <pod>
+    log <pod> <container> <priority> [<oc logs options>]
+    previous <pod> <container> <priority> [<oc logs options>]
+    init <pod> <container> <priority> [<oc logs options>]
+The describe tasks come first, the log tasks follow by decreasing priority.
+Crashing containers (waiting in CrashLoopBackOff or failed, the last time
+or now) get priority 2, the ones that have restarted priority 1.
+
+The size of each log can be capped with --limit-bytes, and the current
+logs restricted to a time window with --since (the previous logs of the
+restarted containers are kept whole, as the crash is usually at their end).
+With --budget the total size of the logs is shared among the containers,
+the crashing and the restarting ones getting a larger share.
+"""
+
+import argparse
+import json
+import re
+import sys
+
+# share of the budget of the containers, by priority
+WEIGHTS = {0: 1, 1: 2, 2: 4}
+CRASH_REASONS = ("CrashLoopBackOff", "Error", "RunContainerError",
+                 "CreateContainerError")
+SIZE_UNITS = {"": 1, "k": 10**3, "m": 10**6, "g": 10**9,
+              "ki": 2**10, "mi": 2**20, "gi": 2**30}
+
+
+def parse_size(value):
+    """
+    Parse a size in bytes, with an optional K, M, G, Ki, Mi or Gi suffix.
+    """
+    m = re.fullmatch(r"(\d+)([kmg]i?)?b?", value.strip().lower())
+    if not m:
+        raise argparse.ArgumentTypeError(f"invalid size: {value}")
+    return int(m.group(1)) * SIZE_UNITS[m.group(2) or ""]
+
+
+def parse_since(value):
+    """
+    Check a duration accepted by oc logs --since (e.g. 30m, 1h30m).
+    """
+    if not re.fullmatch(r"(\d+(ns|us|ms|s|m|h))+", value):
+        raise argparse.ArgumentTypeError(f"invalid duration: {value}")
+    return value
+
+
+def crash_priority(status):
+    """
+    Return 2 for a crashing container, 1 for a restarted one, 0 otherwise.
+    """
+    state = status.get("state") or {}
+    last = (status.get("lastState") or {}).get("terminated") or {}
+    waiting = (state.get("waiting") or {}).get("reason")
+    terminated = state.get("terminated") or {}
+    if (waiting in CRASH_REASONS or terminated.get("exitCode", 0) != 0
+            or last.get("exitCode", 0) != 0):
+        return 2
+    if status.get("restartCount", 0) > 0 or last:
+        return 1
+    return 0
+
+
+class LogTask():
+    """
+    A log of a container to gather.
+    """
+
+    def __init__(self, kind, pod, container, priority):
+        self.kind = kind
+        self.pod = pod
+        self.container = container
+        self.priority = priority
+        self.limit = None
+
+    def line(self, since=None):
+        """
+        Return the task as printed, with its oc logs options.
+        """
+        opts = []
+        if self.limit is not None:
+            opts.append(f"--limit-bytes={self.limit}")
+        if since and self.kind != "previous":
+            opts.append(f"--since={since}")
+        return " ".join([self.kind, self.pod, self.container,
+                         str(self.priority)] + opts)
+
+
+def plan_pod(pod):
+    """
+    Return the log tasks of a pod: the current logs of its running or
+    terminated containers, init ones included, and the previous logs of
+    the containers that have terminated before, even if they are waiting
+    to restart.
+    """
+    name = pod["metadata"]["name"]
+    status = pod.get("status") or {}
+    tasks = []
+    for key, kind in [("initContainerStatuses", "init"),
+                      ("containerStatuses", "log")]:
+        for cs in status.get(key) or []:
+            state = cs.get("state") or {}
+            priority = crash_priority(cs)
+            if "running" in state or "terminated" in state:
+                tasks.append(LogTask(kind, name, cs["name"], priority))
+            # a container waiting to restart only has its previous logs
+            if "terminated" in (cs.get("lastState") or {}):
+                tasks.append(LogTask("previous", name, cs["name"], priority))
+    return tasks
+
+
+def share_budget(tasks, budget, limit=None):
+    """
+    Set the limit of the tasks sharing the budget by the weight of their
+    priority, without exceeding the limit of a single log: the share the
+    capped tasks don't use goes to the others.
+    """
+    pending = list(tasks)
+    while pending:
+        weights = sum(WEIGHTS[t.priority] for t in pending)
+        share = {t: budget * WEIGHTS[t.priority] // weights for t in pending}
+        capped = [t for t in pending if limit is not None and share[t] >= limit]
+        if not capped:
+            for t in pending:
+                t.limit = max(share[t], 1)
+            return
+        for t in capped:
+            t.limit = limit
+            budget -= limit
+            pending.remove(t)
+
+
+def plan(pods, limit=None, budget=None):
+    """
+    Return the pods to describe and their log tasks, by decreasing priority.
+    """
+    names = []
+    tasks = []
+    for pod in pods:
+        names.append(pod["metadata"]["name"])
+        tasks.extend(plan_pod(pod))
+    tasks.sort(key=lambda t: -t.priority)
+    if budget is not None:
+        share_budget(tasks, budget, limit)
+    elif limit is not None:
+        for t in tasks:
+            t.limit = limit
+    return names, tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('input', nargs='?', default='-',
+                        help="JSON List of the pods, '-' for stdin "
+                        "(default)")
+    parser.add_argument('--limit-bytes', type=parse_size,
+                        help='Maximum size of each log, e.g. 10Mi')
+    parser.add_argument('--since', type=parse_since,
+                        help='Only gather the current logs newer than this '
+                        'duration, e.g. 2h')
+    parser.add_argument('--budget', type=parse_size,
+                        help='Maximum size of all the logs, shared among '
+                        'the containers')
+    args = parser.parse_args()
+
+    try:
+        if args.input == '-':
+            pods = json.load(sys.stdin).get("items") or []
+        else:
+            with open(args.input, 'r') as f:
+                pods = json.load(f).get("items") or []
+    except (OSError, ValueError) as e:
+        print(f"Error reading the pods: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    names, tasks = plan(pods, args.limit_bytes, args.budget)
+    for name in names:
+        print(f"describe {name}")
+    for t in tasks:
+        print(t.line(args.since))
+
+
+if __name__ == '__main__':
+    main()
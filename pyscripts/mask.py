@@ -5,10 +5,24 @@ import yaml
 import base64
 from binascii import Error as binascii_error
 import argparse
+import fcntl
+import hashlib
 import re
 import os
 import sys
-from typing import Dict, Optional, Any, Union
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, IO, Iterator, List, Optional, Any, Tuple, Union
+
+# Prefer the libyaml based loader and dumpers when they are available: they
+# are several times faster than the pure-Python implementation, which is kept
+# as a fallback.
+try:
+    from yaml import CSafeLoader as SafeLoader
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CDumper as Dumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper, Dumper  # type: ignore
 
 # The following protect|connection keys have been collected from SoS project
 # https://github.com/sosreport/sos/blob/main/sos/report/plugins/openstack_*.py
@@ -52,6 +66,10 @@ ERR_FORMAT = "Required a dict for masking"
 # Masking string
 MASK_STR = "**********"
 
+# The libyaml and the pure-Python emitters fold long scalars at different
+# offsets: never fold them, so both implementations produce the same output
+YAML_WIDTH = 2 ** 31 - 1
+
 # general and connection regexes are used to match the pattern that should be
 # applied to both Protect keys and connection keys, which is the same thing
 # done in SoS reports
@@ -66,6 +84,346 @@ key_regex = r'(%s)$' % "|".join(PROTECT_KEYS)
 conf_file_regex = r'(.*).(conf)$'
 regexes = [gen_regex, con_regex]
 
+# Identifies the masking rules: files recorded in a manifest by a different
+# version of the rules are masked again
+MASK_VERSION = hashlib.sha256(
+    "\n".join(regexes + [key_regex, MASK_STR]).encode()).hexdigest()[:16]
+
+# Regex metacharacters that end the literal prefix of a key
+REGEX_META = set('.^$*+?{}[]|()\\')
+
+
+def _literal_prefix(pattern: str) -> str:
+    """
+    Return the lower-cased literal text a match of pattern must start with,
+    e.g. 'FernetKeys\\d' -> 'fernetkeys'.
+    """
+    out: List[str] = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern) and \
+                not pattern[i + 1].isalnum():
+            # escaped metacharacter, e.g. '\\.'
+            c = pattern[i + 1]
+            step = 2
+        elif c in REGEX_META:
+            break
+        else:
+            step = 1
+        if pattern[i + step:i + step + 1] in ('*', '?', '{'):
+            # the last char is optional, the prefix stops before it
+            break
+        out.append(c)
+        i += step
+    return "".join(out).lower()
+
+
+def _key_literals(key: str) -> List[str]:
+    """
+    Return the literal prefixes of a key, expanding a leading group of
+    alternatives, e.g. '(tls|ca)\\.(key|crt)' -> ['tls.', 'ca.'].
+    """
+    m = re.match(r'\(([\w|]+)\)', key)
+    if m:
+        rest = _literal_prefix(key[m.end():])
+        return [alt.lower() + rest for alt in m.group(1).split('|')]
+    return [_literal_prefix(key)]
+
+
+# Phases of the masking of a file reported by --stats
+STATS_PHASES = ["read", "parse", "decode", "regex", "annotation", "dump",
+                "write"]
+# Number of slowest files reported by --stats
+STATS_SLOWEST = 10
+
+
+class _Phase():
+    """
+    Context manager accounting the time spent in a phase to the file being
+    masked. Phases are exclusive: the time spent in a nested phase (e.g.
+    the regex pass on the content of an annotation) is only accounted to
+    the nested one.
+    """
+
+    def __init__(self, stats: "MaskStats", name: str) -> None:
+        self.stats = stats
+        self.name = name
+        self.start = 0.0
+        # time spent in the nested phases
+        self.nested = 0.0
+
+    def __enter__(self) -> "_Phase":
+        self.stats.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        elapsed = time.perf_counter() - self.start
+        self.stats.stack.pop()
+        if self.stats.stack:
+            self.stats.stack[-1].nested += elapsed
+        self.stats.count("phases", self.name, elapsed - self.nested)
+
+
+class _NoPhase():
+    """
+    Context manager used when the statistics are disabled.
+    """
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc: Any) -> None:
+        return None
+
+
+NO_PHASE = _NoPhase()
+
+
+class MaskStats():
+    """
+    Statistics of a masking pass, collected when --stats is passed: for each
+    file, the time spent in each phase, the bytes read, decoded and written,
+    and the number of matches per pattern; and the same data aggregated for
+    all the files.
+    """
+
+    def __init__(self, slowest: int = STATS_SLOWEST) -> None:
+        self.slowest: int = slowest
+        self.records: List[Dict[str, Any]] = []
+        self.current: Optional[Dict[str, Any]] = None
+        self.stack: List[_Phase] = []
+        self.start = 0.0
+        self.pid = os.getpid()
+
+    def _check_pid(self) -> None:
+        """
+        Forget the records inherited by a forked worker process: they are
+        reported by the parent.
+        """
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.records = []
+
+    @staticmethod
+    def new_record(path: str) -> Dict[str, Any]:
+        return {"path": path, "seconds": 0.0, "phases": {}, "bytes": {},
+                "matches": {}}
+
+    def start_file(self, path: str) -> None:
+        """
+        Start collecting the statistics of a file.
+        """
+        self._check_pid()
+        self.current = self.new_record(path)
+        self.stack = []
+        self.start = time.perf_counter()
+
+    def end_file(self) -> None:
+        """
+        Store the statistics of the current file.
+        """
+        if self.current is None:
+            return
+        self.current["seconds"] = time.perf_counter() - self.start
+        self.records.append(self.current)
+        self.current = None
+
+    def phase(self, name: str) -> _Phase:
+        return _Phase(self, name)
+
+    def count(self, section: str, key: str, n: Union[int, float]) -> None:
+        """
+        Add n to the key of a section (phases, bytes or matches) of the
+        current file.
+        """
+        if self.current is not None:
+            d = self.current[section]
+            d[key] = d.get(key, 0) + n
+
+    def take(self) -> List[Dict[str, Any]]:
+        """
+        Return and forget the stored records, e.g. to send them from a
+        worker process to the parent.
+        """
+        self._check_pid()
+        records, self.records = self.records, []
+        return records
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Return the aggregated and per-file statistics.
+        """
+        total = self.new_record("total")
+        del total["path"]
+        for r in self.records:
+            total["seconds"] += r["seconds"]
+            for section in ("phases", "bytes", "matches"):
+                for k, v in r[section].items():
+                    total[section][k] = total[section].get(k, 0) + v
+        slowest = sorted(self.records, key=lambda r: r["seconds"],
+                         reverse=True)[:self.slowest]
+        return {
+            "version": MASK_VERSION,
+            "phases": STATS_PHASES,
+            "file_count": len(self.records),
+            "total": total,
+            "slowest": slowest,
+            "files": self.records,
+        }
+
+    def save(self, path: str) -> None:
+        try:
+            with open(path, 'w') as f:
+                json.dump(self.report(), f, indent=2)
+        except IOError as e:
+            print(f"Error while writing the statistics {path}: {e}")
+
+
+# Statistics of the current process, None when they are disabled
+STATS: Optional[MaskStats] = None
+
+
+def enable_stats(slowest: int = STATS_SLOWEST) -> MaskStats:
+    """
+    Start collecting the masking statistics.
+    """
+    global STATS
+    if STATS is None:
+        STATS = MaskStats(slowest)
+    return STATS
+
+
+def get_stats() -> Optional[MaskStats]:
+    return STATS
+
+
+def timed(phase: str) -> Any:
+    """
+    Return a context manager accounting the time spent in phase to the
+    current file, or doing nothing when the statistics are disabled.
+    """
+    if STATS is None:
+        return NO_PHASE
+    return STATS.phase(phase)
+
+
+def count_stat(section: str, key: str, n: Union[int, float]) -> None:
+    if STATS is not None:
+        STATS.count(section, key, n)
+
+
+class KeywordMatcher():
+    """
+    Compiled form of a masking regex built as an alternation of keys.
+    Running the full regex over a long text is expensive (the leading \\w*
+    of gen_regex is retried at every word offset), so the text is first
+    scanned for the keys as plain lower-case literals, and the regex is only
+    tried where one of them has been found. The result is the same as
+    re.sub(pattern, repl, text, flags=re.I).
+    """
+
+    def __init__(self, pattern: str, keys: List[str], repl: str,
+                 word_prefix: bool = False, name: str = "regex") -> None:
+        # name of the pattern reported in the statistics
+        self.name: str = name
+        self.regex = re.compile(pattern, re.I)
+        self.repl: str = repl
+        # the pattern starts with \\w*, so a match begins at the start of
+        # the word that contains the key
+        self.word_prefix: bool = word_prefix
+        literals = set()
+        for k in keys:
+            literals.update(_key_literals(k))
+        # a key without a literal prefix can't be prefiltered
+        self.literals: Optional[List[str]] = None
+        if all(literals):
+            self.literals = sorted(literals)
+
+    def _lower(self, text: str) -> Optional[str]:
+        """
+        Lower-case text the same way re.I matches it, or return None if
+        the positions in the result don't map to the original text.
+        """
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            return None
+        # re.I also matches these with 'i' and 's'
+        if '\u0131' in lowered or '\u017f' in lowered:
+            lowered = lowered.replace('\u0131', 'i').replace('\u017f', 's')
+        return lowered
+
+    def _candidates(self, lowered: str) -> List[int]:
+        """
+        Return the sorted positions where a key literal starts.
+        """
+        assert self.literals is not None
+        found = set()
+        for lit in self.literals:
+            i = lowered.find(lit)
+            while i != -1:
+                found.add(i)
+                i = lowered.find(lit, i + 1)
+        return sorted(found)
+
+    def has_keyword(self, text: str) -> bool:
+        """
+        Return True if any of the keys may appear in text.
+        """
+        lowered = self._lower(text) if self.literals else None
+        if lowered is None:
+            return self.regex.search(text) is not None
+        assert self.literals is not None
+        return any(lit in lowered for lit in self.literals)
+
+    def sub(self, text: str) -> str:
+        """
+        Mask all the matches of the pattern in text.
+        """
+        lowered = self._lower(text) if self.literals else None
+        if lowered is None:
+            text, n = self.regex.subn(self.repl, text)
+            if n and STATS is not None:
+                STATS.count("matches", self.name, n)
+            return text
+
+        out: List[str] = []
+        pos = 0
+        tried = -1
+        for k in self._candidates(lowered):
+            start = k
+            if self.word_prefix:
+                while start > pos and (text[start - 1].isalnum()
+                                       or text[start - 1] == '_'):
+                    start -= 1
+            # a match at the start of the word covers any later offset of
+            # the same word, and nothing can start before pos
+            if start < pos or start == tried:
+                continue
+            tried = start
+            m = self.regex.match(text, start)
+            if m is None:
+                continue
+            out.append(text[pos:m.start()])
+            out.append(m.expand(self.repl))
+            pos = m.end()
+        if not out:
+            return text
+        if STATS is not None:
+            STATS.count("matches", self.name, len(out) // 2)
+        out.append(text[pos:])
+        return "".join(out)
+
+
+# Precompiled matchers applied to any text that should be masked
+matchers = [
+    KeywordMatcher(gen_regex, PROTECT_KEYS, r"\1{}".format(MASK_STR),
+                   word_prefix=True, name="gen_regex"),
+    KeywordMatcher(con_regex, CONNECTION_KEYS, r"\1{}".format(MASK_STR),
+                   name="con_regex"),
+]
+
 
 # Custom YAML representer to preserve multi-line strings as block scalars
 def str_representer(dumper: Any, data: str) -> Any:
@@ -75,6 +433,7 @@ def str_representer(dumper: Any, data: str) -> Any:
 
 
 yaml.add_representer(str, str_representer)
+yaml.add_representer(str, str_representer, Dumper=Dumper)
 
 
 class SecretMask():
@@ -90,15 +449,22 @@ class SecretMask():
                  dump: bool = False) -> None:
         self.path: Union[str, None] = path
         self.dump: bool = dump
+        # set when masking modified the secret
+        self.changed: bool = False
+        # config files dumped next to the secret
+        self.dumped: List[str] = []
 
-    def mask(self) -> bool:
+    def mask(self, s: Optional[Dict[str, Any]] = None) -> bool:
         """
         Read a k8s secret dumped as yaml and process the
         Data section: for each entry analyze the resulting
         dict and mask any sensitive info if the pattern is
         matched.
+        If the secret has already been loaded by the caller,
+        it can be passed as s to avoid parsing it again.
         """
-        s = self._readYaml()
+        if s is None:
+            s = self._readYaml()
         # s is None or empty dict, return
         if not s or len(s) == 0:
             return True
@@ -106,23 +472,33 @@ class SecretMask():
         # mask the dict containing k8s secret dump
         self._applyMask(s)
 
-        # write the resulting, masked/encoded file
-        self._writeYaml(dict(s))
+        # write the resulting, masked/encoded file, unless
+        # there was nothing to mask
+        if self.changed:
+            self._writeYaml(dict(s))
         return True
 
     def _applyAnnotationsMask(self, annotations: Dict[str, Any]) -> Dict[str, Any]:
         last_config = annotations.get("kubectl.kubernetes.io/last-applied-configuration", None)
         if not last_config:
             return annotations
+        with timed("annotation"):
+            return self._maskLastApplied(annotations, last_config)
+
+    def _maskLastApplied(self, annotations: Dict[str, Any],
+                         last_config: str) -> Dict[str, Any]:
         try:
             last_applied_config = json.loads(last_config)
 
             # recursively mask secrets within last-applied-configuration
             self._applyMask(last_applied_config)
-            annotations["kubectl.kubernetes.io/last-applied-configuration"] = json.dumps(last_applied_config, separators=(',', ':'))
+            masked = json.dumps(last_applied_config, separators=(',', ':'))
         except (json.JSONDecodeError, KeyError) as e:
             print(f"Error while parsing contents of kubectl.kubernetes.io/last-applied-configuration {e}")
-            annotations["kubectl.kubernetes.io/last-applied-configuration"] = MASK_STR
+            masked = MASK_STR
+        if masked != last_config:
+            annotations["kubectl.kubernetes.io/last-applied-configuration"] = masked
+            self.changed = True
         return annotations
 
     def _applyMask(self, s: Dict) -> None:
@@ -135,6 +511,8 @@ class SecretMask():
             # within last-applied-configuration
             if k == "data":
                 data = self._process_data(v)
+                if data != v:
+                    self.changed = True
                 s[k] = data
             elif k == "metadata" and "annotations" in s[k]:
                 s[k]["annotations"] = self._applyAnnotationsMask(s[k]["annotations"])
@@ -148,13 +526,21 @@ class SecretMask():
         try:
             assert self.path is not None
             with open(self.path, 'r') as f:
-                s = yaml.safe_load(f)
+                s = yaml.load(f, Loader=SafeLoader)
             return s
         except (FileNotFoundError, yaml.YAMLError) as e:
             print(f"Error while reading YAML: {e}")
             sys.exit(-1)
         return s
 
+    def _dumpYaml(self, encoded_secret: Any) -> str:
+        """
+        Serialize the masked secret as yaml.
+        """
+        with timed("dump"):
+            return yaml.dump(encoded_secret, Dumper=SafeDumper,
+                             default_flow_style=False, width=YAML_WIDTH)
+
     def _writeYaml(self, encoded_secret: Any) -> None:
         """
         Re-write the masked secret in the same
@@ -162,9 +548,8 @@ class SecretMask():
         """
         try:
             assert self.path is not None
-            with open(self.path, 'w') as f:
-                yaml.safe_dump(encoded_secret, f,
-                               default_flow_style=False)
+            content = self._dumpYaml(encoded_secret)
+            write_text(self.path, content)
         except (IOError, yaml.YAMLError) as e:
             print(f"Error while writing the masked file: {e}")
 
@@ -175,8 +560,8 @@ class SecretMask():
         """
         try:
             assert path is not None
-            with open(path, 'w') as f:
-                f.write(encoded_secret)
+            write_text(path, encoded_secret)
+            self.dumped.append(path)
         except IOError as e:
             print(f"Error while writing the masked file: {e}")
 
@@ -186,9 +571,9 @@ class SecretMask():
         to match the pattern according to the provided
         regexes and mask any potential sensitive info.
         """
-        for pattern in regexes:
-            decoded_secret = re.sub(pattern, r"\1{}".format(MASK_STR),
-                                    decoded_secret, flags=re.I)
+        with timed("regex"):
+            for matcher in matchers:
+                decoded_secret = matcher.sub(decoded_secret)
         return decoded_secret
 
     def _process_data(self, data_map: Any) -> Any:
@@ -218,9 +603,13 @@ class SecretMask():
             if re.findall(key_regex, k, re.IGNORECASE):
                 # mask the value of the key entirely
                 masked = MASK_STR
+                count_stat("matches", "key_regex", 1)
             else:
                 try:
-                    masked = self._apply_regex(base64.b64decode(v).decode())
+                    with timed("decode"):
+                        decoded = base64.b64decode(v).decode()
+                    count_stat("bytes", "decoded", len(decoded))
+                    masked = self._apply_regex(decoded)
                     if self.dump and re.search(conf_file_regex, k):
                         self._writeFile('{}-{}'.format(self.path, k), masked)
                 except (binascii_error, UnicodeDecodeError):
@@ -228,7 +617,8 @@ class SecretMask():
                     d[k] = ERR_STR
                     continue
             # re-encode the entry
-            d[k] = base64.b64encode(masked.encode()).decode()
+            with timed("decode"):
+                d[k] = base64.b64encode(masked.encode()).decode()
         return d
 
 
@@ -240,21 +630,27 @@ class PlaintextMask():
 
     def __init__(self, path: Optional[str] = None) -> None:
         self.path: Union[str, None] = path
+        # set when masking modified the resource
+        self.changed: bool = False
 
-    def mask(self) -> bool:
+    def mask(self, resource: Optional[Any] = None) -> bool:
         """
         Read a k8s resource (ConfigMap or CR) dumped as yaml and process
         recursively to mask any sensitive information.
+        If the resource has already been loaded by the caller, it can be
+        passed as resource to avoid parsing it again.
         """
-        resource = self._readYaml()
+        if resource is None:
+            resource = self._readYaml()
         if not resource or len(resource) == 0:
             return True
 
         # Recursively mask the entire resource
         self._applyMaskRecursive(resource)
 
-        # Write the masked file
-        self._writeYaml(resource)
+        # Write the masked file, unless there was nothing to mask
+        if self.changed:
+            self._writeYaml(resource)
         return True
 
     def _readYaml(self) -> Dict[str, Any]:
@@ -264,22 +660,30 @@ class PlaintextMask():
         try:
             assert self.path is not None
             with open(self.path, 'r') as f:
-                resource = yaml.safe_load(f)
+                resource = yaml.load(f, Loader=SafeLoader)
             return resource if resource else {}
         except (FileNotFoundError, yaml.YAMLError) as e:
             print(f"Error while reading YAML {self.path}: {e}")
             return {}
 
+    def _dumpYaml(self, resource: Any) -> str:
+        """
+        Serialize the masked resource as yaml.
+        """
+        # Dump with settings to preserve readability
+        with timed("dump"):
+            return yaml.dump(resource, Dumper=Dumper,
+                             default_flow_style=False, allow_unicode=True,
+                             sort_keys=False, width=YAML_WIDTH)
+
     def _writeYaml(self, resource: Any) -> None:
         """
         Re-write the masked resource to the same path.
         """
         try:
             assert self.path is not None
-            with open(self.path, 'w') as f:
-                # Write with settings to preserve readability
-                yaml.dump(resource, f, default_flow_style=False,
-                          allow_unicode=True, sort_keys=False)
+            content = self._dumpYaml(resource)
+            write_text(self.path, content)
         except (IOError, yaml.YAMLError) as e:
             print(f"Error while writing the masked file {self.path}: {e}")
 
@@ -298,18 +702,25 @@ class PlaintextMask():
                     # If key name matches sensitive pattern and value is single-line, fully mask
                     # This catches: password: secret123, transport_url: mysql://..., etc.
                     if re.search(key_regex, key) and '\n' not in value:
-                        obj[key] = MASK_STR
+                        masked = MASK_STR
+                        count_stat("matches", "key_regex", 1)
                     else:
                         # Parse content to mask sensitive parts
                         # This handles: customServiceConfig blocks (multi-line), long configs, etc.
-                        obj[key] = self._applyRegex(value)
+                        masked = self._applyRegex(value)
+                    if masked != value:
+                        obj[key] = masked
+                        self.changed = True
                 elif isinstance(value, (dict, list)):
                     # Recursively process nested structures
                     self._applyMaskRecursive(value)
         elif isinstance(obj, list):
             for i, item in enumerate(obj):
                 if isinstance(item, str):
-                    obj[i] = self._applyRegex(item)
+                    masked = self._applyRegex(item)
+                    if masked != item:
+                        obj[i] = masked
+                        self.changed = True
                 elif isinstance(item, (dict, list)):
                     self._applyMaskRecursive(item)
         return obj
@@ -319,37 +730,81 @@ class PlaintextMask():
         Apply regex patterns to mask sensitive information in text.
         Handles both single-line and multi-line strings.
         """
-        for pattern in regexes:
-            text = re.sub(pattern, r"\1{}".format(MASK_STR), text, flags=re.MULTILINE | re.IGNORECASE)
+        with timed("regex"):
+            for matcher in matchers:
+                text = matcher.sub(text)
         return text
 
 
+def write_text(path: str, content: str) -> None:
+    """
+    Write content to path, accounting the write in the statistics.
+    """
+    with timed("write"):
+        with open(path, 'w') as f:
+            f.write(content)
+    count_stat("bytes", "written", len(content))
+
+
+def load_resource(path: str) -> Any:
+    """
+    Read and load a k8s resource dumped as yaml file.
+    """
+    with open(path, 'r') as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+
+def needs_masking(text: str) -> bool:
+    """
+    Cheap scan of the raw content of a resource: return False if it can't
+    contain anything to mask, so parsing and rewriting it can be skipped.
+    Secrets are always processed, as their sensitive content is only
+    visible once the base64 encoded data has been decoded.
+    """
+    if re.search(r'\bSecret\b', text):
+        return True
+    return any(m.has_keyword(text) for m in matchers)
+
+
 def get_resource_kind(path: str) -> Optional[str]:
     """
     Read a YAML file and return its 'kind' field to determine resource type.
     Returns None if the file cannot be read or doesn't have a 'kind' field.
     """
     try:
-        with open(path, 'r') as f:
-            resource = yaml.safe_load(f)
-            if isinstance(resource, dict):
-                return resource.get('kind', None)
+        resource = load_resource(path)
+        if isinstance(resource, dict):
+            return resource.get('kind', None)
     except (FileNotFoundError, yaml.YAMLError) as e:
         print(f"Error while reading YAML to determine kind: {e}")
     return None
 
 
-def mask_data(data: Dict[str, Any], path: str) -> bool:
+def mask_data(data: Dict[str, Any], path: str,
+              dump_conf: bool = False,
+              written: Optional[List[str]] = None) -> bool:
     """
     Mask an already-parsed resource dict and write the result to path.
     Avoids a redundant YAML load when the caller already has the data
     in memory (e.g. after splitting a ConfigMapList).
+    The files written, path and the config files dumped from a secret,
+    are appended to written when given.
     """
     if not data:
         return True
+    # path is a new file: write it even if nothing has been masked
+    if data.get('kind') == "Secret":
+        s = SecretMask(path, dump_conf)
+        s._applyMask(data)
+        s._writeYaml(dict(data))
+        if written is not None:
+            written.extend([path] + s.dumped)
+        return True
     m = PlaintextMask(path)
     m._applyMaskRecursive(data)
     m._writeYaml(data)
+    if written is not None:
+        written.append(path)
     return True
 
 
@@ -359,14 +814,315 @@ def mask_resource(path: str, dump_conf: bool = False) -> bool:
     the appropriate masking strategy:
     - Secrets: Use SecretMask (base64 decode/encode)
     - ConfigMaps/CRs/Other: Use PlaintextMask (direct text masking)
+    The file is parsed once and the resulting resource is handed to the
+    selected masker; files without anything to mask are left untouched.
     """
-    kind = get_resource_kind(path)
+    if STATS is None:
+        return _mask_resource(path, dump_conf)
+    STATS.start_file(path)
+    try:
+        return _mask_resource(path, dump_conf)
+    finally:
+        STATS.end_file()
+
+
+def _mask_resource(path: str, dump_conf: bool = False) -> bool:
+    try:
+        with timed("read"):
+            with open(path, 'r') as f:
+                raw = f.read()
+        count_stat("bytes", "read", len(raw))
+        with timed("regex"):
+            if not needs_masking(raw):
+                return True
+        with timed("parse"):
+            resource = yaml.load(raw, Loader=SafeLoader)
+    except (FileNotFoundError, UnicodeDecodeError, yaml.YAMLError) as e:
+        print(f"Error while reading YAML {path}: {e}")
+        return False
+
+    if not resource:
+        return True
 
-    if kind == "Secret":
-        return SecretMask(path, dump_conf).mask()
+    if isinstance(resource, dict) and resource.get('kind') == "Secret":
+        return SecretMask(path, dump_conf).mask(resource)
     else:
         # ConfigMaps, CRs, and any other resource type
-        return PlaintextMask(path).mask()
+        return PlaintextMask(path).mask(resource)
+
+
+def mask_stream(stream: IO[str], path: str, dump_conf: bool = False,
+                manifest: Optional["MaskManifest"] = None) -> bool:
+    """
+    Filter mode: mask the yaml documents read from stream (e.g. the output
+    of oc get piped to mask.py) in memory, with the same logic applied by
+    mask_resource, and write only the masked result to path. Nothing is
+    written if the input is empty (e.g. the command piped to mask.py
+    failed) or can't be parsed, so unmasked data never lands on disk.
+    """
+    if STATS is None:
+        return _mask_stream(stream, path, dump_conf, manifest)
+    STATS.start_file(path)
+    try:
+        return _mask_stream(stream, path, dump_conf, manifest)
+    finally:
+        STATS.end_file()
+
+
+def _mask_stream(stream: IO[str], path: str, dump_conf: bool,
+                 manifest: Optional["MaskManifest"]) -> bool:
+    with timed("read"):
+        raw = stream.read()
+    count_stat("bytes", "read", len(raw))
+    if not raw.strip():
+        print(f"Error: no input to mask for {path}")
+        return False
+    content = raw
+    with timed("regex"):
+        to_mask = needs_masking(raw)
+    if to_mask:
+        try:
+            with timed("parse"):
+                docs = [d for d in yaml.load_all(raw, Loader=SafeLoader)
+                        if d is not None]
+        except yaml.YAMLError as e:
+            print(f"Error while reading YAML for {path}: {e}")
+            return False
+
+        masked = []
+        changed = False
+        for doc in docs:
+            if isinstance(doc, dict) and doc.get('kind') == "Secret":
+                s = SecretMask(path, dump_conf)
+                s._applyMask(doc)
+                masked.append(s._dumpYaml(dict(doc)))
+                changed = changed or s.changed
+            else:
+                p = PlaintextMask(path)
+                p._applyMaskRecursive(doc)
+                masked.append(p._dumpYaml(doc))
+                changed = changed or p.changed
+        # keep the original content if there was nothing to mask
+        if changed:
+            content = "---\n".join(masked)
+
+    try:
+        write_text(path, content)
+    except IOError as e:
+        print(f"Error while writing the masked file {path}: {e}")
+        return False
+
+    if manifest is not None:
+        manifest.record(path, file_entry(path, dump_conf))
+        manifest.save()
+    return True
+
+
+def find_resources(path: str) -> Iterator[str]:
+    """
+    Walk the directory tree rooted at path and yield every YAML file
+    that should be masked.
+    """
+    for root, subdirs, files in os.walk(path):
+        for f in files:
+            # Skip non-YAML files
+            if not f.endswith('.yaml') and not f.endswith('.yml'):
+                continue
+            yield os.path.join(root, f)
+
+
+def default_jobs() -> int:
+    """
+    Return the number of CPUs this process is allowed to run on, which
+    in a must-gather pod can be lower than the number of host CPUs.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def file_entry(path: str, dump_conf: bool = False) -> Dict[str, Any]:
+    """
+    Describe the current content of a masked file, as recorded in a
+    MaskManifest.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+        st = os.fstat(f.fileno())
+    return {
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "sha256": h.hexdigest(),
+        "version": MASK_VERSION,
+        "dump_conf": dump_conf,
+    }
+
+
+def is_masked(path: str, entry: Optional[Dict[str, Any]],
+              dump_conf: bool = False) -> bool:
+    """
+    Return True if path still has the content recorded in entry after
+    it has been masked with the current rules. The files rewritten since
+    (another size or mtime) are not hashed again.
+    """
+    if not entry or entry.get("version") != MASK_VERSION:
+        return False
+    # the config files of the secret have not been dumped yet
+    if dump_conf and not entry.get("dump_conf"):
+        return False
+    try:
+        st = os.stat(path)
+        if st.st_size != entry.get("size") or \
+                st.st_mtime != entry.get("mtime"):
+            return False
+        return file_entry(path)["sha256"] == entry.get("sha256")
+    except OSError:
+        return False
+
+
+class MaskManifest():
+    """
+    Record of the files masked by previous mask.py passes over the same
+    collection: for each path, its size, mtime and content hash after
+    masking, and the version of the masking rules. Masking is idempotent,
+    so a file whose content still matches its entry can be skipped.
+    The manifest is a JSON lines file where later entries for a path
+    replace the earlier ones, so each run only appends its own records.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path: Union[str, None] = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.updates: Dict[str, Dict[str, Any]] = {}
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.entries = self._parse(f)
+
+    def _parse(self, lines: Iterator[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Load the manifest entries; corrupted lines are ignored, which
+        only means that the associated files are masked again.
+        """
+        entries = {}
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                entries[entry.pop("path")] = entry
+            except (ValueError, AttributeError, KeyError, TypeError):
+                continue
+        return entries
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the entry recorded for path, if any.
+        """
+        return self.entries.get(os.path.abspath(path))
+
+    def record(self, path: str, entry: Dict[str, Any]) -> None:
+        """
+        Record the entry of a masked file, written by save().
+        """
+        self.updates[os.path.abspath(path)] = entry
+
+    def save(self) -> None:
+        """
+        Append the recorded entries to the manifest file. The file is
+        locked while writing, so the lines of concurrent mask.py runs
+        don't interleave.
+        """
+        if self.path is None or not self.updates:
+            return
+        lines = "".join(json.dumps(dict(entry, path=path), sort_keys=True) + "\n"
+                        for path, entry in self.updates.items())
+        try:
+            with open(self.path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                # don't append to a truncated line
+                end = f.seek(0, os.SEEK_END)
+                if end > 0:
+                    f.seek(end - 1)
+                    if f.read(1) != "\n":
+                        lines = "\n" + lines
+                f.write(lines)
+            self.entries.update(self.updates)
+            self.updates = {}
+        except IOError as e:
+            print(f"Error while writing the mask manifest {self.path}: {e}")
+
+
+def _mask_worker(args: Tuple[str, bool, Optional[Dict[str, Any]]]
+                 ) -> Tuple[bool, Optional[Dict[str, Any]],
+                            List[Dict[str, Any]]]:
+    """
+    Worker entry point used by mask_dir: mask a single file, unless entry
+    shows it has already been masked, and return whether it succeeded
+    along with the manifest entry for its masked content, and the
+    statistics collected for the file.
+    """
+    path, dump_conf, entry = args
+    ok, entry = _mask_file(path, dump_conf, entry)
+    return ok, entry, STATS.take() if STATS is not None else []
+
+
+def _mask_file(path: str, dump_conf: bool, entry: Optional[Dict[str, Any]]
+               ) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    if entry is not None and is_masked(path, entry, dump_conf):
+        return True, entry
+    try:
+        ok = mask_resource(path, dump_conf)
+    except SystemExit:
+        # SecretMask exits on unreadable files: the error has already been
+        # printed, so keep the pool alive and only fail this file
+        return False, None
+    if not ok or entry is None:
+        return ok, None
+    try:
+        return ok, file_entry(path, dump_conf)
+    except OSError:
+        return ok, None
+
+
+def mask_dir(path: str, dump_conf: bool = False, jobs: int = 1,
+             manifest: Optional[MaskManifest] = None) -> bool:
+    """
+    Mask all the YAML files found in the path directory tree.
+    When jobs is greater than 1, files are sharded across a pool of
+    worker processes; each file is still masked by mask_resource, so the
+    result is the same as the serial path.
+    When a manifest is passed, files it records as already masked are
+    skipped, and the masked ones are added to it.
+    """
+    files: List[str] = list(find_resources(path))
+    # an empty entry asks the worker to describe the masked file
+    tasks = [(f, dump_conf, (manifest.get(f) or {}) if manifest else None)
+             for f in files]
+    if jobs <= 1 or len(files) <= 1:
+        results = [_mask_worker(t) for t in tasks]
+    else:
+        workers = min(jobs, len(files))
+        # group files in chunks to limit the IPC round trips per file, but
+        # keep them small enough to balance large and small files across
+        # workers
+        chunksize = max(1, len(files) // (workers * 4))
+        # flush pending output so forked workers don't inherit and print
+        # it again
+        sys.stdout.flush()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_mask_worker, tasks,
+                                        chunksize=chunksize))
+
+    if STATS is not None:
+        for ok, entry, records in results:
+            STATS.records.extend(records)
+    if manifest is not None:
+        for f, (ok, entry, records) in zip(files, results):
+            if entry is not None:
+                manifest.record(f, entry)
+        manifest.save()
+    return all(r[0] for r in results)
 
 
 def parse_opts(argv: Any) -> Any:
@@ -384,25 +1140,56 @@ def parse_opts(argv: Any) -> Any:
     parser.add_argument('--dump-conf', action='store_true',
                         help="Dump the config files retrieved for a given \
                         service")
+    parser.add_argument('-j', '--jobs', metavar='N', type=int,
+                        default=default_jobs(),
+                        help="Number of worker processes used to mask the \
+                        files found in DIR_PATH (default: available CPUs)")
+    parser.add_argument('-m', '--manifest', metavar='MANIFEST_PATH',
+                        help="Manifest of the masked files: files already \
+                        masked by a previous run are skipped")
+    parser.add_argument('--stdin', action='store_true',
+                        help="Mask the yaml documents read from stdin and \
+                        write the result to OUT_PATH")
+    parser.add_argument('-o', '--out', metavar='OUT_PATH',
+                        help="Path of the file where the masked stdin \
+                        content is written")
+    parser.add_argument('--stats', metavar='STATS_PATH',
+                        help="Write the masking statistics (time spent in \
+                        each phase, bytes, matches per pattern, slowest \
+                        files) as JSON to STATS_PATH")
+    parser.add_argument('--stats-slowest', metavar='N', type=int,
+                        default=STATS_SLOWEST,
+                        help="Number of slowest files reported in the \
+                        statistics (default: %(default)s)")
     opts = parser.parse_args(argv[1:])
+    if opts.stdin and opts.out is None:
+        parser.error("--stdin requires --out")
     return opts
 
 
 if __name__ == '__main__':
     # parse the provided options
     OPTS = parse_opts(sys.argv)
+    rc = 0
+    if OPTS.stats:
+        enable_stats(OPTS.stats_slowest)
+
+    if OPTS.stdin:
+        manifest = MaskManifest(OPTS.manifest) if OPTS.manifest else None
+        if not mask_stream(sys.stdin, OPTS.out, OPTS.dump_conf, manifest):
+            rc = -1
 
     if OPTS.dir is not None and os.path.exists(OPTS.dir):
         # reset OPTS.path in case it has been passed as
         # argument and process all the files found in
         # that directory
-        for root, subdirs, files in os.walk(OPTS.dir):
-            for f in files:
-                # Skip non-YAML files
-                if not f.endswith('.yaml') and not f.endswith('.yml'):
-                    continue
-                file_path = os.path.join(root, f)
-                mask_resource(file_path, OPTS.dump_conf)
+        manifest = MaskManifest(OPTS.manifest) if OPTS.manifest else None
+        if not mask_dir(OPTS.dir, OPTS.dump_conf, OPTS.jobs, manifest):
+            rc = -1
 
     if OPTS.path is not None and os.path.exists(OPTS.path):
         mask_resource(OPTS.path, OPTS.dump_conf)
+
+    if STATS is not None:
+        STATS.save(OPTS.stats)
+    sys.exit(rc)
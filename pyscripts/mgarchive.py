@@ -0,0 +1,607 @@
+#!/usr/bin/env python3
+
+"""
+Create and read indexed must-gather archives. Only the Python standard
+library is used.
+
+The archive is a tar file compressed with xz, so that it can still be
+extracted with 'tar xJf', but the tar stream is compressed in independent
+blocks of about --block-size bytes (concatenated xz streams), in parallel
+on several cores. A catalog written next to it, one JSON record per line,
+lists its members:
+    {"path": ..., "type": "file", "kind": ..., "namespace": ...,
+     "offset": ..., "csize": ..., "skip": ..., "size": ..., "sha256": ...}
+where offset and csize are the position and the size of the compressed
+blocks holding the content of the member, which starts skip bytes after
+the beginning of the first block, and size is its uncompressed size.
+Hardlinks have the path of the file they are linked to in target, and
+its kind. The kind
+is the kind of the Kubernetes resources, or the type of the file (log,
+describe, sql, sos, file). So a single member is read by decompressing a
+few blocks, instead of the whole archive:
+
+    mgarchive.py create -j 4 must-gather.tar.xz /must-gather
+    mgarchive.py list must-gather.tar.xz --namespace openstack --kind Pod
+    mgarchive.py cat must-gather.tar.xz '*/nova-api-0/logs/nova-api.log'
+    mgarchive.py grep must-gather.tar.xz 'ERROR' --member '*.log'
+    mgarchive.py extract -C /tmp/mg must-gather.tar.xz 'namespaces/openstack/*'
+
+Members are selected with shell patterns, matching their path with or
+without the top directory of the archive. Members already compressed
+(e.g. the SOS reports) are stored in their own blocks, compressed with the
+fastest preset, and the gzip members are decompressed by grep.
+"""
+
+import argparse
+import bisect
+import collections
+import concurrent.futures
+import fnmatch
+import hashlib
+import json
+import lzma
+import os
+import re
+import stat
+import sys
+import tarfile
+import zlib
+
+# uncompressed size of the blocks
+BLOCK_SIZE = 4 << 20
+PRESET = 6
+# members already compressed, stored with the fastest preset
+COMPRESSED_SUFFIXES = (".gz", ".xz", ".bz2", ".zst", ".zip", ".tgz")
+FAST_PRESET = 0
+READ_SIZE = 1 << 20
+# the kind and the namespace of the resources are looked up at the
+# beginning of the yaml files
+SNIFF_SIZE = 64 << 10
+KIND_RE = re.compile(rb'^kind: *["\']?([A-Za-z0-9]+)', re.MULTILINE)
+NAMESPACE_RE = re.compile(rb'^  namespace: *["\']?([a-z0-9.-]+)', re.MULTILINE)
+
+
+class ArchiveError(Exception):
+    """
+    Error reading an archive or its catalog.
+    """
+
+
+def catalog_path(archive):
+    """
+    Return the path of the catalog of an archive: must-gather.tar.xz has
+    its catalog in must-gather.catalog.jsonl.
+    """
+    base = archive
+    for suffix in (".xz", ".tar"):
+        if base.endswith(suffix):
+            base = base[:-len(suffix)]
+    return base + ".catalog.jsonl"
+
+
+def member_kind(path, head):
+    """
+    Return the kind of a member from its path and the beginning of its
+    content.
+    """
+    name = os.path.basename(path)
+    parts = path.split("/")
+    if "sos-reports" in parts:
+        return "sos"
+    if name.endswith((".sql", ".sql.gz")):
+        return "sql"
+    if name.endswith("-describe"):
+        return "describe"
+    if name.endswith((".log", ".log.gz")) or "logs" in parts:
+        return "log"
+    if name.endswith((".yaml", ".yml")):
+        m = KIND_RE.search(head)
+        if m:
+            return m.group(1).decode()
+    return "file"
+
+
+def member_namespace(path, head):
+    """
+    Return the namespace of a member, from the namespaces/<namespace>
+    directory it's in or the metadata of the resource.
+    """
+    parts = path.split("/")
+    if "namespaces" in parts[:-2]:
+        return parts[parts.index("namespaces") + 1]
+    if path.endswith((".yaml", ".yml")):
+        m = NAMESPACE_RE.search(head)
+        if m:
+            return m.group(1).decode()
+    return None
+
+
+def compress_block(block):
+    """
+    Compress a block, given with its preset, as an xz stream.
+    """
+    data, preset = block
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=preset)
+
+
+class BlockWriter():
+    """
+    Cut the uncompressed tar stream in blocks, compressed in parallel by
+    jobs processes, and write them in order. The position of each block
+    in the uncompressed and compressed streams are recorded.
+    """
+
+    def __init__(self, out, jobs=1, block_size=BLOCK_SIZE, preset=PRESET):
+        self.out = out
+        self.block_size = block_size
+        self.default_preset = preset
+        self.preset = preset
+        self.buffer = []
+        self.buffered = 0
+        # position of the next byte of the uncompressed stream
+        self.position = 0
+        # uncompressed start, compressed start and size of the blocks
+        self.starts = []
+        self.offsets = []
+        self.sizes = []
+        self.written = 0
+        self.pending = collections.deque()
+        self.jobs = jobs
+        self.executor = None
+        if jobs > 1:
+            self.executor = concurrent.futures.ProcessPoolExecutor(jobs)
+
+    def set_preset(self, preset):
+        """
+        Start a new block if the following data is compressed with
+        another preset.
+        """
+        preset = self.default_preset if preset is None else preset
+        if preset != self.preset:
+            self.flush()
+            self.preset = preset
+
+    def write(self, data):
+        if not data:
+            return
+        self.buffer.append(data)
+        self.buffered += len(data)
+        self.position += len(data)
+        if self.buffered >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Queue the buffered data as a block.
+        """
+        if not self.buffer:
+            return
+        self.starts.append(self.position - self.buffered)
+        block = (b"".join(self.buffer), self.preset)
+        self.buffer = []
+        self.buffered = 0
+        if self.executor is None:
+            self._write(compress_block(block))
+            return
+        self.pending.append(self.executor.submit(compress_block, block))
+        # bound the memory used by the blocks waiting to be written
+        while len(self.pending) > 2 * self.jobs:
+            self._write(self.pending.popleft().result())
+
+    def _write(self, compressed):
+        self.out.write(compressed)
+        self.offsets.append(self.written)
+        self.sizes.append(len(compressed))
+        self.written += len(compressed)
+
+    def close(self):
+        self.flush()
+        while self.pending:
+            self._write(self.pending.popleft().result())
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def locate(self, start, size):
+        """
+        Return the compressed offset and size of the blocks holding the
+        uncompressed bytes [start, start + size), and the position of
+        start in the first of them.
+        """
+        first = bisect.bisect_right(self.starts, start) - 1
+        last = max(first, bisect.bisect_right(self.starts,
+                                              start + size - 1) - 1)
+        offset = self.offsets[first]
+        end = self.offsets[last] + self.sizes[last]
+        return offset, end - offset, start - self.starts[first]
+
+
+def walk(source, excludes):
+    """
+    Yield the paths of the directories and files of the source directory,
+    parents first, skipping the ones whose name matches an exclude pattern.
+    """
+    yield source
+    for root, dirs, files in os.walk(source):
+        dirs[:] = sorted(d for d in dirs
+                         if not any(fnmatch.fnmatch(d, p) for p in excludes))
+        for name in dirs:
+            yield os.path.join(root, name)
+        for name in sorted(files):
+            if not any(fnmatch.fnmatch(name, p) for p in excludes):
+                yield os.path.join(root, name)
+
+
+def tar_info(path, name, st):
+    """
+    Return the tar header of a file from its status.
+    """
+    info = tarfile.TarInfo(name)
+    info.mode = stat.S_IMODE(st.st_mode)
+    info.mtime = int(st.st_mtime)
+    info.uid, info.gid = st.st_uid, st.st_gid
+    if stat.S_ISDIR(st.st_mode):
+        info.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(st.st_mode):
+        info.type = tarfile.SYMTYPE
+        info.linkname = os.readlink(path)
+    else:
+        info.size = st.st_size
+    return info
+
+
+def header(info):
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+
+def add_file(writer, path, info):
+    """
+    Write the header and the content of a regular file, padded to the
+    size recorded in the header if it shrank while it was read, and
+    return the start of its content, its hash and its beginning.
+    """
+    with open(path, 'rb') as f:
+        writer.write(header(info))
+        start = writer.position
+        digest = hashlib.sha256()
+        head = b""
+        left = info.size
+        while left > 0:
+            chunk = f.read(min(READ_SIZE, left))
+            if not chunk:
+                print(f"{path}: file shrank, padded with zeros",
+                      file=sys.stderr)
+                chunk = bytes(min(READ_SIZE, left))
+            if len(head) < SNIFF_SIZE:
+                head += chunk[:SNIFF_SIZE - len(head)]
+            digest.update(chunk)
+            writer.write(chunk)
+            left -= len(chunk)
+    writer.write(bytes(-info.size % tarfile.BLOCKSIZE))
+    return start, digest.hexdigest(), head
+
+
+def create(archive, source, jobs=1, excludes=(), block_size=BLOCK_SIZE,
+           preset=PRESET):
+    """
+    Write the archive of the source directory and its catalog, and return
+    the number of members of the catalog.
+    """
+    source = os.path.abspath(source)
+    top = os.path.basename(source)
+    excludes = list(excludes) + [os.path.basename(archive),
+                                 os.path.basename(catalog_path(archive))]
+    entries = []
+    links = {}
+    with open(archive, 'wb') as out:
+        writer = BlockWriter(out, jobs, block_size, preset)
+        try:
+            for path in walk(source, excludes):
+                rel = os.path.relpath(path, source)
+                name = top if rel == "." else f"{top}/{rel}"
+                try:
+                    st = os.lstat(path)
+                    info = tar_info(path, name, st)
+                except OSError as e:
+                    print(f"{path}: {e}", file=sys.stderr)
+                    continue
+                if not info.isreg():
+                    writer.set_preset(None)
+                    writer.write(header(info))
+                    if info.issym():
+                        entries.append({"path": name, "type": "symlink",
+                                        "target": info.linkname})
+                    continue
+                key = (st.st_dev, st.st_ino)
+                if st.st_nlink > 1 and key in links:
+                    info.type = tarfile.LNKTYPE
+                    info.linkname = links[key]["path"]
+                    info.size = 0
+                    writer.set_preset(None)
+                    writer.write(header(info))
+                    target = links[key]
+                    entries.append({"path": name, "type": "link",
+                                    "target": target["path"],
+                                    "kind": target["kind"],
+                                    "namespace": member_namespace(
+                                        name, b"") or target["namespace"]})
+                    continue
+                writer.set_preset(FAST_PRESET if name.endswith(
+                    COMPRESSED_SUFFIXES) else None)
+                try:
+                    start, digest, head = add_file(writer, path, info)
+                except OSError as e:
+                    print(f"{path}: {e}", file=sys.stderr)
+                    continue
+                links[key] = {"path": name, "type": "file",
+                              "kind": member_kind(name, head),
+                              "namespace": member_namespace(name, head),
+                              "start": start, "size": info.size,
+                              "sha256": digest}
+                entries.append(links[key])
+            writer.set_preset(None)
+            writer.write(bytes(2 * tarfile.BLOCKSIZE))
+        finally:
+            writer.close()
+
+    with open(catalog_path(archive), 'w') as f:
+        for entry in entries:
+            if entry["type"] == "file":
+                start = entry.pop("start")
+                offset, csize, skip = writer.locate(start, entry["size"])
+                entry.update(offset=offset, csize=csize, skip=skip)
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+    return len(entries)
+
+
+class Archive():
+    """
+    An archive opened with its catalog, to read single members.
+    """
+
+    def __init__(self, archive, catalog=None):
+        self.path = archive
+        catalog = catalog or catalog_path(archive)
+        try:
+            with open(catalog, 'r') as f:
+                self.entries = [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError) as e:
+            raise ArchiveError(f"can't read the catalog {catalog}: {e}")
+        self.by_path = {e["path"]: e for e in self.entries}
+        self.file = open(archive, 'rb')
+        # the last decompressed block, consecutive small members share it
+        self.cached = (None, None, 0)
+
+    def close(self):
+        self.file.close()
+
+    def select(self, patterns=(), namespace=None, kind=None):
+        """
+        Return the entries matching one of the patterns, if any, and the
+        namespace and kind, if given.
+        """
+        selected = []
+        for entry in self.entries:
+            if namespace and entry.get("namespace") != namespace:
+                continue
+            if kind and entry.get("kind") != kind:
+                continue
+            if patterns:
+                short = entry["path"].partition("/")[2]
+                if not any(fnmatch.fnmatch(entry["path"], p)
+                           or fnmatch.fnmatch(short, p) for p in patterns):
+                    continue
+            selected.append(entry)
+        return selected
+
+    def _block(self, offset):
+        """
+        Return the decompressed block at offset, and its compressed size.
+        """
+        if self.cached[0] == offset:
+            return self.cached[1], self.cached[2]
+        decomp = lzma.LZMADecompressor(lzma.FORMAT_XZ)
+        self.file.seek(offset)
+        out = []
+        size = 0
+        while not decomp.eof:
+            chunk = self.file.read(READ_SIZE)
+            if not chunk:
+                raise ArchiveError(f"{self.path}: truncated block at "
+                                   f"offset {offset}")
+            out.append(decomp.decompress(chunk))
+            size += len(chunk)
+        size -= len(decomp.unused_data)
+        data = b"".join(out)
+        self.cached = (offset, data, size)
+        return data, size
+
+    def read(self, entry):
+        """
+        Yield the content of a member, decompressing only its blocks.
+        """
+        if entry["type"] == "link":
+            entry = self.by_path[entry["target"]]
+        elif entry["type"] != "file":
+            return
+        offset, end = entry["offset"], entry["offset"] + entry["csize"]
+        skip, left = entry["skip"], entry["size"]
+        while left > 0 and offset < end:
+            data, size = self._block(offset)
+            chunk = data[skip:skip + left]
+            skip = max(0, skip - len(data))
+            left -= len(chunk)
+            offset += size
+            if chunk:
+                yield chunk
+        if left:
+            raise ArchiveError(f"{self.path}: {entry['path']} is truncated")
+
+    def lines(self, entry):
+        """
+        Yield the lines of a member, decompressing the gzip ones.
+        """
+        chunks = self.read(entry)
+        if entry["path"].endswith(".gz"):
+            chunks = gunzip(chunks)
+        rest = b""
+        for chunk in chunks:
+            lines = (rest + chunk).split(b"\n")
+            rest = lines.pop()
+            yield from lines
+        if rest:
+            yield rest
+
+
+def gunzip(chunks):
+    """
+    Decompress a gzip stream, made of one or more members.
+    """
+    decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        while chunk:
+            yield decomp.decompress(chunk)
+            chunk = b""
+            if decomp.eof:
+                chunk = decomp.unused_data
+                decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def do_create(args):
+    count = create(args.archive, args.source, args.jobs or os.cpu_count(),
+                   args.exclude, args.block_size, args.preset)
+    print(f"Archived {count} members in {args.archive}, catalog in "
+          f"{catalog_path(args.archive)}")
+
+
+def do_list(archive, args):
+    for entry in archive.select(args.patterns, args.namespace, args.kind):
+        if args.long:
+            print(json.dumps(entry, sort_keys=True))
+        else:
+            print(entry["path"])
+
+
+def do_cat(archive, args):
+    entries = archive.select(args.patterns)
+    if not entries:
+        raise ArchiveError("no member matches " + " ".join(args.patterns))
+    for entry in entries:
+        for chunk in archive.read(entry):
+            sys.stdout.buffer.write(chunk)
+
+
+def do_grep(archive, args):
+    regex = re.compile(args.regex.encode(), re.IGNORECASE if args.ignore_case
+                       else 0)
+    found = False
+    for entry in archive.select(args.member, args.namespace, args.kind):
+        if entry["type"] == "symlink":
+            continue
+        prefix = entry["path"].encode() + b":"
+        for number, line in enumerate(archive.lines(entry), 1):
+            if regex.search(line):
+                found = True
+                sys.stdout.buffer.write(prefix + b"%d:" % number + line
+                                        + b"\n")
+    if not found:
+        sys.exit(1)
+
+
+def do_extract(archive, args):
+    for entry in archive.select(args.patterns):
+        dest = os.path.join(args.directory, entry["path"])
+        if os.path.relpath(dest, args.directory).startswith(".."):
+            raise ArchiveError(f"{entry['path']}: outside the directory")
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if entry["type"] == "symlink":
+            if os.path.lexists(dest):
+                os.unlink(dest)
+            os.symlink(entry["target"], dest)
+            continue
+        digest = hashlib.sha256()
+        with open(dest, 'wb') as f:
+            for chunk in archive.read(entry):
+                digest.update(chunk)
+                f.write(chunk)
+        target = archive.by_path.get(entry.get("target"), entry)
+        if digest.hexdigest() != target["sha256"]:
+            raise ArchiveError(f"{entry['path']}: checksum mismatch")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    cmd = commands.add_parser('create', help='Archive a directory')
+    cmd.add_argument('archive', help='Archive to write (.tar.xz)')
+    cmd.add_argument('source', help='Directory to archive')
+    cmd.add_argument('-j', '--jobs', type=int, default=0,
+                     help='Blocks compressed in parallel (default: the '
+                     'number of CPUs)')
+    cmd.add_argument('--exclude', action='append', default=[],
+                     help='Skip the files and directories whose name '
+                     'matches this pattern, can be repeated')
+    cmd.add_argument('--block-size', type=int, default=BLOCK_SIZE,
+                     help='Uncompressed size of the blocks (default: '
+                     '%(default)s)')
+    cmd.add_argument('--preset', type=int, default=PRESET,
+                     choices=range(10), metavar='0-9',
+                     help='xz compression preset (default: %(default)s)')
+    cmd.set_defaults(func=do_create)
+
+    def reader(name, help, func):
+        cmd = commands.add_parser(name, help=help)
+        cmd.add_argument('archive', help='Archive to read')
+        cmd.add_argument('--catalog', help='Catalog of the archive (default: '
+                         '<name>.catalog.jsonl next to it)')
+        cmd.set_defaults(func=func, reader=True)
+        return cmd
+
+    cmd = reader('list', 'List the members', do_list)
+    cmd.add_argument('patterns', nargs='*', help='Members to list')
+    cmd.add_argument('-n', '--namespace', help='Namespace of the members')
+    cmd.add_argument('-k', '--kind', help='Kind of the members')
+    cmd.add_argument('-l', '--long', action='store_true',
+                     help='Print the catalog records')
+
+    cmd = reader('cat', 'Write members to stdout', do_cat)
+    cmd.add_argument('patterns', nargs='+', help='Members to write')
+
+    cmd = reader('grep', 'Print the lines of the members matching a '
+                 'regular expression', do_grep)
+    cmd.add_argument('regex', help='Python regular expression')
+    cmd.add_argument('-m', '--member', action='append', default=[],
+                     help='Only search the members matching this pattern, '
+                     'can be repeated')
+    cmd.add_argument('-n', '--namespace', help='Namespace of the members')
+    cmd.add_argument('-k', '--kind', help='Kind of the members')
+    cmd.add_argument('-i', '--ignore-case', action='store_true')
+
+    cmd = reader('extract', 'Extract members', do_extract)
+    cmd.add_argument('patterns', nargs='*', help='Members to extract '
+                     '(default: all)')
+    cmd.add_argument('-C', '--directory', default='.',
+                     help='Directory to extract to (default: current)')
+
+    args = parser.parse_args()
+    try:
+        if not getattr(args, 'reader', False):
+            args.func(args)
+            return
+        archive = Archive(args.archive, args.catalog)
+        try:
+            args.func(archive, args)
+        finally:
+            archive.close()
+    except ArchiveError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+    except OSError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
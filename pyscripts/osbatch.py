@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+"""
+Run a batch of openstack commands in a single session of the
+openstackclient pod, and write the output of each of them to its file.
+
+Each openstack command run through oc rsh starts an exec session, a Python
+interpreter loading all the client plugins and asks Keystone for a token.
+This script sends itself to the pod instead, where it's run as a driver
+creating the OpenStack shell once and running the commands in it, so that
+the plugins are loaded once and the authenticated session is reused.
+
+The batch is read from a file (- for the standard input), one command per
+line with tab separated fields:
+
+    <mode> <output> <arguments> [<each>]
+
+where mode is > or >>, arguments are shell quoted, and each is an optional
+shell quoted command: the command is then run for each line it prints,
+with {} replaced by the line, and their outputs are concatenated.
+
+Each command is stopped after --timeout seconds. The errors are printed
+with the command that failed and the script exits with 1 if any of them
+did. The commands are run by separate openstack processes when the shell
+can't be created in the pod, or by oc rsh when the driver can't be run.
+
+    osbatch.py --namespace openstack --timeout 120 batch
+"""
+
+import argparse
+import io
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+OSC_POD = "openstackclient"
+# seconds allowed to each command
+TIMEOUT = 120
+# status of the commands stopped, as timeout(1) does
+TIMEOUT_STATUS = 124
+
+
+class CommandTimeout(BaseException):
+    """
+    Raised by the alarm of a command running for too long, it's not an
+    Exception so that the shell can't handle it.
+    """
+
+
+def parse_batch(lines):
+    """
+    Return the commands of a batch as dicts with their id, mode, output,
+    arguments and each command.
+    """
+    batch = []
+    for line in lines:
+        line = line.rstrip('\n')
+        if not line.strip():
+            continue
+        fields = line.split('\t')
+        if len(fields) < 3 or fields[0] not in ('>', '>>'):
+            raise ValueError(f"invalid batch line: {line}")
+        batch.append({
+            "id": len(batch),
+            "mode": fields[0],
+            "output": fields[1],
+            "args": shlex.split(fields[2]),
+            "each": shlex.split(fields[3]) if len(fields) > 3 else [],
+        })
+    return batch
+
+
+def execute(request, run, cache):
+    """
+    Run a command of the batch with run, which returns the status, output
+    and errors of a list of arguments, expanding it for each line of the
+    each command first. The output of the each commands is kept in cache,
+    as several commands can iterate on the same list.
+    """
+    if not request.get("each"):
+        return run(request["args"])
+    key = tuple(request["each"])
+    if key not in cache:
+        cache[key] = run(request["each"])
+    status, out, err = cache[key]
+    if status:
+        return status, "", err
+    outs, errs = [], []
+    for value in out.split():
+        ret, out, err = run([a.replace("{}", value) for a in request["args"]])
+        status = status or ret
+        outs.append(out)
+        errs.append(err)
+    return status, "".join(outs), "".join(errs)
+
+
+def command_runner(command, timeout):
+    """
+    Return a function running the arguments with the given command in a
+    separate process.
+    """
+    def run(args):
+        try:
+            ret = subprocess.run(command + args, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 universal_newlines=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return TIMEOUT_STATUS, "", f"timed out after {timeout}s\n"
+        except OSError as e:
+            return 127, "", f"{e}\n"
+        return ret.returncode, ret.stdout, ret.stderr
+    return run
+
+
+class Switch:
+    """
+    A stream writing to the current target, so that the output of the
+    commands, and of the loggers created with the streams, can be captured.
+    """
+
+    def __init__(self, target):
+        self.target = target
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+
+class ShellRunner:
+    """
+    The OpenStack shell, created once, running the commands in process.
+    """
+
+    def __init__(self, stdout, stderr, timeout):
+        # imported here, only the driver runs in the pod
+        from openstackclient import shell
+
+        self.shell = shell
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timeout = timeout
+        self.app = self._alarm(self._create)
+
+    def _alarm(self, func, *args):
+        """
+        Call func, stopping it with CommandTimeout after the timeout.
+        """
+        def expired(signum, frame):
+            raise CommandTimeout()
+
+        signal.signal(signal.SIGALRM, expired)
+        signal.alarm(self.timeout)
+        try:
+            return func(*args)
+        finally:
+            signal.alarm(0)
+
+    def _create(self):
+        """
+        Set up the shell as its run method does, without any command.
+        """
+        app = self.shell.OpenStackShell()
+        app.options, _ = app.parser.parse_known_args([])
+        app.configure_logging()
+        app.interactive_mode = False
+        app.initialize_app([])
+        # keep the session, and its connections, for the next commands
+        app.clean_up = lambda cmd, result, err: None
+        return app
+
+    def _run(self, args):
+        """
+        Run a command, the ones starting with global options (e.g.
+        --os-volume-api-version) need a shell of their own.
+        """
+        if args and args[0].startswith('-'):
+            return self.shell.OpenStackShell().run(args)
+        return self.app.run_subcommand(args)
+
+    def __call__(self, args):
+        out, err = io.StringIO(), io.StringIO()
+        self.stdout.target, self.stderr.target = out, err
+        try:
+            status = self._alarm(self._run, args)
+        except CommandTimeout:
+            status = TIMEOUT_STATUS
+            err.write(f"timed out after {self.timeout}s\n")
+        except SystemExit as e:
+            # argparse exits on invalid arguments
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            status = 1
+            err.write(f"{e}\n")
+        finally:
+            self.stdout.target = sys.__stdout__
+            self.stderr.target = sys.__stderr__
+        return status or 0, out.getvalue(), err.getvalue()
+
+
+def driver(timeout):
+    """
+    Run the requests read from the standard input, printing their results
+    as JSON lines as soon as they are done.
+    """
+    requests = [json.loads(line) for line in sys.stdin if line.strip()]
+    results = sys.stdout
+    sys.stdout = Switch(sys.__stdout__)
+    sys.stderr = Switch(sys.__stderr__)
+    try:
+        run = ShellRunner(sys.stdout, sys.stderr, timeout)
+    except (Exception, CommandTimeout) as e:
+        print(f"Running openstack processes, the shell failed: {e!r}",
+              file=sys.__stderr__)
+        run = command_runner(["openstack"], timeout)
+    cache = {}
+    for request in requests:
+        start = time.monotonic()
+        status, out, err = execute(request, run, cache)
+        results.write(json.dumps({
+            "id": request["id"], "status": status, "out": out, "err": err,
+            "seconds": round(time.monotonic() - start, 3)}) + '\n')
+        results.flush()
+
+
+def write_result(request, result):
+    """
+    Write the output of a command, and report its errors.
+    """
+    os.makedirs(os.path.dirname(request["output"]) or ".", exist_ok=True)
+    with open(request["output"], 'a' if request["mode"] == '>>' else 'w') as f:
+        f.write(result["out"])
+    if result["status"]:
+        print(f"openstack {' '.join(request['args'])}: exit "
+              f"{result['status']}", file=sys.stderr)
+    if result["err"]:
+        sys.stderr.write(result["err"])
+
+
+def run_batch(batch, command, fallback, timeout):
+    """
+    Run the batch with the driver started by command, then the commands
+    it didn't run with fallback. Return the number of commands failed.
+    """
+    results = {}
+    try:
+        proc = subprocess.Popen(command + ["--driver", "--timeout",
+                                           str(timeout)],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                universal_newlines=True)
+    except OSError as e:
+        print(f"{command[0]}: {e}", file=sys.stderr)
+    else:
+        # the driver stops each command, this is for the session itself
+        watchdog = threading.Timer(timeout * (len(batch) + 1), proc.kill)
+        watchdog.start()
+        try:
+            for request in batch:
+                proc.stdin.write(json.dumps(
+                    {k: request[k] for k in ("id", "args", "each")}) + '\n')
+            proc.stdin.close()
+            for line in proc.stdout:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                results[result["id"]] = result
+            proc.wait()
+        except BrokenPipeError:
+            proc.kill()
+            proc.wait()
+        finally:
+            watchdog.cancel()
+
+    missing = [r for r in batch if r["id"] not in results]
+    if missing:
+        print(f"Running {len(missing)} openstack commands one by one",
+              file=sys.stderr)
+    cache = {}
+    for request in missing:
+        status, out, err = execute(request, fallback, cache)
+        results[request["id"]] = {"status": status, "out": out, "err": err}
+
+    for request in batch:
+        write_result(request, results[request["id"]])
+    return sum(1 for r in results.values() if r["status"])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('batch', nargs='?', default='-',
+                        help='File with the commands (default: stdin)')
+    parser.add_argument('--namespace', default='openstack',
+                        help='Namespace of the openstackclient pod')
+    parser.add_argument('--pod', default=OSC_POD,
+                        help='Name of the openstackclient pod')
+    parser.add_argument('--timeout', type=int, default=TIMEOUT,
+                        help='Seconds allowed to each command '
+                        '(default: %(default)s)')
+    parser.add_argument('--driver', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.driver:
+        driver(args.timeout)
+        return
+
+    try:
+        if args.batch == '-':
+            batch = parse_batch(sys.stdin)
+        else:
+            with open(args.batch, 'r') as f:
+                batch = parse_batch(f)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if not batch:
+        return
+
+    with open(os.path.abspath(__file__), 'r') as f:
+        source = f.read()
+    oc = ["oc", "-n", args.namespace]
+    start = time.monotonic()
+    failed = run_batch(
+        batch, oc + ["exec", "-i", args.pod, "--", "python3", "-c", source],
+        command_runner(oc + ["rsh", args.pod, "openstack"], args.timeout),
+        args.timeout)
+    print(f"Ran {len(batch)} openstack commands in "
+          f"{time.monotonic() - start:.1f}s, {failed} failed")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
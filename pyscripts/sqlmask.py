@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+
+"""
+Mask the sensitive data of a mysqldump output while it's streamed, with
+the rules of mask.py, so that the database dumps can be shipped.
+
+The dump is read a line, i.e. a statement, at a time. In the INSERT
+statements:
+
+- the values of the columns named after a protected key (e.g. password,
+  transport_url, database_connection) or holding secrets in the OpenStack
+  schemas (e.g. keystone password_hash, barbican cypher_text) are replaced
+  with the mask;
+- the values of the key/value tables (e.g. nova instance_system_metadata)
+  are masked when their key is a protected one;
+- the other strings are unescaped and masked like the content of the
+  config files (<key> = <value>, <proto>://<user>:<password>@<host>), and
+  like JSON documents ("<key>": "<value>").
+
+The statements without any of the keys are written as they are, so most
+of the dump is never parsed. It can be used as a pipe stage:
+
+    mysqldump nova | sqlmask.py | gzip > nova.sql.gz
+    sqlmask.py --stats -o masked.sql nova.sql
+"""
+
+import argparse
+import bisect
+import re
+import sys
+import time
+
+from mask import MASK_STR, PROTECT_KEYS, KeywordMatcher, matchers
+
+# columns holding secrets without a protected key in their name
+SQL_PROTECT_COLUMNS = ["password_hash", "secret", "blob", "key_hash",
+                       "cypher_text", "plugin_meta"]
+column_regex = re.compile(
+    r'(%s)$' % "|".join(PROTECT_KEYS + SQL_PROTECT_COLUMNS), re.I)
+key_regex = re.compile(r'(%s)' % "|".join(PROTECT_KEYS), re.I)
+# the key and value columns of the key/value tables
+KV_KEYS = ("key", "name")
+KV_VALUE = "value"
+
+# "<key>": "<value>" in JSON (or Python) documents
+json_regex = (r'(?<=["\'])(\w*(%s)["\']\s*:\s*)(?P<q>["\'])'
+              r'(?:(?!(?P=q))[^\\]|\\.)*(?P=q)' % "|".join(PROTECT_KEYS))
+sql_matchers = matchers + [
+    KeywordMatcher(json_regex, PROTECT_KEYS, r"\1\g<q>{}\g<q>".format(MASK_STR),
+                   word_prefix=True, name="json_regex")]
+
+# A key can only be in a statement containing one of its literals, which
+# contains one of these needles: the literals are only looked for where
+# their needle is, the needles being few.
+SHORT_NEEDLES = ["pass", "key", "secret", "auth", "_pw", "user", "token",
+                 "connection", "rabbit", "transport"]
+
+
+def _needles():
+    """
+    Return the needles with the literals of the keys containing them, and
+    the offset of the needle in each literal.
+    """
+    literals = set()
+    for matcher in sql_matchers:
+        literals.update(matcher.literals or [])
+    # a literal containing another one is found with it
+    literals = [lit for lit in literals
+                if not any(o != lit and o in lit for o in literals)]
+    needles = {}
+    for lit in sorted(literals):
+        needle = next((n for n in SHORT_NEEDLES if n in lit), lit)
+        needles.setdefault(needle.encode(), []).append(
+            (lit.encode(), lit.index(needle)))
+    return sorted(needles.items())
+
+
+NEEDLES = _needles()
+
+
+def find_keys(lowered, start=0):
+    """
+    Return the sorted positions of the literals of the keys in a lower-case
+    text, from start.
+    """
+    found = []
+    for needle, literals in NEEDLES:
+        i = lowered.find(needle, start)
+        while i != -1:
+            for lit, offset in literals:
+                if i - offset >= start and lowered.startswith(lit, i - offset):
+                    found.append(i - offset)
+            i = lowered.find(needle, i + 1)
+    return sorted(found)
+
+
+INSERT = re.compile(rb'(?:INSERT|REPLACE)(?: IGNORE)? INTO `([^`]+)`'
+                    rb'(?: \(([^)]*)\))? VALUES ')
+CREATE = re.compile(rb'CREATE TABLE `([^`]+)`')
+COLUMN = re.compile(rb'\s+`([^`]+)`')
+STRING = re.compile(rb"'(?:[^'\\]|\\.)*'", re.S)
+ROW = re.compile(rb"\((?:'(?:[^'\\]|\\.)*'|[^'()])*\)", re.S)
+FIELD = re.compile(rb"'(?:[^'\\]|\\.)*'|,|[^',]+", re.S)
+UNESCAPE = re.compile(rb"\\(.)", re.S)
+UNESCAPES = {b'0': b'\0', b'n': b'\n', b'r': b'\r', b't': b'\t',
+             b'b': b'\b', b'Z': b'\x1a'}
+ESCAPE = re.compile(rb"[\0\n\r\\'\"\x1a]")
+ESCAPES = {b'\0': b'\\0', b'\n': b'\\n', b'\r': b'\\r', b'\\': b'\\\\',
+           b"'": b"\\'", b'"': b'\\"', b'\x1a': b'\\Z'}
+MASKED = b"'" + MASK_STR.encode() + b"'"
+
+
+def identifier(value):
+    """
+    Return the name of a table or column, which may not be valid UTF-8.
+    """
+    return value.decode('utf-8', 'surrogateescape')
+
+
+def unescape(value):
+    """
+    Return the content of a string literal of the dump.
+    """
+    return UNESCAPE.sub(lambda m: UNESCAPES.get(m.group(1), m.group(1)),
+                        value[1:-1])
+
+
+def escape(value):
+    """
+    Return the string literal of a value, escaped as mysqldump does.
+    """
+    return b"'" + ESCAPE.sub(lambda m: ESCAPES[m.group(0)], value) + b"'"
+
+
+def mask_text(value):
+    """
+    Mask a string literal like a config file, return None if there was
+    nothing to mask.
+    """
+    text = unescape(value).decode('utf-8', 'surrogateescape')
+    masked = text
+    for matcher in sql_matchers:
+        masked = matcher.sub(masked)
+    if masked == text:
+        return None
+    return escape(masked.encode('utf-8', 'surrogateescape'))
+
+
+class SqlMask():
+    """
+    The masking of a dump, keeping the columns of its tables and the
+    number of statements and values masked.
+    """
+
+    def __init__(self):
+        # table -> column names, from CREATE TABLE
+        self.columns = {}
+        self._table = None
+        # (table, column list) -> (masked fields, (key field, value field))
+        self._rules = {}
+        self.lines = 0
+        self.bytes = 0
+        self.parsed = 0
+        self.masked = 0
+
+    def _track(self, line):
+        """
+        Record the columns of the tables created in the dump, for the
+        INSERT statements without column names.
+        """
+        if self._table is not None:
+            m = COLUMN.match(line)
+            if m:
+                self.columns[self._table].append(identifier(m.group(1)))
+            elif line.startswith(b')'):
+                self._table = None
+            return
+        m = CREATE.match(line)
+        if m:
+            self._table = identifier(m.group(1))
+            self.columns[self._table] = []
+
+    def _rule(self, table, names):
+        """
+        Return the fields of the rows of a table that are masked, and the
+        fields of the keys and values if it's a key/value table.
+        """
+        key = (table, names)
+        if key not in self._rules:
+            if names is not None:
+                columns = [c.strip().strip('`') for c in
+                           identifier(names).split(',')]
+            else:
+                columns = self.columns.get(table, [])
+            protected = {i for i, c in enumerate(columns)
+                         if column_regex.search(c)}
+            kv = (None, None)
+            lowered = [c.lower() for c in columns]
+            if KV_VALUE in lowered:
+                for k in KV_KEYS:
+                    if k in lowered:
+                        kv = (lowered.index(k), lowered.index(KV_VALUE))
+                        break
+            self._rules[key] = (protected, kv)
+        return self._rules[key]
+
+    def _row(self, row, offset, found, protected, kv):
+        """
+        Mask a row of an INSERT statement, found at offset in it, and return
+        it or None if there was nothing to mask.
+        """
+        fields = [[]]
+        # the (field, token) indexes of the strings containing a key
+        keys = []
+        for m in FIELD.finditer(row, 1, len(row) - 1):
+            token = m.group()
+            if token == b',':
+                fields.append([])
+                continue
+            if token[:1] == b"'" and found:
+                k = bisect.bisect_left(found, offset + m.start())
+                if k < len(found) and found[k] < offset + m.end():
+                    keys.append((len(fields) - 1, len(fields[-1])))
+            fields[-1].append(token)
+        key_field, value_field = kv
+        if any(i == key_field for i, _ in keys) and key_regex.search(
+                unescape(b"".join(fields[key_field])).decode(
+                    'utf-8', 'surrogateescape')):
+            protected = protected | {value_field}
+        masked = 0
+        for i in protected:
+            for j, token in enumerate(fields[i] if i < len(fields) else []):
+                if token[:1] == b"'" and token != b"''":
+                    fields[i][j] = MASKED
+                    masked += 1
+        for i, j in keys:
+            if i in protected:
+                continue
+            value = mask_text(fields[i][j])
+            if value is not None:
+                fields[i][j] = value
+                masked += 1
+        if not masked:
+            return None
+        self.masked += masked
+        return b'(' + b','.join(b''.join(f) for f in fields) + b')'
+
+    def _strings(self, line, start, found):
+        """
+        Mask the strings of an INSERT statement containing the keys found,
+        the other values being kept as they are.
+        """
+        out = []
+        pos = 0
+        for m in STRING.finditer(line, start):
+            k = bisect.bisect_left(found, m.start())
+            if k == len(found):
+                break
+            if found[k] >= m.end():
+                continue
+            masked = mask_text(m.group())
+            if masked is not None:
+                out += [line[pos:m.start()], masked]
+                pos = m.end()
+                self.masked += 1
+        if not out:
+            return line
+        out.append(line[pos:])
+        return b''.join(out)
+
+    def _values(self, line, start, found, protected, kv):
+        """
+        Parse the rows of an INSERT statement containing the keys found, or
+        all of them if the table has protected columns, and mask them.
+        """
+        out = []
+        pos = 0
+        for m in ROW.finditer(line, start):
+            if not protected:
+                k = bisect.bisect_left(found, m.start())
+                if k == len(found):
+                    break
+                if found[k] >= m.end():
+                    continue
+            masked = self._row(m.group(), m.start(), found, protected, kv)
+            if masked is not None:
+                out += [line[pos:m.start()], masked]
+                pos = m.end()
+        if not out:
+            return line
+        out.append(line[pos:])
+        return b''.join(out)
+
+    def line(self, line):
+        """
+        Return a line of the dump, masked.
+        """
+        self.lines += 1
+        self.bytes += len(line)
+        m = INSERT.match(line)
+        if m is None:
+            self._track(line)
+            return line
+        protected, kv = self._rule(identifier(m.group(1)), m.group(2))
+        found = find_keys(line.lower(), m.end())
+        if not protected and not found:
+            return line
+        self.parsed += 1
+        if not protected and kv[0] is None:
+            return self._strings(line, m.end(), found)
+        return self._values(line, m.end(), found, protected, kv)
+
+    def stream(self, source):
+        """
+        Yield the masked lines of a binary stream.
+        """
+        for line in source:
+            yield self.line(line)
+
+
+class MaskedReader():
+    """
+    A binary stream returning the masked content of another one, to put
+    the masking in the pipeline of a dump.
+    """
+
+    def __init__(self, source, mask=None):
+        self.mask = mask or SqlMask()
+        self._lines = self.mask.stream(iter(source.readline, b''))
+        self._buffer = bytearray()
+
+    def read(self, size=-1):
+        for line in self._lines:
+            self._buffer += line
+            if 0 <= size <= len(self._buffer):
+                break
+        if size < 0:
+            size = len(self._buffer)
+        chunk = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('input', nargs='?', default='-',
+                        help='The dump (default: stdin)')
+    parser.add_argument('-o', '--output', default='-',
+                        help='The masked dump (default: stdout)')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print the statements and values masked and '
+                        'the throughput on stderr')
+    args = parser.parse_args()
+
+    mask = SqlMask()
+    start = time.monotonic()
+    source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+    dest = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    try:
+        dest.writelines(mask.stream(source))
+    except OSError as e:
+        print(f"Error masking {args.input}: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if dest is not sys.stdout.buffer:
+            dest.close()
+    if args.stats:
+        elapsed = max(time.monotonic() - start, 1e-6)
+        print(f"{mask.lines} lines, {mask.bytes} bytes: {mask.parsed} "
+              f"statements parsed, {mask.masked} values masked in "
+              f"{elapsed:.1f}s ({mask.bytes / elapsed / 2 ** 20:.1f} MiB/s)",
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+import unittest
+import os
+import tempfile
+import shutil
+from bench_mask import BENCHMARKS, available, run_single
+from gen_corpus import gen_corpus
+from mask import mask_dir
+
+
+class TestBenchmark(unittest.TestCase):
+    """
+    The class that implements basic tests for the synthetic
+    corpus generator and the benchmark suite.
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory for test files
+        """
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _read_tree(self, path):
+        """
+        Return a dict of relative path -> content for the
+        given tree.
+        """
+        tree = {}
+        for root, subdirs, files in os.walk(path):
+            for f in files:
+                full = os.path.join(root, f)
+                with open(full, 'rb') as fh:
+                    tree[os.path.relpath(full, path)] = fh.read()
+        return tree
+
+    def _gen(self, name, seed=0, dump_size=0):
+        """
+        Generate a small corpus and return its content.
+        """
+        path = os.path.join(self.temp_dir, name)
+        gen_corpus(path, count=4, size=512, entries=2, items=10, seed=seed,
+                   dump_size=dump_size)
+        return self._read_tree(path)
+
+    def test_corpus_deterministic(self):
+        """
+        The same seed produces the same corpus.
+        """
+        first = self._gen("first")
+        self.assertEqual(len(first), 13)
+        self.assertEqual(first, self._gen("second"))
+        self.assertNotEqual(first, self._gen("other", seed=1))
+        self.assertNotIn("sqlmask", available(
+            os.path.join(self.temp_dir, "first")))
+
+    def test_corpus_masked(self):
+        """
+        The generated corpus contains data masked by mask.py.
+        """
+        path = os.path.join(self.temp_dir, "corpus")
+        before = self._gen("corpus")
+        mask_dir(path)
+        after = self._read_tree(path)
+        for f in ("secrets", "configmaps", "crs"):
+            changed = [k for k in before
+                       if k.startswith(f) and after[k] != before[k]]
+            self.assertGreater(len(changed), 0, f)
+
+    def test_run_single(self):
+        """
+        Each benchmark reports its throughput and peak RSS, and
+        leaves the corpus untouched.
+        """
+        path = os.path.join(self.temp_dir, "corpus")
+        corpus = self._gen("corpus", dump_size=1 << 20)
+        self.assertEqual(available(path), list(BENCHMARKS))
+        for name in BENCHMARKS:
+            res = run_single(name, path, 1)
+            for key in ("files", "bytes", "seconds", "files_per_sec",
+                        "mb_per_sec", "peak_rss_mb"):
+                self.assertGreater(res[key], 0, f"{name} {key}")
+        self.assertEqual(self._read_tree(path), corpus)
+
+
+if __name__ == '__main__':
+    unittest.main()
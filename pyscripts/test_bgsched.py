@@ -0,0 +1,456 @@
+#!/usr/bin/python
+
+import unittest
+import io
+import json
+import os
+import subprocess
+import tempfile
+import shutil
+from contextlib import redirect_stderr
+from signal import SIGKILL, SIGTERM
+from bgsched import (TIMEOUT_STATUS, THROTTLE_RE, Pool, Scheduler, Task,
+                     classify)
+
+BG_SH = os.path.abspath("../collection-scripts/bg.sh")
+SCHED_BIN = os.path.abspath("bgsched.py")
+
+
+class TestScheduler(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the scheduling of the background tasks.
+    """
+
+    def setUp(self):
+        """
+        Create a scheduler recording the messages for the shell
+        """
+        self.sent = []
+        self.killed = []
+        self.sched = Scheduler(2, self.sent.append, retry_delay=0,
+                               kill=lambda *args: self.killed.append(args))
+
+    def _started(self):
+        """
+        utility function to return the tasks the shell was asked
+        to start, and start them.
+        """
+        ids = [m.split()[1] for m in self.sent if m.startswith("run ")]
+        self.sent[:] = [m for m in self.sent
+                        if not m.startswith(("run ", "queued "))]
+        for i in ids:
+            self.sched.handle(f"start {i} {1000 + int(i)}")
+        return ids
+
+    def test_concurrency_and_priority(self):
+        """
+        At most concurrency tasks run, the highest priority
+        ones first.
+        """
+        self.sched.handle("task 0 0 0 0 - - 1 cmd 0")
+        # the task is acknowledged after being started
+        self.assertEqual(self.sent, ["run 0 api", "queued 0 0"])
+        for i, prio in enumerate([0, 0, 10, 5], 1):
+            self.sched.handle(f"task {i} {prio} 0 0 - - 1 cmd {i}")
+        self.assertEqual(self._started(), ["0", "1"])
+        self.sched.handle("exit 0 0")
+        self.assertEqual(self._started(), ["3"])
+        self.sched.handle("exit 1 0")
+        self.sched.handle("exit 3 0")
+        self.assertEqual(self._started(), ["4", "2"])
+        self.assertEqual(self.sched.tasks["0"].name, "cmd 0")
+
+    def test_dependencies(self):
+        """
+        Tasks start after the tasks they depend on, even if
+        these fail.
+        """
+        self.sched.handle("task 1 0 0 0 - - 1 fetch")
+        self.sched.handle("task 2 0 0 0 - - 1 fetch")
+        self.sched.handle("task 3 10 0 0 1,2 - 1 mask")
+        self.assertEqual(self._started(), ["1", "2"])
+        self.sched.handle("exit 1 0")
+        self.assertEqual(self._started(), [])
+        self.sched.handle("exit 2 1")
+        self.assertEqual(self._started(), ["3"])
+        # already finished dependencies don't block
+        self.sched.handle("task 4 0 0 0 1 - 1 other")
+        self.assertEqual(self._started(), ["4"])
+
+    def test_retries(self):
+        """
+        Failed tasks are started again until they have no
+        attempts left.
+        """
+        self.sched.handle("task 1 0 0 1 - - 1 flaky")
+        self.assertEqual(self._started(), ["1"])
+        self.sched.handle("exit 1 1")
+        self.sched.check_timers()
+        self.assertEqual(self._started(), ["1"])
+        self.sched.handle("exit 1 1")
+        self.sched.check_timers()
+        self.assertEqual(self._started(), [])
+        task = self.sched.tasks["1"]
+        self.assertEqual((task.state, task.status, task.attempts),
+                         ("done", 1, 2))
+
+    def test_wait(self):
+        """
+        Waits are answered when the tasks are done, with the
+        number of failed ones.
+        """
+        self.sched.handle("task 1 0 0 0 - - 1 a")
+        self.sched.handle("task 2 0 0 0 - - 1 b")
+        self._started()
+        self.sched.handle("wait w1 1")
+        self.sched.handle("wait w2")
+        self.sched.handle("wait w3 999")
+        self.assertEqual(self.sent, ["done w3 0 0"])
+        self.sched.handle("exit 1 1")
+        self.assertEqual(self.sent[1:], ["done w1 1 0"])
+        self.sched.handle("exit 2 0")
+        self.assertEqual(self.sent[2:], ["done w2 1 0"])
+
+    def test_waiting(self):
+        """
+        The replies tell how many tasks are not started yet,
+        and pause is echoed after the run messages.
+        """
+        for i in range(1, 4):
+            self.sched.handle(f"task {i} 0 0 0 - - 1 cmd {i}")
+        self.assertEqual(self.sent[-1], "queued 3 1")
+        self._started()
+        self.sched.handle("task 4 0 0 0 1 - 1 after 1")
+        self.sched.handle("wait w1 2")
+        self.sched.handle("exit 2 0")
+        self.sched.handle("pause")
+        self.assertEqual(self.sent, ["queued 4 2", "done w1 0 2", "run 3 api",
+                                     "pause"])
+
+    def test_timeout(self):
+        """
+        Tasks running after their timeout are reported as
+        timed out.
+        """
+        self.sched.submit(Task("1", "sleep", timeout=60))
+        self.sched.submit(Task("2", "stuck", timeout=60))
+        self._started()
+        for task in self.sched.tasks.values():
+            task.deadline = 1
+        self.sched.check_timers()
+        self.assertEqual(self.killed, [(1001, SIGTERM, False),
+                                       (1002, SIGTERM, False)])
+        self.sched.handle("exit 1 143")
+        self.assertEqual(self.sched.tasks["1"].status, TIMEOUT_STATUS)
+        # the processes that ignore SIGTERM are killed
+        self.sched.tasks["2"].kill_at = 1
+        self.sched.check_timers()
+        self.assertEqual(self.killed[2], (1002, SIGKILL, True))
+        self.assertEqual(self.sched.tasks["2"].status, TIMEOUT_STATUS)
+
+    def test_lost_task(self):
+        """
+        A task whose process is gone without reporting its
+        status is marked as failed, freeing its slot.
+        """
+        self.sched.handle("task 1 0 0 0 - - 1 a")
+        self.sched.handle("task 2 0 0 0 - - 1 b")
+        self.sched.handle("task 3 0 0 0 - - 1 c")
+        self._started()
+        self.sched.lost("1", 1001)
+        self.assertEqual(self.sched.tasks["1"].status, 255)
+        self.assertEqual(self._started(), ["3"])
+
+
+class TestPools(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the pools of the different classes of tasks.
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory for the stderr of the tasks
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.sent = []
+        pools = {"api": Pool("api", 2, 8), "node": Pool("node", 1)}
+        self.sched = Scheduler(5, self.sent.append, retry_delay=0,
+                               pools=pools, errors=self.temp_dir)
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _started(self):
+        """
+        utility function to return the tasks the shell was asked
+        to start, and start them.
+        """
+        runs = [m.split()[1:] for m in self.sent if m.startswith("run ")]
+        self.sent.clear()
+        for i, _ in runs:
+            self.sched.handle(f"start {i} {1000 + int(i)}")
+        return runs
+
+    def test_classify(self):
+        """
+        The class of the tasks is guessed from their command.
+        """
+        for cmd, pool in [
+                ("/usr/bin/oc -n openstack get pods", "api"),
+                ("/usr/bin/oc get secret dataplane-ssh-key", "api"),
+                ("oc -n ns logs pod -c c '>' c.log", "logs"),
+                ("oc -n openstack rsh openstackclient openstack service "
+                 "list", "exec"),
+                ("gather_node_sos worker-0", "node"),
+                ("gather_edpm_sos compute-0 1.2.3.4 root key ns", "node"),
+                ("mask.py --dir namespaces", "api")]:
+            self.assertEqual(classify(cmd), pool, cmd)
+
+    def test_separate_pools(self):
+        """
+        Long node tasks don't hold the slots of the api tasks.
+        """
+        self.sched.handle("task 1 10 0 0 - - 1 gather_node_sos a")
+        self.sched.handle("task 2 10 0 0 - - 1 gather_node_sos b")
+        for i in range(3, 6):
+            self.sched.handle(f"task {i} 0 0 0 - - 1 oc get {i}")
+        self.sched.handle("task 6 0 0 0 - exec 1 oc get 6")
+        self.assertEqual(self._started(), [["1", "node"], ["3", "api"],
+                                           ["4", "api"], ["6", "exec"]])
+        self.sched.handle("exit 3 0")
+        self.assertEqual(self._started(), [["5", "api"]])
+
+    def test_slots(self):
+        """
+        Tasks holding several slots wait for enough of them to be
+        free, the next tasks waiting behind them.
+        """
+        self.sched.handle("task 1 0 0 0 - exec 4 dbdump.py --jobs 4")
+        self.sched.handle("task 2 0 0 0 - exec 2 dbdump.py --jobs 2")
+        self.sched.handle("task 3 0 0 0 - exec 1 oc rsh pod ls")
+        self.sched.handle("task 4 0 0 0 - exec 10 dbdump.py --jobs 10")
+        self.assertEqual(self._started(), [["1", "exec"]])
+        self.sched.handle("exit 1 0")
+        self.assertEqual(self._started(), [["2", "exec"], ["3", "exec"]])
+        self.sched.handle("exit 2 0")
+        self.assertEqual(self._started(), [])
+        # more slots than the pool has take all of them
+        self.sched.handle("exit 3 0")
+        self.assertEqual(self._started(), [["4", "exec"]])
+        self.assertEqual(self.sched.pools["exec"].active, 5)
+
+    def test_throttled_retry(self):
+        """
+        api tasks failing because the API server is overloaded
+        are retried, and their pool concurrency is lowered.
+        """
+        pool = self.sched.pools["api"]
+        pool.limit = 4
+        self.sched.handle("task 1 0 0 0 - - 1 oc get pods")
+        self._started()
+        with open(os.path.join(self.temp_dir, "1.err"), 'w') as f:
+            f.write("Error from server (TooManyRequests): slow down\n")
+        pool.completed = 10
+        self.sched.handle("exit 1 1")
+        self.assertEqual(pool.limit, 2)
+        self.assertEqual(self.sched.tasks["1"].throttled, 1)
+        self.assertFalse(os.listdir(self.temp_dir))
+        self.sched.check_timers()
+        self.assertEqual(self._started(), [["1", "api"]])
+        # without errors from the API server failures are final
+        self.sched.handle("exit 1 1")
+        self.assertEqual(self.sched.tasks["1"].state, "done")
+
+    def test_throttled_no_retry(self):
+        """
+        Throttled tasks appending to their output are not retried
+        unless asked to, and HTTP codes out of their context are
+        not taken as throttling.
+        """
+        self.sched.handle("task 1 0 0 0 - - 1 oc get sub a '>>' subs")
+        self.sched.handle("task 2 0 0 0 - - 1 oc get pod foo-500")
+        self._started()
+        for i, error in [("1", "Error from server (TooManyRequests): x\n"),
+                         ("2", 'Error from server (NotFound): pods '
+                          '"foo-500" not found\n')]:
+            with open(os.path.join(self.temp_dir, f"{i}.err"), 'w') as f:
+                f.write(error)
+            self.sched.handle(f"exit {i} 1")
+        self.sched.check_timers()
+        self.assertEqual(self._started(), [])
+        self.assertEqual([(t.state, t.throttled) for t in
+                          self.sched.tasks.values()], [("done", 1),
+                                                       ("done", 0)])
+        self.assertTrue(THROTTLE_RE.search(
+            "the server responded with the status code 503: unavailable"))
+        self.assertFalse(THROTTLE_RE.search("pods \"db-429\" not found"))
+
+    def test_quiet_errors(self):
+        """
+        The stderr of the api tasks is printed without the messages
+        that are not errors.
+        """
+        self.sched.handle("task 1 0 0 0 - - 1 oc get foo -A")
+        self._started()
+        with open(os.path.join(self.temp_dir, "1.err"), 'w') as f:
+            f.write("No resources found\nError from server (Forbidden)\n")
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            self.sched.handle("exit 1 1")
+        self.assertEqual(stderr.getvalue(), "Error from server (Forbidden)\n")
+
+    def test_adaptive_limit(self):
+        """
+        The concurrency grows while the tasks are fast, and
+        shrinks when they slow down.
+        """
+        pool = Pool("api", 2, 4)
+        for _ in range(20):
+            pool.observe(0.1, False)
+        self.assertEqual(pool.limit, 4)
+        pool.observe(2, False)
+        self.assertEqual(pool.limit, 3)
+        # throttling halves the concurrency
+        pool.completed = 3
+        self.assertIsNotNone(pool.observe(0.1, True))
+        self.assertEqual(pool.limit, 1)
+        # pools without a maximum are not tuned
+        fixed = Pool("node", 2)
+        self.assertIsNone(fixed.observe(10, True))
+        self.assertEqual(fixed.limit, 2)
+
+
+class TestBgScheduler(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    run_bg and wait_bg using the scheduler.
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory for test files
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.status = os.path.join(self.temp_dir, "status.jsonl")
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _run(self, script, **env):
+        """
+        utility function to run a script with the scheduler,
+        returning its output.
+        """
+        script = (f'source "{BG_SH}"\n'
+                  f'sched_start "{self.status}" || exit 2\n'
+                  f'cd "{self.temp_dir}"\n' + script + '\nsched_stop\n')
+        env = dict(os.environ, SCHED_BIN=SCHED_BIN, TRACE_FILE="", **env)
+        return subprocess.run(["bash", "-c", script], env=env, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True, timeout=60)
+
+    def _status(self):
+        """
+        utility function to read the status records by task name.
+        """
+        with open(self.status, 'r') as f:
+            return {r["name"]: r for r in map(json.loads, f)}
+
+    def test_tasks(self):
+        """
+        Tasks run in priority order, after their dependencies,
+        and their exit status is reported.
+        """
+        out = self._run("""
+            run_bg sleep 0.3 '&&' echo first '>>' order
+            run_bg echo low '>>' order
+            run_bg --priority 5 echo high '>>' order
+            run_bg false
+            failed=$BG_TASK_ID
+            run_bg --after "$failed" echo after '>>' order
+            wait_bg "$failed" || echo "wait failed"
+            wait_bg
+            """, CONCURRENCY="1",
+                        CONCURRENCY_API_MAX="1")
+        self.assertIn("wait failed", out.stdout)
+        with open(os.path.join(self.temp_dir, "order"), 'r') as f:
+            self.assertEqual(f.read().split(), ["first", "high", "low",
+                                                "after"])
+        status = self._status()
+        self.assertEqual(status["false"]["status"], 1)
+        self.assertEqual(status["echo high >> order"]["priority"], 5)
+        self.assertIn("exit 1: false", out.stderr)
+
+    def test_timeout_and_retries(self):
+        """
+        Tasks are killed when they time out, and the failed
+        ones are retried.
+        """
+        self._run("""
+            run_bg --timeout 0.5 sleep 30
+            run_bg --retries 1 'test -e flag || { touch flag; false; }'
+            wait_bg
+            """)
+        status = self._status()
+        self.assertTrue(status["sleep 30"]["timed_out"])
+        self.assertEqual(status["sleep 30"]["status"], 124)
+        retried = [r for n, r in status.items() if n.startswith("test")][0]
+        self.assertEqual((retried["status"], retried["attempts"]), (0, 2))
+
+    def test_launcher(self):
+        """
+        The queued tasks are started while the shell runs
+        foreground commands.
+        """
+        out = self._run("""
+            run_bg sleep 0.5
+            run_bg touch started
+            sleep 2
+            test -e started && echo "started in the foreground"
+            run_bg echo queued again
+            wait_bg
+            """, CONCURRENCY="1")
+        self.assertIn("started in the foreground", out.stdout)
+        self.assertIn("queued again", out.stdout)
+        self.assertEqual(self._status()["touch started"]["status"], 0)
+
+    def test_scheduler_died(self):
+        """
+        When the scheduler dies, wait_bg waits for the tasks the
+        launcher started.
+        """
+        out = self._run("""
+            run_bg sleep 0.2
+            run_bg 'sleep 1.5; echo written > output'
+            sleep 0.6
+            kill -9 "$SCHED_PID"
+            sleep 0.2
+            wait_bg || echo "wait failed"
+            cat output
+            """, CONCURRENCY="1", CONCURRENCY_API_MAX="1")
+        self.assertIn("The scheduler is gone", out.stdout)
+        self.assertIn("wait failed", out.stdout)
+        self.assertTrue(out.stdout.endswith("written\n"), out.stdout)
+
+    def test_subshell_fallback(self):
+        """
+        run_bg called from a subshell runs the tasks without
+        the scheduler.
+        """
+        out = self._run("""
+            ( run_bg echo nested; wait_bg "$BG_TASK_ID" )
+            """)
+        self.assertIn("nested", out.stdout)
+        self.assertNotIn("nested", self._status())
+
+
+if __name__ == '__main__':
+    unittest.main()
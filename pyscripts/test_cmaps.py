@@ -6,13 +6,22 @@ Tests with the sample ConfigMapList YAML file and creates individual ConfigMap
 files (both masked and unmasked use cases).
 """
 
+import argparse
+import io
+import os
+import shutil
 import tempfile
 import unittest
+import yaml
+from contextlib import redirect_stdout
 from pathlib import Path
-from cmaps import split_configmaps
+from cmaps import ListReader, Progress, split_configmaps, split_list
+from cmaps import add_split_arguments, run_split, split_lists
+from mask import MaskManifest, mask_resource
 
 SAMPLE_SRC_FILE = "tests/samples_plaintext/configmaps.yaml"
 TARGET_DIR = "configmaps"
+SECRET_SAMPLES = ["tests/samples/secret1.yaml", "tests/samples/secret2.yaml"]
 
 
 class TestConfigMapSplitting(unittest.TestCase):
@@ -109,6 +118,255 @@ class TestConfigMapSplitting(unittest.TestCase):
                               content, f"File {f} should have data section")
 
 
+class TestListSplitting(unittest.TestCase):
+    """
+    Test the generic List splitting functionality.
+    """
+
+    def setUp(self):
+        """
+        Build a SecretList from the sample secrets, as returned by
+        'oc get secrets -o yaml'.
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        items = []
+        for sample in SECRET_SAMPLES:
+            with open(sample, 'r') as f:
+                items.append(yaml.safe_load(f))
+        items.append({'apiVersion': 'v1', 'kind': 'Secret',
+                      'metadata': {'name': 'builder-dockercfg-x',
+                                   'namespace': 'other'},
+                      'type': 'kubernetes.io/dockercfg'})
+        self.list_file = os.path.join(self.temp_dir, "secrets.yaml")
+        with open(self.list_file, 'w') as f:
+            yaml.dump({'apiVersion': 'v1', 'kind': 'List', 'items': items}, f)
+        self.output_dir = os.path.join(self.temp_dir, "namespaces")
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def test_namespace_layout(self):
+        """
+        Items are split in the namespaces/<ns>/<kind>/<name>.yaml layout.
+        """
+        created = split_list(self.list_file, self.output_dir,
+                             layout="{namespace}/{kind}/{name}.yaml")
+        rel = sorted(os.path.relpath(f, self.output_dir) for f in created)
+        self.assertEqual(rel, ["openstack/Secret/rabbitmq-transport-url.yaml",
+                               "openstack/Secret/service1.yaml",
+                               "other/Secret/builder-dockercfg-x.yaml"])
+
+    def test_match_and_exclude(self):
+        """
+        Items are saved once per matching pattern, excluded items are
+        skipped.
+        """
+        created = split_list(self.list_file, self.output_dir,
+                             layout="{match}/{name}.yaml",
+                             match=["rabbitmq", "service", "builder"],
+                             exclude="(token|dockercfg)")
+        rel = sorted(os.path.relpath(f, self.output_dir) for f in created)
+        self.assertEqual(rel, ["rabbitmq/rabbitmq-transport-url.yaml",
+                               "service/service1.yaml"])
+
+    def test_match_case(self):
+        """
+        The patterns are case sensitive, unless ignore_case is set.
+        """
+        created = split_list(self.list_file, self.output_dir,
+                             match=["RabbitMQ", "Service"], exclude="DOCKER")
+        self.assertEqual(created, [])
+        created = split_list(self.list_file, self.output_dir,
+                             layout="{match}/{name}.yaml",
+                             match=["RabbitMQ", "BUILDER"], exclude="DOCKER",
+                             ignore_case=True)
+        rel = sorted(os.path.relpath(f, self.output_dir) for f in created)
+        self.assertEqual(rel, ["RabbitMQ/rabbitmq-transport-url.yaml"])
+
+    def test_long_lines_not_folded(self):
+        """
+        Long values are not folded, whether the items are masked
+        or not.
+        """
+        value = " ".join(["word"] * 50)
+        list_file = os.path.join(self.temp_dir, "cms.yaml")
+        with open(list_file, 'w') as f:
+            yaml.dump({'apiVersion': 'v1', 'kind': 'ConfigMapList',
+                       'items': [{'metadata': {'name': 'long'},
+                                  'data': {'note': value}}]}, f, width=80)
+        for apply_mask in (False, True):
+            out = os.path.join(self.temp_dir, f"mask-{apply_mask}")
+            created = split_list(list_file, out, apply_mask=apply_mask)
+            with open(created[0], 'r') as f:
+                self.assertIn(f"note: {value}\n", f.read())
+
+    def test_masked_items_match_mask_resource(self):
+        """
+        Items masked in memory are identical to the secrets collected one
+        by one and masked by mask.py, and are recorded in the manifest.
+        """
+        manifest_path = os.path.join(self.temp_dir, "manifest.jsonl")
+        created = split_list(self.list_file, self.output_dir,
+                             apply_mask=True, layout="{name}.yaml",
+                             match=["service1", "rabbitmq"], dump_conf=True,
+                             manifest=MaskManifest(manifest_path))
+        self.assertEqual(len(created), len(SECRET_SAMPLES))
+        for sample in SECRET_SAMPLES:
+            with open(sample, 'r') as f:
+                name = yaml.safe_load(f)['metadata']['name']
+            expected = os.path.join(self.temp_dir, f"{name}.yaml")
+            shutil.copy(sample, expected)
+            mask_resource(expected, True)
+            actual = os.path.join(self.output_dir, f"{name}.yaml")
+            self.assertEqual(Path(actual).read_text(),
+                             Path(expected).read_text())
+        self.assertEqual(sorted(MaskManifest(manifest_path).entries),
+                         sorted(created))
+
+    def test_masked_once(self):
+        """
+        A secret matching several services is masked once, the other
+        copies and their config files are hardlinks.
+        """
+        with open("tests/samples/secret3.yaml", 'r') as f:
+            item = yaml.safe_load(f)
+        with open(self.list_file, 'w') as f:
+            yaml.dump({'apiVersion': 'v1', 'kind': 'List', 'items': [item]},
+                      f)
+        manifest_path = os.path.join(self.temp_dir, "manifest.jsonl")
+        created = split_list(self.list_file, self.output_dir,
+                             apply_mask=True, layout="{match}/{name}.yaml",
+                             match=["service", "config"], dump_conf=True,
+                             manifest=MaskManifest(manifest_path))
+        rel = [os.path.relpath(f, self.output_dir) for f in created]
+        self.assertEqual(rel, ["service/service-config-data.yaml",
+                               "config/service-config-data.yaml"])
+        for name in ["service-config-data.yaml",
+                     "service-config-data.yaml-00-config.conf"]:
+            first, other = (os.stat(os.path.join(self.output_dir, d, name))
+                            for d in ["service", "config"])
+            self.assertEqual((first.st_ino, first.st_nlink),
+                             (other.st_ino, 2))
+        with open(os.path.join(self.output_dir, "config",
+                               "service-config-data.yaml-00-config.conf")) as f:
+            self.assertNotIn("examplePSW", f.read())
+        self.assertEqual(sorted(MaskManifest(manifest_path).entries),
+                         sorted(created))
+
+    def test_streamed_items(self):
+        """
+        Items are loaded one at a time, and match the fully loaded List.
+        """
+        with open(SAMPLE_SRC_FILE, 'r') as f:
+            expected = yaml.safe_load(f)
+        with open(SAMPLE_SRC_FILE, 'r') as f:
+            reader = ListReader(f)
+            items = reader.items()
+            self.assertEqual(next(items), expected['items'][0])
+            # kind follows the items in the oc output
+            self.assertNotIn('kind', reader.header)
+            self.assertEqual(list(items), expected['items'][1:])
+        self.assertEqual(reader.header['kind'], 'ConfigMapList')
+
+    def test_items_without_kind(self):
+        """
+        Items without kind get the kind of the List, so secrets are
+        masked as such.
+        """
+        items = []
+        for sample in SECRET_SAMPLES:
+            with open(sample, 'r') as f:
+                item = yaml.safe_load(f)
+            del item['kind']
+            items.append(item)
+        with open(self.list_file, 'w') as f:
+            yaml.dump({'items': items, 'kind': 'SecretList'}, f)
+        created = split_list(self.list_file, self.output_dir,
+                             apply_mask=True)
+        for f in created:
+            with open(f, 'r') as fh:
+                self.assertEqual(yaml.safe_load(fh)['kind'], 'Secret')
+        self.assertNotIn("YWJjZGVmCg==", Path(created[0]).read_text())
+
+    def test_not_a_list(self):
+        """
+        Documents that are not a List are rejected.
+        """
+        self.assertIsNone(split_list(SECRET_SAMPLES[0], self.output_dir))
+        self.assertFalse(os.path.exists(self.output_dir))
+
+    def test_parallel_matches_serial(self):
+        """
+        Lists split with a worker pool produce the same files as the
+        serial split, several Lists sharing the same pool.
+        """
+        trees = {}
+        for jobs in (1, 3):
+            out = os.path.join(self.temp_dir, f"jobs{jobs}")
+            pairs = [(self.list_file, os.path.join(out, "secrets")),
+                     (SAMPLE_SRC_FILE, os.path.join(out, "configmaps"))]
+            self.assertTrue(split_lists(pairs, jobs, apply_mask=True,
+                                        dump_conf=True))
+            trees[jobs] = {os.path.relpath(os.path.join(root, f), out):
+                           Path(root, f).read_bytes()
+                           for root, dirs, files in os.walk(out)
+                           for f in files}
+        self.assertGreater(len(trees[1]), 0)
+        self.assertEqual(trees[1], trees[3])
+
+    def test_missing_input(self):
+        """
+        Missing inputs are reported, the other Lists are still split.
+        """
+        pairs = [(os.path.join(self.temp_dir, "missing.yaml"),
+                  self.output_dir),
+                 (SAMPLE_SRC_FILE, self.output_dir)]
+        self.assertFalse(split_lists(pairs))
+        self.assertEqual(len(os.listdir(self.output_dir)), 3)
+
+    def test_kind_option(self):
+        """
+        The --kind option restricts the Lists whose items are saved.
+        """
+        parser = argparse.ArgumentParser()
+        add_split_arguments(parser)
+        pairs = [(self.list_file, os.path.join(self.temp_dir, "secrets")),
+                 (SAMPLE_SRC_FILE, self.output_dir)]
+        with redirect_stdout(io.StringIO()):
+            run_split(parser.parse_args(["--kind", "ConfigMapList"]), pairs)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir,
+                                                     "secrets")))
+        self.assertEqual(len(os.listdir(self.output_dir)), 3)
+
+    def test_progress_rate_limited(self):
+        """
+        Progress messages are not printed for every item.
+        """
+        out = io.StringIO()
+        progress = Progress("test", interval=3600)
+        with redirect_stdout(out):
+            for i in range(100):
+                progress.update(f"item-{i}")
+        self.assertEqual(out.getvalue(), "")
+        self.assertEqual(progress.count, 100)
+        progress.interval = 0
+        with redirect_stdout(out):
+            progress.update("last")
+        self.assertEqual(out.getvalue(), "  [101] last (test)\n")
+
+    def test_empty_input(self):
+        """
+        Empty input (e.g. the kind is not available) creates nothing.
+        """
+        empty = os.path.join(self.temp_dir, "empty.yaml")
+        Path(empty).write_text("")
+        self.assertEqual(split_list(empty, self.output_dir), [])
+        self.assertFalse(os.path.exists(self.output_dir))
+
+
 if __name__ == "__main__":
     # Run the unittest
     unittest.main()
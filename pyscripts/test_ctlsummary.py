@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+import unittest
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import shutil
+from ctlsummary import parse_table, summarize
+
+SERVICES = """\
++----+----------------+------------+----------+---------+-------+
+| ID | Binary         | Host       | Zone     | Status  | State |
++----+----------------+------------+----------+---------+-------+
+| 1  | nova-conductor | conductor  | internal | enabled | up    |
+| 2  | nova-compute   | compute-0  | nova     | enabled | up    |
+| 3  | nova-compute   | compute-1  | nova     | enabled | down  |
++----+----------------+------------+----------+---------+-------+
+"""
+
+CELLS = """\
++-------+--------------------------------------+---------------+----------+
+|  Name |                 UUID                 | Transport URL | Disabled |
++-------+--------------------------------------+---------------+----------+
+| cell0 | 00000000-0000-0000-0000-000000000000 |     none:/    |  False   |
+| cell1 | 1f2e3d4c-0000-0000-0000-000000000001 |  rabbit://*** |  False   |
+| cell2 | 1f2e3d4c-0000-0000-0000-000000000002 |  rabbit://*** |  False   |
++-------+--------------------------------------+---------------+----------+
+"""
+
+HOSTS = """\
++-----------+--------------------------------------+-----------+
+| Cell Name |              Cell UUID               |  Hostname |
++-----------+--------------------------------------+-----------+
+|   cell1   | 1f2e3d4c-0000-0000-0000-000000000001 | compute-0 |
+|   cell1   | 1f2e3d4c-0000-0000-0000-000000000001 | compute-9 |
++-----------+--------------------------------------+-----------+
+"""
+
+PORTS = """\
++------+------+------------------------------------+--------+
+| ID   | Name | Fixed IP Addresses                 | Status |
++------+------+------------------------------------+--------+
+| p1   |      | ip_address='10.0.0.1', subnet_id=1 | ACTIVE |
+|      |      | ip_address='10.0.1.1', subnet_id=2 |        |
+| p2   | vm2  | ip_address='10.0.0.2', subnet_id=1 | ERROR  |
++------+------+------------------------------------+--------+
+"""
+
+
+class TestCtlSummary(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the summary index of the control plane status.
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory with the outputs of
+        gather_services_status
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self._write("nova/service_list", SERVICES)
+        self._write("nova/cell_list", CELLS)
+        self._write("nova/host_list", HOSTS)
+        self._write("neutron/port_list", PORTS)
+        self._write("neutron/agent_list.json", json.dumps([
+            {"ID": "a1", "Agent Type": "OVN Controller agent",
+             "Host": "compute-0", "Alive": True, "State": True},
+            {"ID": "a2", "Agent Type": "OVN Controller agent",
+             "Host": "compute-1", "Alive": False, "State": True}]))
+        # the lists of each zone are concatenated
+        self._write("designate/recordset_list.json",
+                    '[{"id": "r1", "status": "ACTIVE"}]\n'
+                    '[{"id": "r2", "status": "ERROR"}]\n')
+        self._write("ovn/ovnnb_db.db", "OVSDB CLUSTER 1 | 2\n")
+        self._write("openstack_batch", ">\tports\tport list\n")
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _write(self, name, content):
+        """
+        utility function to write an output in the ctlplane directory.
+        """
+        path = os.path.join(self.temp_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_parse_table(self):
+        """
+        The cells continued on several lines are joined.
+        """
+        rows = parse_table(PORTS)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]["Fixed IP Addresses"],
+                         "ip_address='10.0.0.1', subnet_id=1\n"
+                         "ip_address='10.0.1.1', subnet_id=2")
+        self.assertEqual((rows[1]["Name"], rows[1]["Status"]),
+                         ("vm2", "ERROR"))
+
+    def test_summary(self):
+        """
+        The states are counted, the services down, the ports in error and
+        the hosts missing a mapping or a service are listed.
+        """
+        summary = summarize(self.temp_dir)
+        self.assertEqual(sorted(summary["counts"]), [
+            "designate/recordset_list", "neutron/agent_list",
+            "neutron/port_list", "nova/cell_list", "nova/host_list",
+            "nova/service_list"])
+        self.assertEqual(summary["counts"]["nova/service_list"], {
+            "total": 3, "State": {"up": 2, "down": 1},
+            "Status": {"enabled": 3}})
+        self.assertEqual(summary["counts"]["designate/recordset_list"],
+                         {"total": 2, "status": {"ACTIVE": 1, "ERROR": 1}})
+        self.assertEqual([(d["source"], d["Host"]) for d in summary["down"]],
+                         [("neutron/agent_list", "compute-1"),
+                          ("nova/service_list", "compute-1")])
+        self.assertEqual(summary["error_ports"],
+                         [{"ID": "p2", "Name": "vm2", "Status": "ERROR"}])
+        self.assertEqual(summary["cells"], {
+            "hosts": {"cell0": 0, "cell1": 2, "cell2": 0},
+            "empty_cells": ["cell2"],
+            "unmapped_hosts": ["compute-1"],
+            "unknown_hosts": ["compute-9"]})
+
+    def test_json_preferred(self):
+        """
+        The JSON capture of an output is read instead of its table.
+        """
+        self._write("nova/service_list.json", json.dumps([
+            {"ID": 2, "Binary": "nova-compute", "Host": "compute-0",
+             "State": "up"}]))
+        summary = summarize(self.temp_dir)
+        self.assertEqual(summary["counts"]["nova/service_list"],
+                         {"total": 1, "State": {"up": 1}})
+        self.assertEqual(summary["cells"]["unmapped_hosts"], [])
+
+    def test_command(self):
+        """
+        The index is written to summary.json, which is not indexed again.
+        """
+        for _ in range(2):
+            ret = subprocess.run(
+                [sys.executable, "ctlsummary.py", self.temp_dir],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True, timeout=60)
+            self.assertEqual(ret.returncode, 0, ret.stderr)
+        self.assertIn("Indexed 6 lists", ret.stdout)
+        self.assertIn("2 down, 1 ports in error, 1 unmapped hosts",
+                      ret.stdout)
+        with open(os.path.join(self.temp_dir, "summary.json"), 'r') as f:
+            self.assertEqual(len(json.load(f)["down"]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
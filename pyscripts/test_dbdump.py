@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+import unittest
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import shutil
+from unittest import mock
+import dbdump
+
+# stands for oc exec in the galera pods, neutron fails to be dumped, nova
+# is large and keystone has passwords
+OC = """#!/bin/sh
+pod=$6
+shift 7
+for db; do :; done
+case "$1" in
+    mysql)
+        [ "$pod" = broken-galera-0 ] && { echo "not ready" >&2; exit 1; }
+        printf 'information_schema\\nkeystone\\nnova\\nneutron\\n' ;;
+    mysqldump)
+        echo "-- options: $*"
+        case "$db" in
+            neutron) echo "Got error: 1045" >&2; exit 2 ;;
+            nova) seq 1 50000 | sed 's/.*/INSERT INTO instances VALUES (&);/' ;;
+            keystone) echo "INSERT INTO \\`password\\` (\\`id\\`," \\
+                "\\`password_hash\\`) VALUES (1,'\\$2b\\$12\\$abcd');" ;;
+        esac ;;
+esac
+"""
+
+
+class TestDbDump(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the parallel dumps of the databases.
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory with the fake oc command
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.bin = os.path.join(self.temp_dir, "bin")
+        os.makedirs(self.bin)
+        with open(os.path.join(self.bin, "oc"), 'w') as f:
+            f.write(OC)
+        os.chmod(os.path.join(self.bin, "oc"), 0o755)
+        self.out = os.path.join(self.temp_dir, "dbs", "openstack")
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _run(self, *args):
+        """
+        utility function to run the dumps with the fake oc command.
+        """
+        env = dict(os.environ,
+                   PATH=self.bin + os.pathsep + os.environ["PATH"])
+        return subprocess.run(
+            [sys.executable, "dbdump.py", "--namespace", "openstack",
+             "--output-dir", self.out] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, timeout=60, env=env)
+
+    def _stats(self):
+        """
+        utility function to return the records of the dumps by file.
+        """
+        with open(os.path.join(self.out, "dumps.json"), 'r') as f:
+            return {r["file"]: r for r in json.load(f)}
+
+    def test_selected(self):
+        """
+        The databases asked for are dumped when they exist, the large
+        dumps are compressed and the failures reported.
+        """
+        ret = self._run("--databases", "nova,neutron,cinder", "--jobs", "2",
+                        "openstack-galera-0", "broken-galera-0")
+        self.assertEqual(ret.returncode, 1)
+        self.assertIn("Database cinder does not exist on openstack-galera-0",
+                      ret.stdout)
+        self.assertIn("Can't list the databases of broken-galera-0",
+                      ret.stderr)
+        self.assertIn("Dump of neutron on openstack-galera-0 failed: "
+                      "Got error: 1045", ret.stderr)
+        self.assertEqual(sorted(os.listdir(self.out)), [
+            "dumps.json", "openstack-galera-0-neutron.sql",
+            "openstack-galera-0-nova.sql.gz"])
+        stats = self._stats()
+        nova = stats["openstack-galera-0-nova.sql.gz"]
+        with gzip.open(os.path.join(self.out, nova["file"]), 'rt') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], "-- options: mysqldump -uroot "
+                         "--single-transaction --complete-insert "
+                         "--skip-lock-tables --lock-tables=0 nova")
+        self.assertEqual(lines[-1], "INSERT INTO instances VALUES (50000);")
+        self.assertEqual(nova["dump_size"], len("\n".join(lines)) + 1)
+        self.assertLess(nova["size"], nova["dump_size"] / 4)
+        self.assertEqual(nova["status"], 0)
+        self.assertEqual(stats["openstack-galera-0-neutron.sql"]["status"], 2)
+
+    def test_all(self):
+        """
+        All the databases but the system ones are dumped separately.
+        """
+        ret = self._run("--options=--single-transaction",
+                        "openstack-galera-0")
+        self.assertEqual(ret.returncode, 1)
+        self.assertEqual(sorted(r["database"] for r in self._stats().values()),
+                         ["keystone", "neutron", "nova"])
+        with open(os.path.join(self.out,
+                               "openstack-galera-0-keystone.sql"), 'r') as f:
+            self.assertEqual(f.read(), "-- options: mysqldump -uroot "
+                             "--single-transaction keystone\n"
+                             "INSERT INTO `password` (`id`, `password_hash`) "
+                             "VALUES (1,'$2b$12$abcd');\n")
+        self.assertNotIn("masked", self._stats()[
+            "openstack-galera-0-keystone.sql"])
+
+    def test_masked(self):
+        """
+        The dumps are masked while they are streamed with --mask.
+        """
+        ret = self._run("--mask", "--databases", "keystone,nova",
+                        "openstack-galera-0")
+        self.assertEqual(ret.returncode, 0, ret.stderr)
+        stats = self._stats()
+        keystone = stats["openstack-galera-0-keystone.sql"]
+        with open(os.path.join(self.out, keystone["file"]), 'r') as f:
+            self.assertEqual(f.read().splitlines()[1],
+                             "INSERT INTO `password` (`id`, `password_hash`) "
+                             "VALUES (1,'**********');")
+        self.assertEqual(keystone["masked"], 1)
+        nova = stats["openstack-galera-0-nova.sql.gz"]
+        self.assertEqual(nova["masked"], 0)
+        with gzip.open(os.path.join(self.out, nova["file"]), 'rt') as f:
+            self.assertEqual(len(f.read()), nova["dump_size"])
+
+    def test_mask_failure(self):
+        """
+        A dump failing for any reason is recorded as failed, its
+        mysqldump being stopped.
+        """
+        path = self.bin + os.pathsep + os.environ["PATH"]
+        with mock.patch.dict(os.environ, PATH=path), \
+                mock.patch.object(dbdump, "save",
+                                  side_effect=ValueError("bad dump")):
+            os.makedirs(self.out)
+            record = dbdump.dump("openstack", "openstack-galera-0", "nova",
+                                 self.out, [], 1024, 1, mask=True)
+        self.assertEqual((record["status"], record["file"]), (1, None))
+        self.assertIn("bad dump", record["error"])
+
+
+if __name__ == '__main__':
+    unittest.main()
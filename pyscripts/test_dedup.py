@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+import unittest
+import os
+import subprocess
+import sys
+import tempfile
+import shutil
+from dedup import dedup, human
+
+CONFIG = b"[DEFAULT]\ntransport_url = **********\n" * 100
+
+
+class TestDedup(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the replacement of the duplicated files with hardlinks.
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory with duplicated files
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.files = {}
+        for path, content in [
+                ("secrets/nova/config.yaml", CONFIG),
+                ("secrets/placement/config.yaml", CONFIG),
+                ("secrets/glance/config.yaml", CONFIG),
+                ("secrets/glance/other.yaml", CONFIG[:-1] + b"x"),
+                ("logs/big.log", b"line\n" * 100000),
+                ("logs/big-copy.log", b"line\n" * 100000),
+                ("logs/big-tail.log", b"line\n" * 99999 + b"diff\n"),
+                ("small/a", b"x"),
+                ("small/b", b"x"),
+                (".discovery_cache/crds", CONFIG)]:
+            self.files[path] = os.path.join(self.temp_dir, path)
+            os.makedirs(os.path.dirname(self.files[path]), exist_ok=True)
+            with open(self.files[path], 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _inode(self, path):
+        """
+        utility function to return the inode of a file.
+        """
+        return os.stat(self.files[path]).st_ino
+
+    def test_dedup(self):
+        """
+        Files with the same content are linked, the space saved is
+        reported, different and small files are left alone.
+        """
+        replaced, saved = dedup(self.temp_dir, [".discovery_cache"])
+        self.assertEqual(replaced, 3)
+        self.assertEqual(saved, 2 * len(CONFIG) + 500000)
+        self.assertEqual(len({self._inode(p) for p in [
+            "secrets/nova/config.yaml", "secrets/placement/config.yaml",
+            "secrets/glance/config.yaml"]}), 1)
+        self.assertEqual(self._inode("logs/big.log"),
+                         self._inode("logs/big-copy.log"))
+        for path in ["secrets/glance/other.yaml", "logs/big-tail.log",
+                     "small/b", ".discovery_cache/crds"]:
+            self.assertEqual(os.stat(self.files[path]).st_nlink, 1, path)
+        with open(self.files["secrets/placement/config.yaml"], 'rb') as f:
+            self.assertEqual(f.read(), CONFIG)
+        # files already linked are not counted again
+        self.assertEqual(dedup(self.temp_dir, [".discovery_cache"]), (0, 0))
+
+    def test_linked_groups(self):
+        """
+        Groups of files already linked are merged, the largest one
+        is kept.
+        """
+        os.unlink(self.files["secrets/glance/config.yaml"])
+        os.link(self.files["secrets/placement/config.yaml"],
+                self.files["secrets/glance/config.yaml"])
+        placement = self._inode("secrets/placement/config.yaml")
+        self.assertEqual(dedup(self.temp_dir, min_size=1 << 20), (0, 0))
+        replaced, saved = dedup(self.temp_dir, [".discovery_cache"])
+        self.assertEqual((replaced, saved), (2, len(CONFIG) + 500000))
+        self.assertEqual(self._inode("secrets/nova/config.yaml"), placement)
+
+    def test_command(self):
+        """
+        The dry run reports the space that would be saved.
+        """
+        ret = subprocess.run(
+            [sys.executable, "dedup.py", "--dry-run", self.temp_dir],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, timeout=60)
+        self.assertEqual(ret.returncode, 0, ret.stderr)
+        self.assertIn("Would replace 4 duplicated files with hardlinks, "
+                      f"saving {human(3 * len(CONFIG) + 500000)}", ret.stdout)
+        self.assertEqual(os.stat(self.files["logs/big.log"]).st_nlink, 1)
+        self.assertEqual(human(3 << 20), "3.0 MiB")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+
+import unittest
+import os
+import subprocess
+import tempfile
+import shutil
+
+SCRIPTS_DIR = os.path.abspath("../collection-scripts")
+
+
+class TestDiscoveryCache(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the discovery cache shared by the collection scripts.
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory for the collected data
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.counter = os.path.join(self.temp_dir, "calls")
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _run(self, script, **env):
+        """
+        utility function to run a script with the functions of
+        common.sh, returning its output.
+        """
+        script = f'source "{SCRIPTS_DIR}/common.sh"\n' + script
+        env = dict(os.environ, DIR_NAME=SCRIPTS_DIR, BG_SCHEDULER="0",
+                   KUBEAPI="0", TRACE_FILE="", BG_STATUS_FILE="",
+                   BASE_COLLECTION_PATH=self.temp_dir, **env)
+        return subprocess.run(["bash", "-c", script], env=env, check=True,
+                              stdout=subprocess.PIPE, universal_newlines=True,
+                              timeout=60).stdout
+
+    def _calls(self):
+        """
+        utility function to return the number of times the looked up
+        command has been run.
+        """
+        with open(self.counter, 'r') as f:
+            return len(f.read().split())
+
+    def test_cached(self):
+        """
+        The output and status of the commands are reused, failures
+        only when requested.
+        """
+        out = self._run(f"""
+            lookup() {{ echo x >> "{self.counter}"; echo "value $1"; return $2; }}
+            cached k1 lookup a 0
+            cached k1 lookup b 0
+            ( cached k1 lookup c 0 )
+            cached k2 lookup d 1 || echo "failed $?"
+            cached k2 lookup e 1 || echo "failed $?"
+            cached --failures 'k 3' lookup f 3
+            cached --failures 'k 3' lookup g 0 || echo "failed $?"
+            """)
+        self.assertEqual(out.split("\n"), [
+            "value a", "value a", "value a", "value d", "failed 1",
+            "value e", "failed 1", "value f", "value f", "failed 3", ""])
+        self.assertEqual(self._calls(), 4)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.temp_dir, ".discovery_cache", "k_3")))
+
+    def test_expiry_and_invalidation(self):
+        """
+        Expired and invalidated entries are looked up again.
+        """
+        script = f"""
+            lookup() {{ echo x >> "{self.counter}"; echo "$1"; }}
+            cached pods_ns1 lookup a
+            cached pods_ns2 lookup b
+            cached crds lookup c
+            discovery_invalidate pods_ns1
+            cached pods_ns1 lookup d
+            cached pods_ns2 lookup e
+            discovery_invalidate
+            cached crds lookup f
+            """
+        self.assertEqual(self._run(script).split(),
+                         ["a", "b", "c", "d", "b", "f"])
+        self.assertEqual(self._calls(), 5)
+        out = self._run(script, DISCOVERY_CACHE_TTL="0")
+        self.assertEqual(out.split(), ["a", "b", "c", "d", "e", "f"])
+        out = self._run(script, DISCOVERY_CACHE="")
+        self.assertEqual(out.split(), ["a", "b", "c", "d", "e", "f"])
+
+
+if __name__ == '__main__':
+    unittest.main()
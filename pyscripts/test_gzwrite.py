@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+import unittest
+import gzip
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import shutil
+from gzwrite import save
+
+
+class TestGzWrite(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the compression of the artifacts while they are written.
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory for test files
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "pod.log")
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def test_small_file(self):
+        """
+        Small outputs are written as they are.
+        """
+        written = save(io.BytesIO(b"line\n" * 10), self.path, min_size=100)
+        self.assertEqual(written, self.path)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b"line\n" * 10)
+        self.assertEqual(os.listdir(self.temp_dir), ["pod.log"])
+
+    def test_large_file(self):
+        """
+        Large outputs are compressed, replacing the file of a previous
+        attempt, and the same content gives the same file.
+        """
+        with open(self.path, 'w') as f:
+            f.write("partial")
+        data = b"".join(b"%d INFO message\n" % i for i in range(100000))
+        written = save(io.BytesIO(data), self.path, min_size=1000)
+        self.assertEqual(written, self.path + ".gz")
+        self.assertEqual(os.listdir(self.temp_dir), ["pod.log.gz"])
+        with gzip.open(written, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        with open(written, 'rb') as f:
+            first = f.read()
+        self.assertLess(len(first), len(data) / 4)
+        save(io.BytesIO(data), self.path, min_size=1000)
+        with open(written, 'rb') as f:
+            self.assertEqual(f.read(), first)
+
+    def test_command(self):
+        """
+        The standard input is saved, and the file of a previous
+        attempt is replaced.
+        """
+        with open(self.path + ".gz", 'w') as f:
+            f.write("partial")
+        ret = subprocess.run([sys.executable, "gzwrite.py", self.path],
+                             input=b"short\n", stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, timeout=60)
+        self.assertEqual(ret.returncode, 0, ret.stderr)
+        self.assertEqual(os.listdir(self.temp_dir), ["pod.log"])
+        ret = subprocess.run([sys.executable, "gzwrite.py", "/nonexistent/x"],
+                             input=b"short\n", stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, timeout=60)
+        self.assertEqual(ret.returncode, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
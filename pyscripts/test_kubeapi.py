@@ -0,0 +1,335 @@
+#!/usr/bin/python
+
+import unittest
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import shutil
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from kubeapi import ApiClient, ApiError
+
+TOKEN = "sa-token"
+
+CORE_RESOURCES = {"kind": "APIResourceList", "groupVersion": "v1",
+                  "resources": [
+                      {"name": "namespaces", "singularName": "namespace",
+                       "namespaced": False, "kind": "Namespace",
+                       "shortNames": ["ns"]},
+                      {"name": "configmaps", "singularName": "configmap",
+                       "namespaced": True, "kind": "ConfigMap",
+                       "shortNames": ["cm"]},
+                      {"name": "secrets", "singularName": "secret",
+                       "namespaced": True, "kind": "Secret"},
+                      {"name": "pods/log", "singularName": "",
+                       "namespaced": True, "kind": "Pod"}]}
+
+AGGREGATED = {"kind": "APIGroupDiscoveryList", "items": [
+    {"metadata": {"name": "apps"}, "versions": [
+        {"version": "v1", "resources": [
+            {"resource": "deployments", "singularResource": "deployment",
+             "scope": "Namespaced", "shortNames": ["deploy"],
+             "responseKind": {"kind": "Deployment"}}]}]}]}
+
+OPENSTACK_GROUP = {"kind": "APIGroup", "name": "core.openstack.org",
+                   "preferredVersion": {"groupVersion":
+                                        "core.openstack.org/v1beta1",
+                                        "version": "v1beta1"}}
+
+OPENSTACK_RESOURCES = {"kind": "APIResourceList",
+                       "groupVersion": "core.openstack.org/v1beta1",
+                       "resources": [
+                           {"name": "openstackcontrolplanes",
+                            "singularName": "openstackcontrolplane",
+                            "namespaced": True,
+                            "kind": "OpenStackControlPlane",
+                            "shortNames": ["osctlplane"]}]}
+
+
+def secret(i, ns="openstack"):
+    """
+    utility function to return a secret as stored by the API server.
+    """
+    return {"metadata": {"name": f"secret-{i}", "namespace": ns,
+                         "managedFields": [{"manager": "kubectl",
+                                            "operation": "Update"}]},
+            "type": "Opaque", "data": {"password": f"c2VjcmV0LXt{i}"}}
+
+
+class StubApi(BaseHTTPRequestHandler):
+    """
+    Handler of a stub API server serving the discovery and the objects in
+    server.objects, by path, paginating the Lists.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, obj):
+        body = json.dumps(obj).encode()
+        # close the connection without telling the client, as the idle
+        # connections closed by a server
+        self.close_connection = self.server.drop
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def status(self, code, reason, message, extra=None):
+        self.reply(code, dict({"kind": "Status", "status": "Failure",
+                               "reason": reason, "message": message,
+                               "code": code}, **extra or {}))
+
+    def do_GET(self):
+        server = self.server
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        server.requests.append((url.path, query))
+        server.clients.add(self.client_address)
+        if self.headers.get("Authorization") != f"Bearer {server.token}":
+            return self.status(401, "Unauthorized", "Unauthorized")
+        if server.fail:
+            return self.status(*server.fail.pop(0))
+        if url.path == "/version":
+            return self.reply(200, {"major": "1", "minor": "31"})
+        if url.path == "/api/v1":
+            return self.reply(200, CORE_RESOURCES)
+        if url.path == "/apis":
+            if "APIGroupDiscoveryList" not in self.headers.get("Accept"):
+                return self.status(406, "NotAcceptable", "not acceptable")
+            return self.reply(200, AGGREGATED)
+        if url.path == "/apis/core.openstack.org":
+            return self.reply(200, OPENSTACK_GROUP)
+        if url.path == "/apis/core.openstack.org/v1beta1":
+            return self.reply(200, OPENSTACK_RESOURCES)
+        obj = server.objects.get(url.path)
+        if obj is None:
+            return self.status(404, "NotFound", f"{url.path} not found")
+        if isinstance(obj, dict):
+            return self.reply(200, obj)
+        start = int(query.get("continue", 0))
+        end = start + int(query.get("limit", len(obj)))
+        page = {"kind": "SecretList", "apiVersion": "v1",
+                "metadata": {"resourceVersion": "1"}, "items": obj[start:end]}
+        if end < len(obj):
+            page["metadata"]["continue"] = str(end)
+        self.reply(200, page)
+
+
+class TestKubeApi(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the API client, against a stub API server.
+    """
+
+    def setUp(self):
+        """
+        Start the stub API server, and set up temporary directory
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.token_file = os.path.join(self.temp_dir, "token")
+        with open(self.token_file, 'w') as f:
+            f.write(TOKEN + "\n")
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubApi)
+        self.server.daemon_threads = True
+        self.server.token = TOKEN
+        self.server.requests = []
+        self.server.clients = set()
+        self.server.fail = []
+        self.server.drop = False
+        self.server.objects = {
+            "/api/v1/namespaces/openstack/secrets":
+                [secret(i) for i in range(7)],
+            "/api/v1/namespaces/openstack":
+                {"kind": "Namespace", "metadata": {
+                    "name": "openstack",
+                    "managedFields": [{"manager": "kubectl"}]}},
+        }
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.05,))
+        self.thread.start()
+        self.client = ApiClient(self.url, token_file=self.token_file,
+                                chunk_size=3)
+
+    def tearDown(self):
+        """
+        Stop the stub API server, and clean up temporary directory
+        """
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.temp_dir)
+
+    def _run(self, *args):
+        """
+        utility function to run kubeapi.py against the stub server.
+        """
+        return subprocess.run(
+            [sys.executable, "kubeapi.py", "--server", self.url,
+             "--token-file", self.token_file, "--chunk-size", "3"]
+            + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, timeout=60)
+
+    def test_list_pages(self):
+        """
+        Lists are read in pages over a single connection, and their
+        objects get their kind and apiVersion.
+        """
+        stream = self.client.list("secrets", "openstack")
+        items = list(stream.items())
+        self.assertEqual([i["metadata"]["name"] for i in items],
+                         [f"secret-{i}" for i in range(7)])
+        self.assertEqual(list(items[0]),
+                         ["apiVersion", "data", "kind", "metadata", "type"])
+        self.assertEqual((items[0]["kind"], items[0]["apiVersion"]),
+                         ("Secret", "v1"))
+        self.assertEqual(stream.header["kind"], "SecretList")
+        pages = [q for p, q in self.server.requests if p.endswith("secrets")]
+        self.assertEqual(pages, [{"limit": "3"},
+                                 {"limit": "3", "continue": "3"},
+                                 {"limit": "3", "continue": "6"}])
+        self.assertEqual((self.client.connections, len(self.server.clients)),
+                         (1, 1))
+
+    def test_resolve(self):
+        """
+        Resource types are found as oc does, by name, short name,
+        kind or with their group.
+        """
+        self.assertEqual(self.client.resolve("cm").path("ns"),
+                         "/api/v1/namespaces/ns/configmaps")
+        self.assertEqual(self.client.resolve("Namespace").path("ns", "x"),
+                         "/api/v1/namespaces/x")
+        self.assertEqual(self.client.resolve("deploy").path(),
+                         "/apis/apps/v1/deployments")
+        res = self.client.resolve("openstackcontrolplanes.core.openstack.org")
+        self.assertEqual((res.kind, res.api_version),
+                         ("OpenStackControlPlane", "core.openstack.org/v1beta1"))
+        with self.assertRaisesRegex(ApiError, "resource type \"foo\""):
+            self.client.resolve("foo")
+        with self.assertRaisesRegex(ApiError, "resource type \"log\""):
+            self.client.resolve("log")
+        # the discovery is done once
+        self.client.resolve("secrets")
+        paths = [p for p, _ in self.server.requests]
+        self.assertEqual(paths.count("/api/v1"), 1)
+        self.assertEqual(paths.count("/apis"), 1)
+
+    def test_discovery_cache(self):
+        """
+        The discovery stored in the cache directory is shared by the
+        clients until it expires.
+        """
+        cache_dir = os.path.join(self.temp_dir, "cache")
+        os.mkdir(cache_dir)
+        for _ in range(2):
+            client = ApiClient(self.url, token_file=self.token_file,
+                               cache_dir=cache_dir)
+            client.resolve("deploy")
+            client.resolve("osctlplane.core.openstack.org")
+            client.close()
+        paths = [p for p, _ in self.server.requests]
+        self.assertEqual(paths, ["/api/v1", "/apis", "/apis/core.openstack.org",
+                                 "/apis/core.openstack.org/v1beta1"])
+        client = ApiClient(self.url, token_file=self.token_file,
+                           cache_dir=cache_dir, cache_ttl=0)
+        client.resolve("cm")
+        client.close()
+        self.assertEqual(self.server.requests[-1][0], "/api/v1")
+
+    def test_errors(self):
+        """
+        Errors of the API server are reported as oc does, expired
+        continue tokens and rotated tokens are handled.
+        """
+        with self.assertRaises(ApiError) as cm:
+            self.client.get("namespaces", "missing")
+        self.assertEqual(cm.exception.status, 404)
+        self.assertEqual(str(cm.exception), "Error from server (NotFound): "
+                         "/api/v1/namespaces/missing not found")
+        stream = self.client.list("secrets", "openstack")
+        items = stream.items()
+        next(items)
+        self.server.fail = [(410, "Expired", "expired",
+                             {"metadata": {"continue": "5"}})]
+        self.assertEqual(len(list(items)), 4)
+        # the token of the service account is read again
+        self.server.token = "rotated"
+        with open(self.token_file, 'w') as f:
+            f.write("rotated")
+        self.assertEqual(self.client.get("ns", "openstack")["kind"],
+                         "Namespace")
+        self.server.fail = [(429, "TooManyRequests", "slow down")]
+        with self.assertRaisesRegex(ApiError, r"\(TooManyRequests\)"):
+            self.client.get("ns", "openstack")
+
+    def test_reconnect(self):
+        """
+        A connection closed by the server is replaced.
+        """
+        self.client.resolve("ns")
+        self.server.drop = True
+        self.client.get("ns", "openstack")
+        self.server.drop = False
+        self.assertEqual(self.client.get("ns", "openstack")["metadata"],
+                         {"name": "openstack"})
+        self.assertEqual(self.client.connections, 2)
+
+    def test_oc_shape(self):
+        """
+        The objects are returned as oc get -o json writes them,
+        with sorted keys and without their managedFields.
+        """
+        items = list(self.client.list("secrets", "openstack").items())
+        self.assertEqual(items[0], {
+            "apiVersion": "v1", "data": {"password": "c2VjcmV0LXt0"},
+            "kind": "Secret", "metadata": {"name": "secret-0",
+                                           "namespace": "openstack"},
+            "type": "Opaque"})
+        self.assertEqual(list(items[0]), sorted(items[0]))
+        self.assertEqual(self.client.get("ns", "openstack")["metadata"],
+                         {"name": "openstack"})
+
+    def test_get_command(self):
+        """
+        get writes the List as oc get -o json, and fails as oc.
+        """
+        out = os.path.join(self.temp_dir, "secrets.json")
+        ret = self._run("get", "-n", "openstack", "secrets", "-o", out)
+        self.assertEqual(ret.returncode, 0, ret.stderr)
+        with open(out, 'r') as f:
+            data = json.load(f)
+        self.assertEqual(data["kind"], "List")
+        self.assertEqual(len(data["items"]), 7)
+        ret = self._run("get", "namespaces", "missing")
+        self.assertEqual(ret.returncode, 1)
+        self.assertIn("Error from server (NotFound)", ret.stderr)
+
+    def test_split_command(self):
+        """
+        split saves the objects in one file each, masked.
+        """
+        out = os.path.join(self.temp_dir, "secrets")
+        ret = self._run("split", "-n", "openstack", "secrets", out,
+                        "--mask", "--exclude", "secret-6", "-j", "1")
+        self.assertEqual(ret.returncode, 0, ret.stderr)
+        files = sorted(os.listdir(out))
+        self.assertEqual(files, [f"secret-{i}.yaml" for i in range(6)])
+        with open(os.path.join(out, "secret-1.yaml"), 'r') as f:
+            content = f.read()
+        self.assertIn("kind: Secret", content)
+        self.assertNotIn("c2VjcmV0LXt1", content)
+        ret = self._run("split", "-n", "openstack", "foo", out)
+        self.assertEqual(ret.returncode, 1)
+        self.assertIn('resource type "foo"', ret.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+
+import unittest
+import json
+import subprocess
+import sys
+from logplan import parse_size, plan
+
+RUNNING = {"running": {"startedAt": "2026-01-01T00:00:00Z"}}
+CRASHED = {"terminated": {"exitCode": 1, "reason": "Error"}}
+COMPLETED = {"terminated": {"exitCode": 0, "reason": "Completed"}}
+
+
+def container(name, state=None, last=None, restarts=0):
+    """
+    utility function to return the status of a container.
+    """
+    return {"name": name, "state": state or RUNNING,
+            "lastState": {"terminated": last} if last else {},
+            "restartCount": restarts}
+
+
+def pod(name, containers, init=None):
+    """
+    utility function to return a pod with the given container statuses.
+    """
+    status = {"containerStatuses": containers}
+    if init is not None:
+        status["initContainerStatuses"] = init
+    return {"metadata": {"name": name}, "status": status}
+
+
+PODS = [
+    pod("api-0", [container("api"), container("httpd")],
+        init=[container("init", COMPLETED),
+              container("wait", {"waiting": {"reason": "PodInitializing"}})]),
+    pod("worker-0", [container("worker",
+                               {"waiting": {"reason": "CrashLoopBackOff"}},
+                               CRASHED["terminated"], 5)]),
+    pod("proxy-0", [container("proxy", last=COMPLETED["terminated"],
+                              restarts=1)]),
+    {"metadata": {"name": "pending-0"}, "status": {"phase": "Pending"}},
+]
+
+
+class TestLogPlan(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the planning of the pod logs.
+    """
+
+    def _lines(self, tasks):
+        """
+        utility function to return the tasks as printed.
+        """
+        return [t.line() for t in tasks]
+
+    def test_plan(self):
+        """
+        Every pod is described, the logs of the started containers are
+        gathered once, crashing and restarted ones first.
+        """
+        names, tasks = plan(PODS)
+        self.assertEqual(names, ["api-0", "worker-0", "proxy-0", "pending-0"])
+        self.assertEqual(self._lines(tasks), [
+            "previous worker-0 worker 2",
+            "log proxy-0 proxy 1", "previous proxy-0 proxy 1",
+            "init api-0 init 0", "log api-0 api 0", "log api-0 httpd 0"])
+
+    def test_limits(self):
+        """
+        Each log is capped, the current logs are limited in time.
+        """
+        _, tasks = plan(PODS[1:3], limit=1024)
+        self.assertEqual([t.line("1h") for t in tasks], [
+            "previous worker-0 worker 2 --limit-bytes=1024",
+            "log proxy-0 proxy 1 --limit-bytes=1024 --since=1h",
+            "previous proxy-0 proxy 1 --limit-bytes=1024"])
+
+    def test_budget(self):
+        """
+        The budget is shared by priority, the share the capped logs
+        don't use goes to the others.
+        """
+        _, tasks = plan(PODS, budget=1100)
+        limits = {(t.kind, t.pod): t.limit for t in tasks}
+        self.assertEqual(limits[("previous", "worker-0")], 400)
+        self.assertEqual(limits[("log", "proxy-0")], 200)
+        self.assertEqual(limits[("log", "api-0")], 100)
+        _, tasks = plan(PODS, limit=300, budget=1100)
+        limits = {(t.kind, t.pod): t.limit for t in tasks}
+        self.assertEqual(limits[("previous", "worker-0")], 300)
+        self.assertEqual(limits[("previous", "proxy-0")], 228)
+        self.assertEqual(limits[("log", "api-0")], 114)
+        self.assertLessEqual(sum(t.limit for t in tasks), 1100)
+
+    def test_parse_size(self):
+        """
+        Sizes are given in bytes or with a unit.
+        """
+        self.assertEqual([parse_size(s) for s in ["512", "10K", "2Mi", "1G"]],
+                         [512, 10000, 2 * 2**20, 10**9])
+
+    def test_command(self):
+        """
+        The pods are read from stdin, the pods to describe come first.
+        """
+        ret = subprocess.run(
+            [sys.executable, "logplan.py", "--limit-bytes", "1Ki",
+             "--since", "30m"], input=json.dumps({"items": PODS[1:]}),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, timeout=60)
+        self.assertEqual(ret.returncode, 0, ret.stderr)
+        self.assertEqual(ret.stdout.splitlines(), [
+            "describe worker-0", "describe proxy-0", "describe pending-0",
+            "previous worker-0 worker 2 --limit-bytes=1024",
+            "log proxy-0 proxy 1 --limit-bytes=1024 --since=30m",
+            "previous proxy-0 proxy 1 --limit-bytes=1024"])
+        ret = subprocess.run(
+            [sys.executable, "logplan.py", "--since", "yesterday"],
+            input="{}", stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, timeout=60)
+        self.assertEqual(ret.returncode, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
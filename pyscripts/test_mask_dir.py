@@ -0,0 +1,108 @@
+#!/usr/bin/python
+
+import unittest
+import os
+import tempfile
+import shutil
+import yaml
+from unittest import mock
+import mask
+from mask import mask_dir
+
+# sample directories used to build the tree to mask
+SAMPLE_DIRS = ["tests/samples", "tests/samples_plaintext"]
+
+
+class TestMaskDir(unittest.TestCase):
+    """
+    The class that implements basic tests for the
+    directory masking (serial and worker-pool modes).
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory for test files
+        """
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _copy_samples(self, name):
+        """
+        Copy all the sample directories in a fresh tree
+        and return its path.
+        """
+        dest = os.path.join(self.temp_dir, name)
+        for d in SAMPLE_DIRS:
+            shutil.copytree(d, os.path.join(dest, os.path.basename(d)))
+        return dest
+
+    def _read_tree(self, path):
+        """
+        Return a dict of relative path -> content for the
+        given tree.
+        """
+        tree = {}
+        for root, subdirs, files in os.walk(path):
+            for f in files:
+                full = os.path.join(root, f)
+                with open(full, 'rb') as fh:
+                    tree[os.path.relpath(full, path)] = fh.read()
+        return tree
+
+    def test_parallel_matches_serial(self):
+        """
+        Masking a tree with a worker pool produces the
+        same bytes as the serial path.
+        """
+        serial = self._copy_samples("serial")
+        parallel = self._copy_samples("parallel")
+
+        mask_dir(serial, dump_conf=True, jobs=1)
+        mask_dir(parallel, dump_conf=True, jobs=4)
+
+        expected = self._read_tree(serial)
+        actual = self._read_tree(parallel)
+        self.assertEqual(sorted(expected), sorted(actual))
+        for path, content in expected.items():
+            self.assertEqual(content, actual[path],
+                             f"File {path} differs from the serial run")
+
+    @unittest.skipUnless(yaml.__with_libyaml__, "libyaml not available")
+    def test_libyaml_matches_pure_python(self):
+        """
+        The libyaml loader/dumpers and the pure-Python fallback
+        produce the same masked files.
+        """
+        clib = self._copy_samples("clib")
+        pure = self._copy_samples("pure")
+
+        mask_dir(clib, dump_conf=True)
+        with mock.patch.object(mask, 'SafeLoader', yaml.SafeLoader), \
+                mock.patch.object(mask, 'SafeDumper', yaml.SafeDumper), \
+                mock.patch.object(mask, 'Dumper', yaml.Dumper):
+            mask_dir(pure, dump_conf=True)
+
+        self.assertEqual(self._read_tree(pure), self._read_tree(clib))
+
+    def test_non_yaml_files_untouched(self):
+        """
+        Files that are not YAML are not processed.
+        """
+        tree = self._copy_samples("tree")
+        readme = os.path.join(tree, "samples", "README.md")
+        with open(readme, 'rb') as f:
+            before = f.read()
+
+        mask_dir(tree, jobs=2)
+
+        with open(readme, 'rb') as f:
+            self.assertEqual(before, f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+
+import unittest
+import os
+import json
+import tempfile
+import shutil
+from unittest import mock
+import mask
+from mask import MaskManifest, mask_dir
+
+# sample directory used to build the tree to mask
+SAMPLE_DIR = "tests/samples_plaintext"
+
+
+class TestMaskManifest(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    MaskManifest and its use in mask_dir.
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory for test files
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.tree = os.path.join(self.temp_dir, "namespaces")
+        shutil.copytree(SAMPLE_DIR, self.tree)
+        self.manifest_path = os.path.join(self.temp_dir, "manifest.jsonl")
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _mask(self, dump_conf=False):
+        """
+        Mask the tree recording the files in the manifest, and
+        return the list of files that have been processed.
+        """
+        with mock.patch.object(mask, 'mask_resource',
+                               wraps=mask.mask_resource) as m:
+            mask_dir(self.tree, dump_conf, jobs=1,
+                     manifest=MaskManifest(self.manifest_path))
+        return sorted(os.path.basename(c.args[0]) for c in m.call_args_list)
+
+    def test_second_pass_skips_files(self):
+        """
+        Files masked by a previous pass are skipped.
+        """
+        first = self._mask()
+        self.assertGreater(len(first), 0)
+        with open(self.manifest_path, 'r') as f:
+            files = [json.loads(line)["path"] for line in f]
+        self.assertEqual(len(files), len(first))
+        self.assertEqual(self._mask(), [])
+
+    def test_modified_file_masked_again(self):
+        """
+        Files changed after the previous pass are masked again.
+        """
+        self._mask()
+        path = os.path.join(self.tree, "configmap1.yaml")
+        with open(path, 'a') as f:
+            f.write("# new content\n")
+        self.assertEqual(self._mask(), ["configmap1.yaml"])
+
+    def test_rewritten_file_masked_again(self):
+        """
+        Files rewritten after the previous pass are masked again,
+        even with the same size.
+        """
+        self._mask()
+        path = os.path.join(self.tree, "configmap1.yaml")
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertEqual(self._mask(), ["configmap1.yaml"])
+
+    def test_dump_conf_masked_again(self):
+        """
+        Files masked without dumping the config files are
+        processed again when --dump-conf is requested.
+        """
+        first = self._mask()
+        self.assertEqual(self._mask(dump_conf=True), first)
+        self.assertEqual(self._mask(dump_conf=True), [])
+        self.assertEqual(self._mask(), [])
+
+    def test_version_change_masks_again(self):
+        """
+        Files masked with a different version of the rules are
+        processed again.
+        """
+        first = self._mask()
+        with mock.patch.object(mask, 'MASK_VERSION', 'other'):
+            self.assertEqual(self._mask(), first)
+
+    def test_corrupted_manifest(self):
+        """
+        A corrupted manifest is ignored.
+        """
+        with open(self.manifest_path, 'w') as f:
+            f.write("{not json")
+        self.assertGreater(len(self._mask()), 0)
+        self.assertEqual(self._mask(), [])
+
+    def test_latest_entry_wins(self):
+        """
+        Entries appended by later runs replace the earlier ones.
+        """
+        self._mask()
+        self._mask(dump_conf=True)
+        manifest = MaskManifest(self.manifest_path)
+        self.assertTrue(all(e["dump_conf"] for e in manifest.entries.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
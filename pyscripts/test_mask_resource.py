@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+import unittest
+import os
+import tempfile
+import shutil
+from mask import mask_resource, needs_masking
+
+# resource without any sensitive keyword, with formatting
+# that would be lost if the file was parsed and dumped again
+CLEAN_RESOURCE = """# dumped by oc
+apiVersion: v1
+kind: ConfigMap
+metadata: {name: clean, namespace: openstack}
+data:
+  config: |
+    [DEFAULT]
+    debug = true
+"""
+
+# resource containing a sensitive keyword that is not
+# associated with any value to mask
+KEYWORD_RESOURCE = """# dumped by oc
+apiVersion: v1
+kind: ConfigMap
+metadata: {name: keyword, namespace: openstack}
+data:
+  note: the password is rotated every day
+"""
+
+SENSITIVE_RESOURCE = """apiVersion: v1
+kind: ConfigMap
+metadata: {name: sensitive, namespace: openstack}
+data:
+  config: |
+    [DEFAULT]
+    password = foo
+"""
+
+
+class TestMaskResource(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    mask_resource.
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory for test files
+        """
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _write(self, name, content):
+        """
+        Create a test file and return its path
+        """
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def _read(self, path):
+        """
+        utility function to read a file.
+        """
+        with open(path, 'r') as f:
+            return f.read()
+
+    def test_needs_masking(self):
+        """
+        Only resources with a sensitive keyword, or secrets,
+        need to be parsed.
+        """
+        self.assertFalse(needs_masking(CLEAN_RESOURCE))
+        self.assertTrue(needs_masking(KEYWORD_RESOURCE))
+        self.assertTrue(needs_masking(SENSITIVE_RESOURCE))
+        self.assertTrue(needs_masking("kind: Secret\ndata: {a: Zm9v}\n"))
+        self.assertTrue(needs_masking("data:\n  x: 'PASSWORD=foo'\n"))
+        self.assertFalse(needs_masking("kind: SecretStore\n"))
+
+    def test_clean_file_untouched(self):
+        """
+        Files without any sensitive keyword are not rewritten.
+        """
+        path = self._write("clean.yaml", CLEAN_RESOURCE)
+        self.assertTrue(mask_resource(path))
+        self.assertEqual(self._read(path), CLEAN_RESOURCE)
+
+    def test_unchanged_file_not_written(self):
+        """
+        Files parsed without anything to mask are not rewritten.
+        """
+        path = self._write("keyword.yaml", KEYWORD_RESOURCE)
+        self.assertTrue(mask_resource(path))
+        self.assertEqual(self._read(path), KEYWORD_RESOURCE)
+
+    def test_unchanged_secret_not_written(self):
+        """
+        Secrets without anything to mask are decoded, but
+        not rewritten.
+        """
+        path = os.path.join(self.temp_dir, "nochange.yaml")
+        shutil.copy("tests/samples/nochange.yaml", path)
+        original = self._read(path)
+        self.assertTrue(mask_resource(path))
+        self.assertEqual(self._read(path), original)
+
+    def test_sensitive_file_masked(self):
+        """
+        Files with sensitive data are still masked.
+        """
+        path = self._write("sensitive.yaml", SENSITIVE_RESOURCE)
+        self.assertTrue(mask_resource(path))
+        content = self._read(path)
+        self.assertNotIn("password = foo", content)
+        self.assertIn("password = **********", content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+
+import unittest
+import json
+import os
+import tempfile
+import shutil
+import mask
+from mask import STATS_PHASES, enable_stats, mask_dir
+from cmaps import split_lists
+
+# sample directories used to build the tree to mask
+SAMPLE_DIRS = ["tests/samples", "tests/samples_plaintext"]
+SAMPLE_LIST = "tests/samples_plaintext/configmaps.yaml"
+
+
+class TestMaskStats(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the masking statistics (--stats).
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory for test files
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        mask.STATS = None
+
+    def tearDown(self):
+        """
+        Clean up temporary directory and disable the statistics
+        """
+        shutil.rmtree(self.temp_dir)
+        mask.STATS = None
+
+    def _copy_samples(self, name):
+        """
+        Copy all the sample directories in a fresh tree
+        and return its path.
+        """
+        dest = os.path.join(self.temp_dir, name)
+        for d in SAMPLE_DIRS:
+            shutil.copytree(d, os.path.join(dest, os.path.basename(d)))
+        return dest
+
+    def _mask_dir(self, jobs):
+        """
+        Mask a fresh tree collecting the statistics and return
+        the report.
+        """
+        mask.STATS = None
+        stats = enable_stats(slowest=3)
+        mask_dir(self._copy_samples(f"jobs{jobs}"), True, jobs=jobs)
+        path = os.path.join(self.temp_dir, f"stats{jobs}.json")
+        stats.save(path)
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def test_report(self):
+        """
+        The report contains the per-file and aggregated phases,
+        bytes and matches.
+        """
+        report = self._mask_dir(1)
+        files = report["files"]
+        self.assertEqual(report["file_count"], len(files))
+        self.assertGreater(len(files), 0)
+        self.assertLessEqual(set(report["total"]["phases"]),
+                             set(STATS_PHASES))
+        for phase in ("read", "parse", "decode", "regex", "dump", "write"):
+            self.assertIn(phase, report["total"]["phases"])
+        self.assertGreater(report["total"]["matches"]["gen_regex"], 0)
+        self.assertEqual(report["total"]["bytes"]["read"],
+                         sum(f["bytes"].get("read", 0) for f in files))
+        # phases are exclusive, their sum can't exceed the file time
+        for f in files:
+            self.assertLessEqual(sum(f["phases"].values()),
+                                 f["seconds"] + 1e-6)
+        self.assertEqual(len(report["slowest"]), 3)
+        self.assertEqual(report["slowest"][0]["seconds"],
+                         max(f["seconds"] for f in files))
+
+    def test_parallel_report(self):
+        """
+        Statistics collected by the worker processes are reported
+        once, as in the serial run.
+        """
+        serial = self._mask_dir(1)
+        parallel = self._mask_dir(3)
+        self.assertEqual(parallel["file_count"], serial["file_count"])
+        self.assertEqual(parallel["total"]["matches"],
+                         serial["total"]["matches"])
+        self.assertEqual(parallel["total"]["bytes"],
+                         serial["total"]["bytes"])
+
+    def test_split_report(self):
+        """
+        Splitting a List reports its parsing and each of the
+        written items.
+        """
+        stats = enable_stats()
+        out = os.path.join(self.temp_dir, "configmaps")
+        self.assertTrue(split_lists([(SAMPLE_LIST, out)], 2,
+                                    apply_mask=True))
+        report = stats.report()
+        paths = [f["path"] for f in report["files"]]
+        self.assertEqual(len(paths), 4)
+        self.assertIn(SAMPLE_LIST, paths)
+        self.assertIn("parse", report["total"]["phases"])
+        self.assertIn("write", report["total"]["phases"])
+
+    def test_disabled(self):
+        """
+        No statistics are collected by default.
+        """
+        mask_dir(self._copy_samples("tree"), True)
+        self.assertIsNone(mask.STATS)
+
+
+if __name__ == '__main__':
+    unittest.main()
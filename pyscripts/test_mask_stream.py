@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+import unittest
+import io
+import os
+import tempfile
+import shutil
+from mask import MaskManifest, mask_resource, mask_stream
+
+# resource without any sensitive keyword, with formatting
+# that would be lost if it was parsed and dumped again
+CLEAN_RESOURCE = """# dumped by oc
+apiVersion: v1
+kind: ConfigMap
+metadata: {name: clean, namespace: openstack}
+"""
+
+MULTI_DOC = """apiVersion: v1
+kind: ConfigMap
+metadata: {name: first}
+data:
+  config: |
+    password = foo
+---
+apiVersion: v1
+kind: ConfigMap
+metadata: {name: second}
+data:
+  config: |
+    debug = true
+"""
+
+
+class TestMaskStream(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the stdin filter mode (mask_stream).
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory for test files
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.out = os.path.join(self.temp_dir, "out.yaml")
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _read(self, path):
+        """
+        utility function to read a file.
+        """
+        with open(path, 'r') as f:
+            return f.read()
+
+    def test_secret_matches_file_mode(self):
+        """
+        A secret masked from a stream produces the same files
+        as the masking of the collected file.
+        """
+        for name in ("secret1.yaml", "secret2.yaml", "nochange.yaml"):
+            sample = os.path.join("tests/samples", name)
+            path = os.path.join(self.temp_dir, name)
+            shutil.copy(sample, path)
+            self.assertTrue(mask_resource(path, True))
+            expected = self._read(path)
+
+            with open(sample, 'r') as f:
+                self.assertTrue(mask_stream(f, self.out, True))
+            self.assertEqual(self._read(self.out), expected)
+            # the dumped config files are generated as well
+            conf = [f for f in os.listdir(self.temp_dir)
+                    if f.startswith(f"{name}-")]
+            for c in conf:
+                self.assertEqual(
+                    self._read(os.path.join(self.temp_dir, c)),
+                    self._read(os.path.join(self.temp_dir,
+                                            c.replace(name, "out.yaml"))))
+
+    def test_clean_stream_copied(self):
+        """
+        Content without anything to mask is written as is.
+        """
+        self.assertTrue(mask_stream(io.StringIO(CLEAN_RESOURCE), self.out))
+        self.assertEqual(self._read(self.out), CLEAN_RESOURCE)
+
+    def test_multi_document(self):
+        """
+        All the documents of the stream are masked.
+        """
+        self.assertTrue(mask_stream(io.StringIO(MULTI_DOC), self.out))
+        content = self._read(self.out)
+        self.assertNotIn("password = foo", content)
+        self.assertIn("password = **********", content)
+        self.assertIn("debug = true", content)
+        self.assertEqual(content.count("---\n"), 1)
+
+    def test_invalid_yaml_not_written(self):
+        """
+        Nothing is written when the stream can't be parsed.
+        """
+        stream = io.StringIO("password: [foo\n")
+        self.assertFalse(mask_stream(stream, self.out))
+        self.assertFalse(os.path.exists(self.out))
+
+    def test_empty_input_not_written(self):
+        """
+        Nothing is written when the stream is empty.
+        """
+        self.assertFalse(mask_stream(io.StringIO(""), self.out))
+        self.assertFalse(os.path.exists(self.out))
+
+    def test_manifest_recorded(self):
+        """
+        The masked file is recorded in the manifest.
+        """
+        manifest_path = os.path.join(self.temp_dir, "manifest.jsonl")
+        self.assertTrue(mask_stream(io.StringIO(MULTI_DOC), self.out,
+                                    manifest=MaskManifest(manifest_path)))
+        self.assertIn(self.out, MaskManifest(manifest_path).entries)
+
+
+if __name__ == '__main__':
+    unittest.main()
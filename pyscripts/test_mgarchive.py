@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+import unittest
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import shutil
+from mgarchive import Archive, catalog_path, create
+
+SECRET = """apiVersion: v1
+kind: Secret
+metadata:
+  name: nova-config
+  namespace: openstack
+"""
+
+
+class TestIndexedArchive(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the indexed archives and their catalog.
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory with a must-gather tree
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.temp_dir, "must-gather")
+        logs = os.path.join(self.source, "namespaces", "openstack", "pods",
+                            "nova-api-0", "logs")
+        os.makedirs(logs)
+        self.log = os.path.join(logs, "nova-api.log")
+        with open(self.log, 'w') as f:
+            for i in range(20000):
+                f.write(f"{i} INFO nova.api request {i % 97}\n")
+            f.write("ERROR nova.api failed\n")
+        with gzip.open(os.path.join(logs, "nova-api-previous.log.gz"),
+                       'wt') as f:
+            f.write("ERROR nova.api crashed\n")
+        secrets = os.path.join(self.source, "namespaces", "openstack",
+                               "secrets", "nova")
+        os.makedirs(secrets)
+        with open(os.path.join(secrets, "nova-config.yaml"), 'w') as f:
+            f.write(SECRET)
+        os.makedirs(os.path.join(secrets, "..", "glance"))
+        os.link(os.path.join(secrets, "nova-config.yaml"),
+                os.path.join(secrets, "..", "glance", "nova-config.yaml"))
+        with open(os.path.join(self.source, ".mask_manifest.jsonl"), 'w') as f:
+            f.write("{}\n")
+        self.archive = os.path.join(self.temp_dir, "must-gather.tar.xz")
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _create(self, jobs=1):
+        """
+        utility function to archive the tree in small blocks, returning
+        the catalog entries by path.
+        """
+        create(self.archive, self.source, jobs, [".mask_manifest.jsonl"],
+               block_size=64 << 10)
+        with open(catalog_path(self.archive), 'r') as f:
+            return {e["path"]: e for e in map(json.loads, f)}
+
+    def test_catalog(self):
+        """
+        The members are listed with their kind, namespace and position,
+        the hardlinks are stored once.
+        """
+        entries = self._create()
+        self.assertEqual(catalog_path(self.archive),
+                         os.path.join(self.temp_dir,
+                                      "must-gather.catalog.jsonl"))
+        log = entries["must-gather/namespaces/openstack/pods/nova-api-0/logs/"
+                      "nova-api.log"]
+        self.assertEqual((log["kind"], log["namespace"], log["size"]),
+                         ("log", "openstack", os.path.getsize(self.log)))
+        self.assertLess(log["csize"], log["size"])
+        secret = entries["must-gather/namespaces/openstack/secrets/glance/"
+                         "nova-config.yaml"]
+        self.assertEqual(secret["kind"], "Secret")
+        link = entries["must-gather/namespaces/openstack/secrets/nova/"
+                       "nova-config.yaml"]
+        self.assertEqual((link["type"], link["target"]),
+                         ("link", secret["path"]))
+        self.assertNotIn("must-gather/.mask_manifest.jsonl", entries)
+
+    def test_tar_compatible(self):
+        """
+        The archive can be read as a tar.xz file.
+        """
+        self._create(jobs=2)
+        with tarfile.open(self.archive, 'r:xz') as tar:
+            names = tar.getnames()
+            member = tar.extractfile("must-gather/namespaces/openstack/"
+                                     "secrets/nova/nova-config.yaml")
+            self.assertEqual(member.read().decode(), SECRET)
+        self.assertIn("must-gather/namespaces/openstack/pods/nova-api-0/"
+                      "logs/nova-api-previous.log.gz", names)
+
+    def test_read_member(self):
+        """
+        Single members are read through the catalog, the gzip ones
+        are decompressed when their lines are read.
+        """
+        self._create()
+        archive = Archive(self.archive)
+        try:
+            [log] = archive.select(["*/nova-api.log"])
+            with open(self.log, 'rb') as f:
+                self.assertEqual(b"".join(archive.read(log)), f.read())
+            [secret] = archive.select(["namespaces/*/nova/*"])
+            self.assertEqual(b"".join(archive.read(secret)).decode(), SECRET)
+            [previous] = archive.select(kind="log", patterns=["*.gz"])
+            self.assertEqual(list(archive.lines(previous)),
+                             [b"ERROR nova.api crashed"])
+            self.assertEqual(len(archive.select(namespace="openstack")), 4)
+        finally:
+            archive.close()
+
+    def test_commands(self):
+        """
+        grep prints the matching lines of the selected members, extract
+        writes them after checking their hash.
+        """
+        self._create()
+
+        def run(*args):
+            return subprocess.run([sys.executable, "mgarchive.py"]
+                                  + list(args), stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE,
+                                  universal_newlines=True, timeout=60)
+
+        ret = run("grep", self.archive, "^ERROR", "-m", "*.log*")
+        self.assertEqual(ret.returncode, 0, ret.stderr)
+        self.assertEqual(ret.stdout.splitlines(), [
+            "must-gather/namespaces/openstack/pods/nova-api-0/logs/"
+            "nova-api-previous.log.gz:1:ERROR nova.api crashed",
+            "must-gather/namespaces/openstack/pods/nova-api-0/logs/"
+            "nova-api.log:20001:ERROR nova.api failed"])
+        out = os.path.join(self.temp_dir, "out")
+        ret = run("extract", "-C", out, self.archive, "*/secrets/*")
+        self.assertEqual(ret.returncode, 0, ret.stderr)
+        self.assertEqual(sorted(os.listdir(os.path.join(
+            out, "must-gather", "namespaces", "openstack", "secrets"))),
+            ["glance", "nova"])
+        self.assertEqual(run("cat", self.archive, "missing").returncode, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+
+import unittest
+import os
+import subprocess
+import sys
+import tempfile
+import shutil
+from osbatch import execute, parse_batch
+
+# stands for the openstack command, printing its arguments
+OPENSTACK = """#!/bin/sh
+case "$*" in
+    "zone list -f value -c id") printf 'z1\\nz2\\n' ;;
+    *fail*) echo "failed: $*" >&2; exit 1 ;;
+    *hang*) sleep 30 ;;
+    *) echo "$*" ;;
+esac
+"""
+
+# stands for oc, running the driver locally and openstack for rsh
+OC = """#!/bin/sh
+shift 2
+case "$1" in
+    exec) [ -e "$NO_DRIVER" ] && exit 1; shift 5; exec "$PYTHON" "$@" ;;
+    rsh) shift 2; exec "$@" ;;
+esac
+"""
+
+
+class TestOsBatch(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the batches of openstack commands.
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory with the fake commands
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.bin = os.path.join(self.temp_dir, "bin")
+        os.makedirs(self.bin)
+        for name, script in [("openstack", OPENSTACK), ("oc", OC)]:
+            with open(os.path.join(self.bin, name), 'w') as f:
+                f.write(script)
+            os.chmod(os.path.join(self.bin, name), 0o755)
+        self.out = os.path.join(self.temp_dir, "ctlplane")
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _run(self, batch, **env):
+        """
+        utility function to run a batch with the fake commands.
+        """
+        environ = dict(os.environ, PYTHON=sys.executable,
+                       PATH=self.bin + os.pathsep + os.environ["PATH"], **env)
+        return subprocess.run(
+            [sys.executable, "osbatch.py", "--timeout", "2", "-"],
+            input=batch, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, timeout=60, env=environ)
+
+    def _read(self, name):
+        """
+        utility function to return the content of an output.
+        """
+        with open(os.path.join(self.out, name), 'r') as f:
+            return f.read()
+
+    def test_execute(self):
+        """
+        The commands are expanded for each line of their each command,
+        which is run once.
+        """
+        batch = parse_batch([
+            ">\tnova/service_list\tcompute service list\n",
+            ">\tplacement/candidates\t-c resource\\ provider -c traits\n",
+            ">>\tdesignate/recordset_list\trecordset list {}\t"
+            "zone list -f value -c id\n",
+            ">\tdesignate/zone_share_list\tzone share list {}\t"
+            "zone list -f value -c id\n"])
+        self.assertEqual(batch[1]["args"],
+                         ["-c", "resource provider", "-c", "traits"])
+        calls = []
+
+        def run(args):
+            calls.append(args)
+            if args[:2] == ["zone", "list"]:
+                return 0, "z1\nz2\n", ""
+            return int(args[-1] == "z2"), f"{args[-1]}\n", ""
+
+        cache = {}
+        self.assertEqual(execute(batch[0], run, cache),
+                         (0, "list\n", ""))
+        self.assertEqual(execute(batch[2], run, cache),
+                         (1, "z1\nz2\n", ""))
+        execute(batch[3], run, cache)
+        self.assertEqual(calls.count(["zone", "list", "-f", "value", "-c",
+                                      "id"]), 1)
+        self.assertIn(["zone", "share", "list", "z2"], calls)
+        with self.assertRaises(ValueError):
+            parse_batch(["<\tfile\tservice list\n"])
+
+    def test_batch(self):
+        """
+        The outputs are written to their files, the failures and the
+        commands timed out are reported.
+        """
+        batch = "".join([
+            f">\t{self.out}/nova/service_list\tcompute service list\n",
+            f">\t{self.out}/nova/hang\tserver hang\n",
+            f">\t{self.out}/cinder/service_list\tvolume fail\n",
+            f">\t{self.out}/designate/recordset_list\trecordset list {{}}\t"
+            "zone list -f value -c id\n"])
+        ret = self._run(batch)
+        self.assertEqual(ret.returncode, 1)
+        self.assertIn("Ran 4 openstack commands", ret.stdout)
+        self.assertIn("2 failed", ret.stdout)
+        self.assertEqual(self._read("nova/service_list"),
+                         "compute service list\n")
+        self.assertEqual(self._read("designate/recordset_list"),
+                         "recordset list z1\nrecordset list z2\n")
+        self.assertIn("openstack volume fail: exit 1\nfailed: volume fail",
+                      ret.stderr)
+        self.assertIn("openstack server hang: exit 124\ntimed out after 2s",
+                      ret.stderr)
+        self.assertNotIn("one by one", ret.stderr)
+
+    def test_fallback(self):
+        """
+        The commands are run one by one when the driver can't be run.
+        """
+        path = os.path.join(self.out, "neutron", "port_list")
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write("previous\n")
+        ret = self._run(f">>\t{path}\tport list\n", NO_DRIVER=self.bin)
+        self.assertEqual(ret.returncode, 0, ret.stderr)
+        self.assertIn("Running 1 openstack commands one by one", ret.stderr)
+        self.assertEqual(self._read("neutron/port_list"),
+                         "previous\nport list\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+
+import unittest
+import json
+import os
+import subprocess
+import tempfile
+import shutil
+from trace_report import chrome_trace, critical_path, load_trace, summarize
+
+BG_SH = os.path.abspath("../collection-scripts/bg.sh")
+
+# a phase launching two tasks, the second one waiting for a free slot,
+# followed by a phase waiting for them
+TRACE = [
+    {"type": "phase", "name": "gather_crs", "phase": "", "start": 100.0,
+     "end": 101.0, "status": 0},
+    {"type": "task", "name": "oc get a", "phase": "gather_crs",
+     "start": 100.2, "end": 103.0, "status": 0, "bytes": 10},
+    {"type": "task", "name": "oc get b", "phase": "gather_crs",
+     "start": 100.5, "end": 102.0, "status": 1, "bytes": None},
+    {"type": "task", "name": "oc get c", "phase": "gather_crs",
+     "start": 102.0, "end": 105.0, "status": 0, "bytes": 30},
+    {"type": "phase", "name": "wait_bg", "phase": "", "start": 101.0,
+     "end": 105.1, "status": 0},
+]
+
+
+class TestTraceReport(unittest.TestCase):
+    """
+    The class that implements basic tests for
+    the analysis of the gather traces.
+    """
+
+    def setUp(self):
+        """
+        Set up temporary directory for test files
+        """
+        self.temp_dir = tempfile.mkdtemp()
+        self.trace = os.path.join(self.temp_dir, "trace.jsonl")
+
+    def tearDown(self):
+        """
+        Clean up temporary directory
+        """
+        shutil.rmtree(self.temp_dir)
+
+    def _write(self, records, extra=""):
+        """
+        utility function to write a trace file.
+        """
+        with open(self.trace, 'w') as f:
+            for rec in records:
+                f.write(json.dumps(rec) + "\n")
+            f.write(extra)
+
+    def test_load_skips_invalid(self):
+        """
+        Truncated lines are skipped and records are sorted.
+        """
+        self._write(reversed(TRACE), '{"type": "task", "name": "trunc')
+        records = load_trace(self.trace)
+        self.assertEqual(len(records), len(TRACE))
+        self.assertEqual(records[0]["name"], "gather_crs")
+
+    def test_summary(self):
+        """
+        The summary reports the wall clock, the slowest tasks,
+        the failures and the tasks of each phase.
+        """
+        self._write(TRACE)
+        summary = summarize(load_trace(self.trace), top=2)
+        self.assertAlmostEqual(summary["wall"], 5.1)
+        self.assertEqual([t["name"] for t in summary["tasks"]],
+                         ["oc get c", "oc get a"])
+        self.assertEqual([t["name"] for t in summary["failed"]],
+                         ["oc get b"])
+        agg = summary["by_phase"]["gather_crs"]
+        self.assertEqual(agg["tasks"], 3)
+        self.assertEqual(agg["bytes"], 40)
+        self.assertAlmostEqual(agg["seconds"], 7.3)
+
+    def test_critical_path(self):
+        """
+        The critical path follows the task that freed the slot
+        used by the last task.
+        """
+        self._write(TRACE)
+        path = critical_path(load_trace(self.trace))
+        self.assertEqual([r["name"] for r, _ in path],
+                         ["oc get b", "oc get c", "wait_bg"])
+
+    def test_chrome_trace(self):
+        """
+        Concurrent tasks are spread on different tracks, and
+        times are in microseconds from the start of the run.
+        """
+        self._write(TRACE)
+        events = [e for e in chrome_trace(load_trace(self.trace))
+                  ["traceEvents"] if e["ph"] == "X"]
+        tids = {e["name"]: e["tid"] for e in events}
+        self.assertEqual(tids["gather_crs"], 0)
+        self.assertNotEqual(tids["oc get a"], tids["oc get b"])
+        self.assertEqual(tids["oc get b"], tids["oc get c"])
+        first = events[0]
+        self.assertEqual((first["ts"], first["dur"]), (0, 1000000))
+
+    def test_bg_trace(self):
+        """
+        run_bg and trace_phase record the tasks, their output
+        and exit status.
+        """
+        out = os.path.join(self.temp_dir, "out.txt")
+        script = (f'source "{BG_SH}"\n'
+                  f'trace_phase test run_bg echo \'"a \\"b\\""\' ">" "{out}"\n'
+                  'run_bg false\n'
+                  'wait_bg\n')
+        subprocess.run(["bash", "-c", script], check=True,
+                       env=dict(os.environ, TRACE_FILE=self.trace))
+        records = load_trace(self.trace)
+        tasks = {r["name"]: r for r in records if r["type"] == "task"}
+        self.assertEqual(len(records), 3)
+        echo = tasks[f'echo "a \\"b\\"" > {out}']
+        self.assertEqual((echo["status"], echo["phase"]), (0, "test"))
+        self.assertEqual(echo["bytes"], len('a "b"\n'))
+        self.assertEqual(tasks["false"]["status"], 1)
+        self.assertEqual(tasks["false"]["phase"], "")
+
+
+if __name__ == '__main__':
+    unittest.main()
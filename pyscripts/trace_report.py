@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+"""
+Analyze the trace recorded by a must-gather run (TRACE_FILE, see bg.sh):
+print the wall clock time, the slowest phases and background tasks, the
+failed tasks and the critical path of the run, and optionally convert the
+trace to the Chrome trace event format, which can be loaded in Perfetto
+(https://ui.perfetto.dev) or chrome://tracing.
+"""
+
+import argparse
+import json
+import sys
+
+DEFAULT_TOP = 10
+# tolerance when matching the end of a record with the start of the next one
+EPSILON = 0.001
+
+
+def load_trace(path):
+    """
+    Return the records of a trace, sorted by start time. Lines that can't
+    be parsed (e.g. truncated by an interrupted run) are skipped.
+    """
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+                rec["start"] = float(rec["start"])
+                rec["end"] = float(rec["end"])
+            except (ValueError, TypeError, KeyError):
+                continue
+            rec.setdefault("type", "task")
+            rec.setdefault("phase", "")
+            records.append(rec)
+    records.sort(key=lambda r: (r["start"], r["end"]))
+    return records
+
+
+def duration(rec):
+    return rec["end"] - rec["start"]
+
+
+def predecessor(records, current):
+    """
+    Return the record current was waiting for: for a phase that waited for
+    background tasks (e.g. wait_bg), the last task that ended while it ran;
+    otherwise the record that ended last before it started, either a task
+    holding a CONCURRENCY slot or the phase that ran before it.
+    """
+    def latest(recs):
+        return max(recs, key=lambda r: r["end"], default=None)
+
+    if current["type"] == "phase":
+        waited = latest(r for r in records if r["type"] == "task"
+                        and current["start"] < r["end"] <= current["end"])
+        if waited is not None:
+            return waited
+    return latest(r for r in records
+                  if r["end"] <= current["start"] + EPSILON
+                  and r is not current)
+
+
+def critical_path(records):
+    """
+    Return the chain of records that determined the duration of the run,
+    from the first to the last one, as a list of (record, gap) where gap
+    is the time elapsed between the end of the previous record and the
+    start of this one. It's built walking back from the record that ends
+    last, from each record to the one it was waiting for.
+    """
+    if not records:
+        return []
+    current = max(records, key=lambda r: r["end"])
+    path = []
+    visited = set()
+    while current is not None and id(current) not in visited:
+        visited.add(id(current))
+        prev = predecessor(records, current)
+        gap = current["start"] - prev["end"] if prev else 0.0
+        path.append((current, max(gap, 0.0)))
+        current = prev
+    path.reverse()
+    return path
+
+
+def summarize(records, top=DEFAULT_TOP):
+    """
+    Return a summary of the trace as a dict.
+    """
+    if not records:
+        return {"wall": 0.0, "phases": [], "tasks": [], "failed": [],
+                "by_phase": {}, "critical_path": []}
+    origin = min(r["start"] for r in records)
+    phases = [r for r in records if r["type"] == "phase"]
+    tasks = [r for r in records if r["type"] == "task"]
+
+    def entry(rec):
+        return {"name": rec["name"], "phase": rec["phase"],
+                "start": round(rec["start"] - origin, 3),
+                "seconds": round(duration(rec), 3),
+                "status": rec.get("status"), "bytes": rec.get("bytes")}
+
+    by_phase = {}
+    for rec in tasks:
+        agg = by_phase.setdefault(rec["phase"] or "-", {
+            "tasks": 0, "seconds": 0.0, "bytes": 0, "end": 0.0})
+        agg["tasks"] += 1
+        agg["seconds"] += duration(rec)
+        agg["bytes"] += rec.get("bytes") or 0
+        agg["end"] = max(agg["end"], rec["end"] - origin)
+    for agg in by_phase.values():
+        agg["seconds"] = round(agg["seconds"], 3)
+        agg["end"] = round(agg["end"], 3)
+
+    def slowest(recs):
+        return [entry(r) for r in
+                sorted(recs, key=duration, reverse=True)[:top]]
+
+    path = []
+    for rec, gap in critical_path(records):
+        e = entry(rec)
+        e["type"] = rec["type"]
+        e["gap"] = round(gap, 3)
+        path.append(e)
+
+    return {
+        "wall": round(max(r["end"] for r in records) - origin, 3),
+        "phases": slowest(phases),
+        "tasks": slowest(tasks),
+        "failed": [entry(r) for r in tasks if r.get("status") not in (0, None)],
+        "by_phase": by_phase,
+        "critical_path": path,
+    }
+
+
+def chrome_trace(records):
+    """
+    Convert the trace to the Chrome trace event format: the phases are on
+    the first track and the background tasks are spread on as many tracks
+    as they needed to run concurrently.
+    """
+    origin = min((r["start"] for r in records), default=0.0)
+    events = [{"ph": "M", "pid": 1, "tid": 0, "name": "thread_name",
+               "args": {"name": "phases"}}]
+    lanes = []
+    for rec in records:
+        if rec["type"] == "phase":
+            tid = 0
+        else:
+            for i, end in enumerate(lanes):
+                if end <= rec["start"]:
+                    break
+            else:
+                i = len(lanes)
+                lanes.append(0.0)
+                events.append({"ph": "M", "pid": 1, "tid": i + 1,
+                               "name": "thread_name",
+                               "args": {"name": f"task slot {i + 1}"}})
+            lanes[i] = rec["end"]
+            tid = i + 1
+        args = {k: rec[k] for k in ("phase", "status", "bytes", "output",
+                                    "pid") if rec.get(k) not in (None, "")}
+        events.append({
+            "ph": "X", "pid": 1, "tid": tid, "cat": rec["type"],
+            "name": rec["name"],
+            "ts": round((rec["start"] - origin) * 1e6),
+            "dur": round(duration(rec) * 1e6),
+            "args": args,
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def print_summary(summary):
+    """
+    Print a summary of the trace in a human readable form.
+    """
+    def row(e):
+        return f"  {e['seconds']:9.3f}s  @{e['start']:9.3f}s  {e['name']}"
+
+    print(f"Wall clock: {summary['wall']:.3f}s")
+    print("Slowest phases:")
+    for e in summary["phases"]:
+        print(row(e))
+    print("Slowest tasks:")
+    for e in summary["tasks"]:
+        print(row(e) + (f"  [{e['phase']}]" if e["phase"] else ""))
+    if summary["failed"]:
+        print("Failed tasks:")
+        for e in summary["failed"]:
+            print(f"  exit {e['status']}: {e['name']}")
+    print("Tasks by phase (count, busy time, bytes, last end):")
+    for name, agg in sorted(summary["by_phase"].items(),
+                            key=lambda i: i[1]["seconds"], reverse=True):
+        print(f"  {agg['tasks']:5d} {agg['seconds']:10.3f}s "
+              f"{agg['bytes']:12d} @{agg['end']:9.3f}s  {name}")
+    print("Critical path (duration, wait before it):")
+    for e in summary["critical_path"]:
+        print(f"  {e['seconds']:9.3f}s  +{e['gap']:.3f}s  "
+              f"{e['type']}: {e['name']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('trace', help='Trace file (trace.jsonl)')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP,
+                        help='Number of slowest phases and tasks to report '
+                        f'(default: {DEFAULT_TOP})')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the summary as JSON')
+    parser.add_argument('--chrome', metavar='OUTPUT',
+                        help='Write the trace in the Chrome trace event '
+                        'format (Perfetto) to this file')
+    args = parser.parse_args()
+
+    try:
+        records = load_trace(args.trace)
+    except OSError as e:
+        print(f"Error reading {args.trace}: {e}")
+        sys.exit(1)
+
+    summary = summarize(records, args.top)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+    if args.chrome:
+        with open(args.chrome, 'w') as f:
+            json.dump(chrome_trace(records), f)
+
+
+if __name__ == '__main__':
+    main()